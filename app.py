@@ -1,10 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, Response, g, abort, has_request_context
+from werkzeug.local import LocalProxy
 import os
 import random
 import uuid
 import time
-from PIL import Image, ImageDraw, ImageFont # Import Pillow modules
+import hashlib
+import threading
+import functools
+import heapq
+import math
+import itertools
+import contextvars
+import string
+import json
+import logging
+import asyncio
+import signal
+import types
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from PIL import Image, ImageDraw # Import Pillow modules
 import io # To handle image data in memory
+import click
+from flask.cli import AppGroup
+import poster_pipeline
+import poster_catalog
+import poster_layout
+import metrics
+import event_log
+import highlight_reel
+from render_service import RenderService, in_worker_process
+import text_layout
+from text_layout import load_font, layout_text, fit_text
+from state_store import create_state_store, StaleStateError, RoomNotFoundError
+from roster import Roster
+from records import Caption, Round, intern_id
+
+_app_load_started = time.perf_counter() # For startup_timing; benchmarks/bench_startup.py times the whole process
 
 app = Flask(__name__)
 # !!! IMPORTANT: Change this secret key for production !!!
@@ -13,7 +46,15 @@ app.config['SECRET_KEY'] = 'a_very_secret_key_replace_me_in_prod'
 # --- Configuration ---
 WRITING_TIME_SECONDS = 60
 VOTING_TIME_SECONDS = 60
-WAIT_PAGE_REFRESH_SECONDS = 1
+WAIT_PAGE_REFRESH_SECONDS = 1 # Only used by clients without JavaScript; everyone else gets pushed events
+ROOM_CODE_LENGTH = 4
+ROOM_CODE_ALPHABET = ''.join(c for c in string.ascii_uppercase if c not in 'IO') # No I/O, too close to 1/0
+ROOM_IDLE_TIMEOUT_SECONDS = 2 * 60 * 60 # Rooms whose state hasn't changed for this long are removed
+ROOM_GC_INTERVAL_SECONDS = 5 * 60
+EVENT_STREAM_KEEPALIVE_SECONDS = 15 # Comment line sent on idle /events streams so proxies don't drop them
+EVENT_STREAM_RETRY_MILLISECONDS = 2000 # How soon EventSource reconnects after losing the stream
+EVENT_STREAM_MAX_SECONDS = 25 # Streams end after this (the browser reconnects), inside gunicorn's 30 s worker timeout
+EVENT_STREAM_POLL_RETRY_MILLISECONDS = 1000 # Reconnect delay on single-threaded workers, where /events answers at once
 
 # --- Font and Rendering Configuration (Percentage-based, adjust values 0-100) ---
 # Paths are relative to app root's static folder
@@ -24,6 +65,7 @@ BODY_FONT_PATH = 'static/fonts/body.ttf'
 TITLE_TOP_PERCENT = 10         # Top edge starts 10% down from image top
 TITLE_WIDTH_PERCENT = 75       # Bounding box is 75% of image width (Adjust as needed)
 TITLE_FONT_SIZE_PERCENT_OF_HEIGHT = 8 # Font size is 8% of image height (Adjust as needed)
+TITLE_LINE_HEIGHT_MULTIPLIER = 1.2 # Vertical space between title lines = font size * multiplier
 
 # Text 2 (Body) - Percentages of actual image dimensions
 BODY_TOP_PERCENT = 80          # Top edge starts 80% down from image top (Adjust as needed)
@@ -31,20 +73,380 @@ BODY_WIDTH_PERCENT = 80        # Bounding box is 80% of image width (Adjust as n
 BODY_FONT_SIZE_PERCENT_OF_HEIGHT = 3  # Font size is 3% of image height (Adjust as needed)
 BODY_LINE_HEIGHT_MULTIPLIER = 1.2 # Vertical space between lines = font size * multiplier (Adjust as needed)
 
+# Fit-to-box: captions too long for their area (title: down to where the body starts; body:
+# down to the bottom of the poster) get the largest smaller font that fits, down to these minimums
+CAPTION_AUTO_FIT = True
+TITLE_MIN_FONT_SIZE_PERCENT_OF_HEIGHT = 4
+BODY_MIN_FONT_SIZE_PERCENT_OF_HEIGHT = 1.5
+
+# Text color: the inverse of the background's average color over the lines' area (from the
+# poster layout index, see poster_layout.py), with an outline on busy backgrounds
+TEXT_OUTLINE_WIDTH_PERCENT_OF_FONT = 4 # Outline thickness as a percentage of the font size (at least 1px)
+
+# Everything above that changes how a caption looks. Part of the render cache key, so editing
+# any of these values naturally invalidates previously cached images.
+RENDER_CONFIG = (
+    TITLE_FONT_PATH, BODY_FONT_PATH,
+    TITLE_TOP_PERCENT, TITLE_WIDTH_PERCENT, TITLE_FONT_SIZE_PERCENT_OF_HEIGHT, TITLE_LINE_HEIGHT_MULTIPLIER,
+    BODY_TOP_PERCENT, BODY_WIDTH_PERCENT, BODY_FONT_SIZE_PERCENT_OF_HEIGHT, BODY_LINE_HEIGHT_MULTIPLIER,
+    CAPTION_AUTO_FIT, TITLE_MIN_FONT_SIZE_PERCENT_OF_HEIGHT, BODY_MIN_FONT_SIZE_PERCENT_OF_HEIGHT,
+    text_layout.WRAP_WIDTH_FRACTION, TEXT_OUTLINE_WIDTH_PERCENT_OF_FONT,
+    poster_layout.ANALYSIS_BANDS, poster_layout.ANALYSIS_ROWS_PER_BAND, poster_layout.MIN_TEXT_CONTRAST, poster_layout.BUSY_LUMA_STDDEV,
+)
+RENDER_BUDGET_MS = 250 # Renders slower than this (layout + drawing, before encoding) are counted in the stats
+CAPTION_PREVIEW_MAX_CHARS = 200 # /caption_fit ignores anything longer (the writing form allows far less)
+
+# --- Render Cache Configuration ---
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Total size of encoded images kept in memory
+RENDERED_CAPTION_MAX_AGE_SECONDS = 3600 # Browser cache lifetime for a versioned /rendered_caption URL
+RENDER_PENDING_RETRY_SECONDS = 1 # Retry-After sent while a caption is still being rendered
+POSTER_CACHE_MAX_BYTES = 48 * 1024 * 1024 # Decoded posters kept in memory (a 1920x2496 RGB poster is ~14 MB)
+
+# --- Render Service (see render_service.py) ---
+# Worker processes rendering captions, per server process; 0 renders on threads of the server process
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', os.cpu_count() or 2))
+RENDER_QUEUE_MAX_JOBS = 256 # Renders waiting for a worker; past this, lower-priority jobs are dropped or new ones refused
+RENDER_JOB_TIMEOUT_SECONDS = 15 # A render still running after this has its worker process killed and replaced
+RENDER_QUEUE_FULL_RETRY_SECONDS = 5 # Retry-After sent when the render queue refuses a job
+RENDER_PROCESS_NICENESS = 5 # Render processes yield the CPU to request handling
+# Render job priorities, lower runs first
+RENDER_PRIORITY_REQUESTED = 0 # A player is waiting for this image right now
+RENDER_PRIORITY_VOTING = 1 # Overlay layers for the round's voting page
+RENDER_PRIORITY_RESULTS = 2 # Full caption images, shown on the results page
+RENDER_PRIORITY_PREFETCH = 3 # Decoding the next round's poster; captions at the extra prerender widths
+RENDER_PRIORITY_EXPORT = 4 # Anything outside the current round
+RENDER_PRIORITY_CATALOG = 5 # Poster placeholders missing from the catalog
+
+# --- Highlight Reel (see highlight_reel.py) ---
+HIGHLIGHT_REEL_WIDTH = 1440 # Poster derivative width the exported captions are drawn on
+HIGHLIGHT_REEL_ENCODING = 'jpeg' # Opens in every image viewer and photo app
+HIGHLIGHT_REEL_RENDER_WINDOW = 2 * max(1, RENDER_PROCESSES) # Images rendering ahead of the download; bounds its memory
+HIGHLIGHT_REEL_RENDER_WAIT_SECONDS = 60 # An image not rendered by then is left out of the archive
+
+# --- Poster Derivatives (built by `flask posters build`, see poster_pipeline.py) ---
+POSTER_MANIFEST_PATH = 'build/posters/manifest.json' # Relative to static/
+POSTER_CATALOG_PATH = 'build/posters/catalog.json' # Path, dimensions, size and hash of every poster, relative to static/
+POSTER_CATALOG_CHECK_INTERVAL_SECONDS = 30 # How often static/posters is rescanned for added, replaced or removed posters
+POSTER_LAYOUT_INDEX_PATH = 'build/posters/layout.json' # Caption region colors per poster, relative to static/
+POSTER_LAYOUT_CACHE_SIZE = 64 # Layouts kept per process for posters the index doesn't cover (analyzed on demand)
+POSTER_DERIVATIVE_WIDTHS = (480, 960, 1440) # Widths (px) to produce; originals are ~1920px wide
+POSTER_DERIVATIVE_QUALITY = 82 # WebP/JPEG quality for derivatives
+CAPTION_PRERENDER_WIDTHS = (480, 960) # Widths captions are pre-rendered at: 350 CSS px caption boxes at 1x and 2x, snapped up to a derivative
+CAPTION_RENDER_DEFAULT_WIDTH = CAPTION_PRERENDER_WIDTHS[0] # Width captions are rendered at when the client's width isn't known yet
+
+# --- Caption Image Encodings ---
+# Served encodings, in order of preference. /rendered_caption picks the first one the client's
+# Accept header allows; PNG is the fallback for clients that don't say. Quality settings are
+# part of the render cache key, so changing them never serves stale bytes.
+CAPTION_ENCODINGS = {
+    'webp': {'mimetype': 'image/webp', 'format': 'WEBP', 'save_options': {'quality': 80, 'method': 4}},
+    'jpeg': {'mimetype': 'image/jpeg', 'format': 'JPEG', 'save_options': {'quality': 85, 'optimize': True, 'progressive': True}},
+    'png': {'mimetype': 'image/png', 'format': 'PNG', 'save_options': {'optimize': True}},
+}
+CAPTION_ENCODING_PREFERENCE = ('webp', 'jpeg', 'png')
+CAPTION_FALLBACK_ENCODING = 'png'
+
+# --- Caption Overlays ---
+# 'overlay': the voting page shows the round's poster (one shared, cacheable image) with each
+# caption's title and body as small transparent images on top, so a caption costs only its
+# text area to render, encode and download. 'composite': every caption is a full poster
+# image. Results pages always use full composites.
+CAPTION_DELIVERY_MODE = 'overlay'
+CAPTION_LAYER_PADDING_PERCENT_OF_FONT = 15 # Room around a text layer's lines for glyph overhang
+OVERLAY_ENCODINGS = { # Need an alpha channel, so no JPEG
+    'webp': {'mimetype': 'image/webp', 'format': 'WEBP', 'save_options': {'lossless': True, 'method': 1, 'quality': 50}}, # Near method 4's size, 4x faster
+    'png': {'mimetype': 'image/png', 'format': 'PNG', 'save_options': {'optimize': True}},
+}
+OVERLAY_ENCODING_PREFERENCE = ('webp', 'png')
+
+
+# --- Logging and Metrics ---
+# LOG_LEVEL=DEBUG adds per-request and per-render detail; RENDER_LOG_LEVEL overrides the level
+# for the renderer alone (e.g. LOG_LEVEL=DEBUG RENDER_LOG_LEVEL=WARNING).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
+render_log = logging.getLogger(__name__ + '.render')
+if os.environ.get('RENDER_LOG_LEVEL'):
+    render_log.setLevel(os.environ['RENDER_LOG_LEVEL'].upper())
+
+metrics_registry = metrics.Registry()
+http_requests = metrics_registry.counter('http_requests_total', 'Requests handled, by route and status.', ('method', 'route', 'status'))
+http_request_seconds = metrics_registry.histogram('http_request_duration_seconds', 'Time to produce a response, by route.', ('method', 'route'))
+render_stage_seconds = metrics_registry.histogram('caption_render_stage_seconds',
+                                                  'Caption render time by stage: poster (decode or cache copy), layout, draw, encode.', ('stage',))
+renders_over_budget = metrics_registry.counter('caption_renders_over_budget_total', f'Renders slower than RENDER_BUDGET_MS ({RENDER_BUDGET_MS} ms) before encoding.')
+encoded_bytes = metrics_registry.counter('caption_encoded_bytes_total', 'Bytes of caption images encoded, by encoding.', ('encoding',))
+phase_transitions = metrics_registry.counter('game_phase_transitions_total', 'Game state changes, e.g. writing -> voting.', ('from_state', 'to_state'))
+state_commit_retries = metrics_registry.counter('game_state_commit_retries_total', 'Transactions rerun because another worker changed the room first.')
+
 
 # --- Game State ---
-game_state = {
-    'players': {},
-    'state': 'lobby',
-    'current_round': 0,
-    'current_poster': None, # Path relative to static/
-    'captions': {}, # {session_id: {'text1': 'Caption 1 Text', 'text2': 'Caption 2 Text'}}
-    'votes': {},
-    'all_posters': [],
-    'posters_used': [],
-    'winning_caption_id': None,
-    'phase_end_time': None
-}
+
+def new_game_state():
+    """Fresh state for one room's game."""
+    return {
+        'players': Roster(), # {session_id: player data}, plus who still has to submit/vote and this round's votes
+        'state': 'lobby',
+        'current_round': 0,
+        'current_poster': None, # Path relative to static/
+        'captions': {}, # {session_id: Caption}
+        'rounds': [], # Round records for this game's finished rounds
+        'posters_used': [],
+        'next_poster': None, # Picked one round ahead so its image can be decoded in the background
+        'winning_caption_id': None,
+        'phase_end_time': None
+    }
+
+# Poster paths relative to static/, shared by every room. Filled in from the poster catalog at startup.
+all_posters = []
+
+# --- Rooms ---
+
+# Where room state lives. 'memory' keeps it in this process (run a single worker); 'journal'
+# does too, but also logs every change to disk so games survive a restart and finished rounds
+# are kept (see event_log.py); 'sqlite' shares it between every worker on the machine, e.g.
+# `GAME_STATE_BACKEND=sqlite gunicorn -w 4 app:app`.
+GAME_STATE_BACKEND = os.environ.get('GAME_STATE_BACKEND', 'memory')
+GAME_STATE_SQLITE_PATH = os.environ.get('GAME_STATE_SQLITE_PATH', os.path.join(app.instance_path, 'game_state.sqlite3'))
+GAME_STATE_JOURNAL_DIR = os.environ.get('GAME_STATE_JOURNAL_DIR', os.path.join(app.instance_path, 'game_journal'))
+STATE_COMMIT_ATTEMPTS = 5 # Retries when another request/worker changed the room first
+STATE_SYNC_INTERVAL_SECONDS = 1 # How often open /events streams look for other workers' writes (shared backends only)
+
+# Render processes import this module for its renderer only; they must not replay or write the journal
+state_store = create_state_store('memory' if in_worker_process() else GAME_STATE_BACKEND,
+                                 GAME_STATE_SQLITE_PATH, GAME_STATE_JOURNAL_DIR)
+
+class Room:
+    """Per-process machinery for one game table (event stream, lock, sync bookkeeping).
+
+    The game state itself lives in state_store, so every worker process can serve the room.
+    """
+    __slots__ = ('code', 'events', 'lock', 'synced_version', 'last_sync', '__weakref__')
+
+    def __init__(self, code):
+        self.code = code
+        self.events = GameEventBroker()
+        self.lock = threading.RLock() # Held for the whole of every transaction on this room in this process
+        self.synced_version = None # Store version last published to local /events streams
+        self.last_sync = 0.0
+
+    def run(self, func, *args, on_retry=None):
+        """Calls func inside a state transaction for this room and returns its result.
+
+        game_state refers to a private copy of the room's state while func runs; changes are
+        committed with a compare-and-set afterwards. Within this process, transactions on one
+        room are serialized by self.lock, so threads (threaded workers, the scheduler) never
+        see each other's half-finished updates: two "last" submitters can't both trigger the
+        phase change, and votes can't be tallied twice. The compare-and-set covers other
+        worker processes: if one of them committed first, func is run again on fresh state
+        (on_retry() is called before each rerun). Side effects registered with after_commit()
+        run once the commit succeeded, after the lock is released. The reasons passed to
+        notify_state_change() label the commit in the journal.
+        Raises RoomNotFoundError if the room no longer exists.
+        """
+        for attempt in range(STATE_COMMIT_ATTEMPTS):
+            if attempt and on_retry:
+                on_retry()
+            effects, events = [], []
+            room_token = _active_room.set(self)
+            try:
+                with self.lock, state_store.transaction(self.code, events) as state:
+                    state_token = _active_state.set(state)
+                    effects_token = _pending_effects.set(effects)
+                    events_token = _pending_events.set(events)
+                    phase_before = state.get('state')
+                    try:
+                        result = func(*args)
+                    finally:
+                        _pending_events.reset(events_token)
+                        _pending_effects.reset(effects_token)
+                        _active_state.reset(state_token)
+                    phase_after = state.get('state')
+            except StaleStateError:
+                log.debug("Room %s changed concurrently, retrying (attempt %d).", self.code, attempt + 1)
+                state_commit_retries.inc()
+                continue
+            finally:
+                _active_room.reset(room_token)
+            if phase_after != phase_before:
+                phase_transitions.inc(from_state=phase_before, to_state=phase_after)
+            for effect in effects:
+                effect()
+            return result
+        raise StaleStateError(self.code)
+
+    def read(self, func, *args):
+        """Calls func with game_state bound to the room's stored state, for reading only.
+
+        Nothing is copied or committed and self.lock isn't taken, so polls and image requests
+        don't queue behind the room's transactions. The state is a read-only mapping, but the
+        roster and other values in it are the stored objects: func must not change them.
+        Effects registered with after_commit() run when func returns.
+        Raises RoomNotFoundError if the room no longer exists.
+        """
+        _, state = state_store.peek(self.code)
+        effects = []
+        room_token = _active_room.set(self)
+        state_token = _active_state.set(types.MappingProxyType(state))
+        effects_token = _pending_effects.set(effects)
+        try:
+            result = func(*args)
+        finally:
+            _pending_effects.reset(effects_token)
+            _active_state.reset(state_token)
+            _active_room.reset(room_token)
+        for effect in effects:
+            effect()
+        return result
+
+    def sync_events(self):
+        """Publishes a fresh snapshot if the stored state changed since this process last did,
+        e.g. because a request was handled by another worker. Throttled to one check per interval."""
+        now = time.time()
+        if now - self.last_sync < STATE_SYNC_INTERVAL_SECONDS:
+            return
+        self.last_sync = now
+        version = state_store.version(self.code)
+        if version is not None and version != self.synced_version:
+            self.synced_version = version
+            self.run(notify_state_change, 'synced')
+
+
+class RoomRegistry:
+    """All rooms, keyed by their short join code. Room objects are created on demand for codes
+    that exist in the state store, since another worker may have created them."""
+
+    def __init__(self, store):
+        self.store = store
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        while True:
+            code = ''.join(random.choice(ROOM_CODE_ALPHABET) for _ in range(ROOM_CODE_LENGTH))
+            if self.store.create(code, new_game_state()):
+                break
+        log.info("Created room %s. %d rooms open.", code, self.store.count())
+        return self._local_room(code)
+
+    def get(self, code):
+        code = (code or '').upper()
+        room = self._rooms.get(code)
+        if room is None and self.store.exists(code):
+            room = self._local_room(code)
+        return room
+
+    def forget(self, code):
+        """Drops this process's objects for a room that was removed from the store."""
+        with self._lock:
+            room = self._rooms.pop(code, None)
+        if room is not None:
+            phase_scheduler.cancel((code, 'phase_deadline'))
+            room.events.close() # Ends any /events streams still attached
+
+    def _local_room(self, code):
+        with self._lock:
+            return self._rooms.setdefault(code, Room(code))
+
+    def __len__(self):
+        return self.store.count()
+
+    def collect_idle(self, max_idle_seconds):
+        """Removes rooms whose state hasn't changed for max_idle_seconds. Returns how many."""
+        idle = self.store.delete_idle(time.time() - max_idle_seconds)
+        for code in idle:
+            self.forget(code)
+        if idle:
+            log.info("Removed %d idle rooms. %d rooms open.", len(idle), self.store.count())
+        return len(idle)
+
+
+rooms = RoomRegistry(state_store)
+
+# The room and state being operated on, set by Room.run() for both requests and scheduler jobs
+_active_room = contextvars.ContextVar('active_room', default=None)
+_active_state = contextvars.ContextVar('active_state', default=None)
+_pending_effects = contextvars.ContextVar('pending_effects', default=None)
+_pending_events = contextvars.ContextVar('pending_events', default=None)
+
+def current_room():
+    """The room the current request (or scheduler job) is operating on."""
+    room = _active_room.get()
+    if room is None and has_request_context():
+        room = g.get('room')
+    if room is None:
+        raise RuntimeError("No active room: game state used outside a room route or Room.run()")
+    return room
+
+def current_game_state():
+    state = _active_state.get()
+    if state is None:
+        raise RuntimeError("No active game state: use it inside a room route or Room.run()")
+    return state
+
+# Everything below keeps using game_state as before; it resolves to the current room's state
+game_state = LocalProxy(current_game_state)
+
+def after_commit(effect):
+    """Runs effect() once the current state transaction has committed (immediately if there's
+    none). Used for anything that must not happen twice when a transaction is retried."""
+    effects = _pending_effects.get()
+    if effects is None:
+        effect()
+    else:
+        effects.append(effect)
+
+def room_route(rule, read_only=False, **options):
+    """Registers a view under /room/<room_code>/... The code is resolved to g.room before the
+    view runs, the view runs inside a state transaction (see Room.run), and url_for() fills
+    the code in automatically while handling a room request.
+
+    read_only views (polls, images) only look at the state and run through Room.read instead:
+    no copy, no lock, no commit. One that finds it must write can call g.room.run() itself.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def transactional_view(*args, **kwargs):
+            flashes_before = list(session.get('_flashes', []))
+            def discard_attempt():
+                session['_flashes'] = list(flashes_before) # Don't repeat flash() from the failed attempt
+            try:
+                if read_only:
+                    return g.room.read(lambda: view(*args, **kwargs))
+                return g.room.run(lambda: view(*args, **kwargs), on_retry=discard_attempt)
+            except RoomNotFoundError:
+                rooms.forget(g.room.code) # Removed by another worker
+                abort(404)
+            except StaleStateError:
+                abort(503)
+        return app.route('/room/<room_code>' + rule, **options)(transactional_view)
+    return decorator
+
+@app.url_value_preprocessor
+def load_room_from_url(endpoint, values):
+    if values and 'room_code' in values:
+        room = rooms.get(values.pop('room_code'))
+        if room is None:
+            abort(404)
+        g.room = room
+
+@app.url_defaults
+def add_room_code_to_urls(endpoint, values):
+    if 'room_code' not in values and 'room' in g and app.url_map.is_endpoint_expecting(endpoint, 'room_code'):
+        values['room_code'] = g.room.code
+
+def collect_idle_rooms():
+    """Periodic scheduler job removing abandoned rooms."""
+    rooms.collect_idle(ROOM_IDLE_TIMEOUT_SECONDS)
+    schedule_room_gc()
+
+def schedule_room_gc():
+    phase_scheduler.schedule(ROOM_GC_JOB, time.time() + ROOM_GC_INTERVAL_SECONDS, collect_idle_rooms)
+
+@app.context_processor
+def inject_room():
+    return {'room_code': g.room.code if 'room' in g else None, 'all_posters': all_posters}
 
 # --- Helper Functions ---
 
@@ -53,77 +455,304 @@ def get_player_id():
     if 'player_id' not in session:
         session['player_id'] = str(uuid.uuid4())
         # print(f"Generated new session ID: {session['player_id']}") # Keep commented
-    return session['player_id']
+    player_id = session['player_id']
+    # One shared string per player however many places in the room's state hold it
+    state = _active_state.get()
+    return state['players'].canonical_id(player_id) if state is not None else intern_id(player_id)
 
 def get_current_player():
     """Returns the player data for the current session from game_state, or None."""
     player_id = get_player_id()
     return game_state['players'].get(player_id)
 
-def load_all_posters():
-    """Loads poster paths from the static directory."""
+# --- Poster Catalog ---
+
+_poster_catalog = {'posters': {}, 'scanned_at': None, 'scan_ms': None, 'reloads': 0,
+                   'placeholder_jobs': set()} # Keys of placeholder jobs queued or running
+_poster_catalog_lock = threading.Lock()
+startup_timing = {'catalog_ms': None, 'first_request_ms': None} # Milliseconds since app.py's imports finished
+
+def get_poster_catalog():
+    """Returns {poster_path: {'width', 'height', 'bytes', 'mtime_ns', 'sha256'[, 'placeholder']}} for every poster."""
+    return _poster_catalog['posters']
+
+def refresh_poster_catalog(reason='startup'):
+    """Rescans static/posters and swaps in the result (see poster_catalog.refresh_catalog).
+
+    At startup the scan starts from the persisted index, so unchanged posters aren't read;
+    afterwards it starts from the catalog in memory. The index is rewritten when anything
+    changed. Returns True if posters were added, replaced or removed.
+    """
     if not app.static_folder:
-         print("Warning: app.static_folder is not set or not available.")
-         return []
+        log.warning("app.static_folder is not set or not available.")
+        return False
+    index_path = os.path.join(app.static_folder, POSTER_CATALOG_PATH)
+    with _poster_catalog_lock:
+        started = time.perf_counter()
+        previous = _poster_catalog['posters'] if _poster_catalog['scanned_at'] else (poster_catalog.load_catalog(index_path) or {})
+        try:
+            posters, summary = poster_catalog.refresh_catalog(app.static_folder, previous, log=log.warning)
+        except OSError as e:
+            log.warning("Can't scan the posters directory: %s", e)
+            return False
+        changed = bool(summary['read'] or summary['removed'])
+        if changed or not os.path.exists(index_path):
+            try:
+                poster_catalog.save_catalog(index_path, posters)
+            except OSError as e:
+                log.warning("Couldn't save the poster catalog to %s: %s", index_path, e)
+        _poster_catalog['posters'] = posters
+        all_posters[:] = sorted(posters) # In place: rooms and templates hold on to this list
+        _poster_catalog['scan_ms'] = (time.perf_counter() - started) * 1000
+        _poster_catalog['scanned_at'] = time.time()
+        if reason != 'startup':
+            _poster_catalog['reloads'] += 1
+    if reason == 'startup' or changed:
+        log.info("Poster catalog (%s): %d posters, %d read, %d unchanged, %d removed in %.0f ms.", reason,
+                 len(posters), summary['read'], summary['reused'], summary['removed'], _poster_catalog['scan_ms'])
+    if not posters:
+        log.warning("No posters found in %s.", os.path.join(app.static_folder, poster_catalog.POSTER_DIR))
+    return changed
+
+def check_poster_catalog():
+    """Periodic scheduler job picking up poster files that changed on disk."""
+    refresh_poster_catalog('file change')
+    queue_missing_placeholders()
+    schedule_poster_catalog_check()
+
+def queue_missing_placeholders():
+    """Has the render processes make the placeholders the catalog lacks (see poster_catalog.make_placeholder).
+
+    Jobs the render queue refuses or drops are queued again by the next catalog check.
+    """
+    for poster_path, entry in get_poster_catalog().items():
+        if 'placeholder' in entry:
+            continue
+        key = ('placeholder', poster_path, entry['sha256'])
+        if render_service.submit(key, poster_catalog.make_placeholder, (app.static_folder, poster_path), RENDER_PRIORITY_CATALOG,
+                                 on_done=functools.partial(finish_placeholder, key)):
+            with _poster_catalog_lock:
+                _poster_catalog['placeholder_jobs'].add(key)
+
+def finish_placeholder(key, placeholder):
+    """Merges a finished placeholder job into the catalog, and saves the index once no more are pending."""
+    _, poster_path, sha256 = key
+    with _poster_catalog_lock:
+        _poster_catalog['placeholder_jobs'].discard(key)
+        if placeholder is not None:
+            posters = poster_catalog.add_placeholder(_poster_catalog['posters'], poster_path, sha256, placeholder)
+            if posters is not None:
+                _poster_catalog['posters'] = posters
+        if _poster_catalog['placeholder_jobs']:
+            return
+        index_path = os.path.join(app.static_folder, POSTER_CATALOG_PATH)
+        try:
+            poster_catalog.save_catalog(index_path, _poster_catalog['posters'])
+        except OSError as e:
+            log.warning("Couldn't save the poster catalog to %s: %s", index_path, e)
 
-    poster_dir = os.path.join(app.static_folder, 'posters')
-    # print(f"DEBUG: Looking for posters in directory: {poster_dir}") # Keep commented
-    if not os.path.exists(poster_dir):
-        print(f"DEBUG: Warning: Posters directory not found at {poster_dir}")
-        return []
+def schedule_poster_catalog_check():
+    phase_scheduler.schedule(POSTER_CATALOG_JOB, time.time() + POSTER_CATALOG_CHECK_INTERVAL_SECONDS, check_poster_catalog)
+
+def handle_sighup(signum, frame):
+    # Signal handlers interrupt the main thread, possibly while it holds a lock; rescan on another thread
+    threading.Thread(target=refresh_poster_catalog, args=('SIGHUP',), name='poster-catalog-reload', daemon=True).start()
+
+def install_sighup_handler():
+    """Reloads the poster catalog on SIGHUP, unless a server (e.g. the gunicorn master) already handles it."""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGHUP) == signal.SIG_DFL:
+        signal.signal(signal.SIGHUP, handle_sighup)
+
+# --- Poster Derivatives ---
+
+_poster_manifest = {'mtime': None, 'posters': {}, 'originals': {}, 'sizes': {}} # originals: {derivative path: poster path}
+
+def get_poster_manifest():
+    """Returns {poster_path: manifest entry} from the derivative build, or {} if it hasn't been built.
+
+    Re-read whenever the manifest file changes, so a rebuild takes effect without a restart.
+    """
+    manifest_path = os.path.join(app.static_folder, POSTER_MANIFEST_PATH)
     try:
-        poster_files = [f for f in os.listdir(poster_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))]
-        poster_paths = [f'posters/{f}' for f in poster_files]
-        # print(f"DEBUG: Loaded {len(poster_paths)} poster paths.") # Keep commented
-        return poster_paths
-    except Exception as e:
-        print(f"DEBUG: Error listing directory {poster_dir}: {e}")
+        mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return {}
+    if mtime != _poster_manifest['mtime']:
+        manifest = poster_pipeline.load_manifest(manifest_path)
+        _poster_manifest['posters'] = manifest['posters'] if manifest else {}
+        _poster_manifest['originals'] = {
+            d[fmt]['path']: poster_path
+            for poster_path, entry in _poster_manifest['posters'].items()
+            for d in entry['derivatives'].values() for fmt in poster_pipeline.DERIVATIVE_FORMATS
+        }
+        _poster_manifest['sizes'] = {
+            d[fmt]['path']: (d['width'], d['height'])
+            for entry in _poster_manifest['posters'].values()
+            for d in entry['derivatives'].values() for fmt in poster_pipeline.DERIVATIVE_FORMATS
+        }
+        _poster_manifest['mtime'] = mtime
+    return _poster_manifest['posters']
+
+def poster_original(render_path):
+    """The poster a render source (see poster_render_source) was derived from; originals map to themselves."""
+    get_poster_manifest()
+    return _poster_manifest['originals'].get(render_path, render_path)
+
+def get_poster_derivatives(poster_path):
+    """Derivatives of a poster sorted by width, or [] if none were built."""
+    entry = get_poster_manifest().get(poster_path)
+    if not entry:
         return []
+    return sorted(entry['derivatives'].values(), key=lambda d: d['width'])
+
+def caption_render_width(display_width):
+    """Snaps a client's display width (?w=) to the derivative width its caption renders at:
+    the smallest of POSTER_DERIVATIVE_WIDTHS that covers it, or the largest.
+
+    caption_loader.js snaps the same way, so every client at a width shares one URL and one
+    render cache entry, and those are the ones prerender_round_captions() fills.
+    """
+    if not display_width:
+        return CAPTION_RENDER_DEFAULT_WIDTH
+    return next((w for w in POSTER_DERIVATIVE_WIDTHS if w >= display_width), POSTER_DERIVATIVE_WIDTHS[-1])
+
+def poster_render_source(poster_path, display_width=None):
+    """Static-relative path of the image to render a caption on for a given display width.
+
+    Picks the smallest JPEG derivative at least display_width wide, falling back to the
+    original when no derivative is big enough (or none were built).
+    """
+    if not poster_path:
+        return poster_path
+    display_width = display_width or CAPTION_RENDER_DEFAULT_WIDTH
+    for derivative in get_poster_derivatives(poster_path):
+        if derivative['width'] >= display_width:
+            return derivative['jpeg']['path']
+    return poster_path
+
+@dataclass(frozen=True, slots=True)
+class PosterSource:
+    """The poster image a render job draws on, resolved in the server process: render
+    processes don't load the poster catalog or the derivatives manifest, so jobs carry this."""
+    path: str # Static-relative: the poster, or a derivative of it (see poster_render_source)
+    file_path: str # Absolute path of that file
+    original: str # The poster it was derived from, which keys the poster layout
+    width: int
+    height: int
+
+def poster_source(render_path):
+    """PosterSource for a render source path, for a render job's arguments."""
+    return PosterSource(render_path, os.path.join(app.static_folder, render_path), poster_original(render_path),
+                        *poster_dimensions(render_path))
+
+@app.context_processor
+def inject_poster_helpers():
+    def poster_srcset(poster_path, fmt):
+        """srcset attribute value listing every derivative of poster_path in one format."""
+        return ', '.join(f"{url_for('static', filename=d[fmt]['path'])} {d['width']}w" for d in get_poster_derivatives(poster_path))
+
+    def poster_url(poster_path, display_width=None):
+        """URL of the smallest poster image that still covers display_width."""
+        return url_for('static', filename=poster_render_source(poster_path, display_width))
+
+    def poster_size(poster_path, display_width=None):
+        """(width, height) of the image poster_url() returns, for <img> attributes that size its box before it loads."""
+        return poster_dimensions(poster_render_source(poster_path, display_width))
+
+    def poster_placeholder(poster_path):
+        """The poster's tiny data: URI preview from the catalog, or '' if it hasn't been made yet."""
+        entry = get_poster_catalog().get(poster_path)
+        return entry.get('placeholder', '') if entry else ''
+
+    return {'poster_srcset': poster_srcset, 'poster_url': poster_url, 'poster_size': poster_size,
+            'poster_placeholder': poster_placeholder, 'caption_render_widths': POSTER_DERIVATIVE_WIDTHS}
+
+posters_cli = AppGroup('posters', help='Poster preprocessing commands.')
+
+@posters_cli.command('build')
+@click.option('--jobs', '-j', type=int, default=None, help='Worker processes (default: one per core).')
+@click.option('--force', is_flag=True, help='Rebuild every poster even if it is unchanged.')
+def build_posters_command(jobs, force):
+    """Writes web-sized WebP/JPEG derivatives of every poster plus a manifest, and the caption layout index."""
+    refresh_poster_catalog('build')
+    poster_paths = list(all_posters)
+    if not poster_paths:
+        click.echo("No posters found; nothing to build.")
+        return
+    started = time.time()
+    summary = poster_pipeline.build_derivatives(
+        app.static_folder, poster_paths, os.path.join(app.static_folder, POSTER_MANIFEST_PATH),
+        POSTER_DERIVATIVE_WIDTHS, POSTER_DERIVATIVE_QUALITY, jobs=jobs, force=force, log=click.echo)
+    click.echo(f"Posters: {summary['built']} built, {summary['skipped']} unchanged, {summary['failed']} failed "
+               f"in {time.time() - started:.1f}s.")
+    started = time.time()
+    summary = poster_layout.build_layout_index(
+        app.static_folder, poster_paths, os.path.join(app.static_folder, POSTER_LAYOUT_INDEX_PATH),
+        caption_regions(), jobs=jobs, force=force, log=click.echo)
+    click.echo(f"Layout index: {summary['analyzed']} analyzed, {summary['skipped']} unchanged, {summary['failed']} failed "
+               f"in {time.time() - started:.1f}s.")
+    started = time.time()
+    missing = sum('placeholder' not in entry for entry in get_poster_catalog().values())
+    queue_missing_placeholders()
+    render_service.wait_idle(RENDER_JOB_TIMEOUT_SECONDS * (missing + 1))
+    missing_after = sum('placeholder' not in entry for entry in get_poster_catalog().values())
+    click.echo(f"Placeholders: {missing - missing_after} made, {missing_after} missing in {time.time() - started:.1f}s.")
+
+app.cli.add_command(posters_cli)
 
 def reset_round_state():
     """Clears state for a new round."""
     game_state['current_poster'] = None
     game_state['captions'] = {}
-    game_state['votes'] = {}
     game_state['winning_caption_id'] = None
-    for player_data in game_state['players'].values():
-        player_data['submitted_this_round'] = False
-        player_data['voted_this_round'] = False
+    game_state['players'].start_round()
     game_state['phase_end_time'] = None
 
 def start_new_round():
     """Selects a new poster and sets the state to writing."""
     reset_round_state()
 
-    available_posters = [p for p in game_state['all_posters'] if p not in game_state['posters_used']]
+    available_posters = [p for p in all_posters if p not in game_state['posters_used']]
 
     if not available_posters:
-        if game_state['all_posters']:
+        if all_posters:
             game_state['posters_used'] = [] # Reuse if needed
-            available_posters = game_state['all_posters']
-            print("Warning: All posters used in previous games. Reusing posters.")
+            available_posters = list(all_posters)
+            log.info("All posters used in previous games. Reusing posters.")
         else:
-            print("Error: No posters loaded at all! Cannot start round.")
-            game_state['state'] = 'game_over' # Should not happen if before_request works
+            log.error("No posters loaded at all! Cannot start round.")
+            game_state['state'] = 'game_over' # Should not happen once the poster catalog has loaded
             return False
 
-    selected_poster = random.choice(available_posters)
+    # Use the poster picked (and prefetched) last round if it's still available
+    if game_state.get('next_poster') in available_posters:
+        selected_poster = game_state['next_poster']
+    else:
+        selected_poster = random.choice(available_posters)
     game_state['current_poster'] = selected_poster
     game_state['posters_used'].append(selected_poster)
 
+    # Pick the following round's poster now so both can be decoded before anyone renders
+    remaining_posters = [p for p in available_posters if p != selected_poster]
+    game_state['next_poster'] = random.choice(remaining_posters) if remaining_posters else None
+    for width in CAPTION_PRERENDER_WIDTHS:
+        prefetch_poster(poster_render_source(selected_poster, width))
+        prefetch_poster(poster_render_source(game_state['next_poster'], width))
+
     game_state['current_round'] += 1
     game_state['state'] = 'writing'
     game_state['phase_end_time'] = time.time() + WRITING_TIME_SECONDS # Set timer for writing
-    print(f"Starting Round {game_state['current_round']} with poster: {game_state['current_poster']}. Writing timer set for {WRITING_TIME_SECONDS}s.")
+    log.info("Starting Round %d with poster: %s. Writing timer set for %ds.", game_state['current_round'], game_state['current_poster'], WRITING_TIME_SECONDS)
+    schedule_phase_deadline()
+    notify_state_change('phase_changed')
     return True
 
 def tally_votes():
     """Calculates scores based on votes and determines the winner."""
-    vote_counts = {}
-    for voter_id, voted_for_id in game_state['votes'].items():
-         # Ensure voter is a named player and voted for a caption by a named player
-         if voter_id in get_named_players() and voted_for_id in game_state['captions'] and voted_for_id in get_named_players():
-            vote_counts[voted_for_id] = vote_counts.get(voted_for_id, 0) + 1
+    # Only votes by named players for a named player's caption count; the roster kept count as they came in
+    vote_counts = game_state['players'].award_votes()
 
     winning_caption_id = None
     max_votes = -1
@@ -135,374 +764,962 @@ def tally_votes():
         if potential_winners:
             winning_caption_id = random.choice(potential_winners)
 
-    for author_id, count in vote_counts.items():
-        if author_id in game_state['players']:
-            game_state['players'][author_id]['score'] += count # Each vote is 1 point
-
     game_state['winning_caption_id'] = winning_caption_id
-    winner_name = game_state['players'][winning_caption_id]['name'] if winning_caption_id and winning_caption_id in game_state['players'] else "None"
-    print(f"Votes tallied. Round winner: {winner_name} with {max_votes if winning_caption_id else 0} votes.")
+    # Shares the round's captions and counts; the next round starts with new dicts
+    game_state['rounds'].append(Round(game_state['current_round'], game_state['current_poster'],
+                                      game_state['captions'], vote_counts, winning_caption_id))
+    winner_name = game_state['players'][winning_caption_id].name if winning_caption_id and winning_caption_id in game_state['players'] else "None"
+    log.info("Votes tallied. Round winner: %s with %d votes.", winner_name, max_votes if winning_caption_id else 0)
 
 def get_named_players():
-    """Returns a list of player_ids who have set a name other than the default."""
-    return [p_id for p_id, p_data in game_state['players'].items() if p_data.get('name') and p_data['name'] != 'Unnamed Player']
+    """Returns the set of player_ids who have set a name other than the default."""
+    return game_state['players'].named
 
 def check_all_submitted():
-    """Checks if all named players have submitted BOTH caption texts."""
-    named_player_ids = get_named_players()
-    if not named_player_ids: return False
-    # Check if the caption entry exists and has both text fields populated AND at least one is non-empty
-    players_not_submitted = [p_id for p_id in named_player_ids if not game_state['captions'].get(p_id) or (not game_state['captions'][p_id].get('text1') and not game_state['captions'][p_id].get('text2'))]
-    return len(players_not_submitted) == 0
+    """Checks if all named players have submitted a caption (at least one line)."""
+    return game_state['players'].all_submitted()
 
 
 def check_all_voted():
     """Checks if all named players who *submitted a caption* have voted."""
-    # Only named players who successfully submitted BOTH caption texts (or at least one) are expected to vote.
-    named_players_who_submitted = [p_id for p_id, caption_data in game_state['captions'].items() if p_id in get_named_players() and (caption_data.get('text1') or caption_data.get('text2'))]
-    if not named_players_who_submitted: return True
-
-    voters_needed = [p_id for p_id in named_players_who_submitted if game_state['players'].get(p_id) and not game_state['players'][p_id].get('voted_this_round')]
-    return len(voters_needed) == 0
-
-def check_and_advance_state_if_timer_expired():
-    """Checks if the current phase timer has expired and transitions the state."""
-    current_time = time.time()
-    if game_state['state'] in ['writing', 'voting'] and game_state.get('phase_end_time') is not None and current_time > game_state['phase_end_time']:
-        print(f"Timer expired for state {game_state['state']}. Advancing state...")
-        if game_state['state'] == 'writing':
-            print("Transitioning from writing to voting due to timer.")
-            game_state['state'] = 'voting'
-            game_state['phase_end_time'] = current_time + VOTING_TIME_SECONDS # Start voting timer
-            print(f"Transitioned to voting. Voting timer set for {VOTING_TIME_SECONDS}s.")
-            for player_data in game_state['players'].values():
-                player_data['voted_this_round'] = False # Reset voted status for the new voting phase
-
-        elif game_state['state'] == 'voting':
-            print("Transitioning from voting to round_results due to timer.")
-            game_state['state'] = 'round_results'
-            game_state['phase_end_time'] = None
-            tally_votes() # Tally votes when voting time is up
-
-# --- Image Rendering Function ---
-
-def render_caption_on_image(poster_path, text1, text2):
-    """Renders text1 and text2 onto the poster image dynamically."""
-    full_poster_path = os.path.join(app.static_folder, poster_path)
-    print(f"\n--- RENDER START ---")
-    print(f"RENDER_DEBUG: Attempting to render on poster: {full_poster_path}")
-    print(f"RENDER_DEBUG: Caption Text 1: '{text1}', Text 2: '{text2}'")
-
-    try:
-        img = Image.open(full_poster_path).convert("RGB") # Ensure RGB mode for inversion
-        draw = ImageDraw.Draw(img)
-        img_width, img_height = img.size
-        print(f"RENDER_DEBUG: Opened image. Size: {img_width}x{img_height}, Mode: {img.mode}")
-
-        # --- Dynamic Font Loading and Sizing ---
-        title_font = None
-        body_font = None
-
-        # Calculate dynamic font sizes based on image height percentages
-        title_font_size = int(img_height * (TITLE_FONT_SIZE_PERCENT_OF_HEIGHT / 100))
-        body_font_size = int(img_height * (BODY_FONT_SIZE_PERCENT_OF_HEIGHT / 100))
-
-        # Ensure font size is not zero or negative
-        title_font_size = max(1, title_font_size)
-        body_font_size = max(1, body_font_size)
-
-        print(f"RENDER_DEBUG: Calculated Font Sizes: Title={title_font_size}px, Body={body_font_size}px")
-
-        try:
-            # Construct full paths to fonts within the static folder
-            # Use os.path.join and app.static_folder correctly
-            full_title_font_path = os.path.join(app.static_folder, TITLE_FONT_PATH.replace('static/', ''))
-            full_body_font_path = os.path.join(app.static_folder, BODY_FONT_PATH.replace('static/', ''))
-
-
-            print(f"RENDER_DEBUG: Attempting to load Title Font from: {full_title_font_path}")
-            print(f"RENDER_DEBUG: Attempting to load Body Font from: {full_body_font_path}")
-
-            title_font = ImageFont.truetype(full_title_font_path, title_font_size)
-            body_font = ImageFont.truetype(full_body_font_path, body_font_size)
-            print(f"RENDER_DEBUG: Custom fonts loaded successfully.")
-
-        except IOError as e:
-             print(f"RENDER_DEBUG: Could not load custom font files. Error: {e}. Rendering with default font.")
-             try:
-                 title_font = ImageFont.load_default()
-                 body_font = ImageFont.load_default()
-                 print("RENDER_DEBUG: Default fonts loaded.")
-                 # Note: Default font rendering/measurement is simplified.
-                 # Calculated sizes/positions may not align visually.
-                 # Truncation might be less precise with default font.
-
-             except Exception as e:
-                 print(f"RENDER_DEBUG: Could load default font either: {e}")
-                 return None
-
-        if not title_font or not body_font:
-             print("RENDER_DEBUG: No usable fonts loaded. Rendering failed.")
-             return None
-
-
-        # --- Dynamic Positioning and Text Layout ---
-
-        # Calculate dynamic text box widths based on image width percentages
-        title_box_width = int(img_width * (TITLE_WIDTH_PERCENT / 100))
-        body_box_width = int(img_width * (BODY_WIDTH_PERCENT / 100))
-
-        # Ensure text box widths are positive and not exceeding image width
-        title_box_width = max(1, min(img_width, title_box_width))
-        body_box_width = max(1, min(img_width, body_box_width))
-
-        print(f"RENDER_DEBUG: Calculated Box Widths: Title={title_box_width}px, Body={body_box_width}px")
-
-
-        # Calculate dynamic top positions based on image height percentages
-        title_top_y = int(img_height * (TITLE_TOP_PERCENT / 100))
-        body_top_y = int(img_height * (BODY_TOP_PERCENT / 100))
-
-        # Ensure top positions are not negative
-        title_top_y = max(0, title_top_y)
-        body_top_y = max(0, body_top_y)
-
-        print(f"RENDER_DEBUG: Calculated Top Positions: Title={title_top_y}px, Body={body_top_y}px")
-
-
-        # Calculate horizontal *center* position for drawing the text lines
-        # This is the center of the image width
-        center_x = img_width // 2
-
-
-        # Helper to get line width reliably - Pass estimated_font_size for fallback
-        def get_text_width(txt, fnt, estimated_font_size):
-             if not txt: return 0 # Empty string has 0 width
-             try:
-                 if hasattr(fnt, 'textbbox'):
-                      bbox = fnt.textbbox((0,0), txt)
-                      return bbox[2]
-                 elif hasattr(fnt, 'getsize'): # Deprecated, but fallback
-                      return fnt.getsize(txt)[0]
-             except Exception as e:
-                  # print(f"RENDER_DEBUG: Error measuring text width for '{txt[:20]}...' with font {fnt}: {e}") # Keep commented
-                  pass # Fail gracefully
-             # Fallback estimation if measurement fails
-             # Estimate width based on font size and average character width multiplier (e.g., 0.6)
-             # This helps layout_text_lines make better decisions even if pixel measurement fails
-             # Ensure estimated_font_size is not zero before multiplying
-             if estimated_font_size <= 0:
-                 return int(len(txt) * 10) # Default small estimate if font size is tiny
-
-             return int(len(txt) * estimated_font_size * 0.6) # <-- Added estimation here
-
-
-        # Helper to get line height reliably
-        def get_text_height(txt, fnt, estimated_font_size, line_height_multiplier):
-             if not txt: # Height of an empty line for spacing purposes
-                 try:
-                     if hasattr(fnt, 'getmetrics'):
-                         ascent, descent = fnt.getmetrics()
-                         return int((ascent + descent) * line_height_multiplier)
-                     elif hasattr(fnt, 'textbbox'):
-                         # Try measuring a placeholder character if textbbox exists but text is empty
-                         try: return int(fnt.textbbox((0,0), 'X')[3] * line_height_multiplier)
-                         except: pass
-                 except Exception:
-                     pass
-                 # Ensure estimated_font_size is not zero before multiplying
-                 if estimated_font_size <= 0:
-                      return int(10 * line_height_multiplier) # Default small estimate
-
-                 return int(estimated_font_size * line_height_multiplier)
-
-             try:
-                 if hasattr(fnt, 'textbbox'):
-                      return int(estimated_font_size * line_height_multiplier)
-                 elif hasattr(fnt, 'getsize'): # Deprecated, but fallback
-                      return int(fnt.getsize(txt)[1] * line_height_multiplier)
-             except Exception as e:
-                  print(f"RENDER_DEBUG: Error measuring text height for '{txt[:20]}...' with font {fnt}: {e}")
-             # Fallback estimation
-             # Ensure estimated_font_size is not zero before multiplying
-             if estimated_font_size <= 0:
-                  return int(10 * line_height_multiplier) # Default small estimate
-
-             return int(estimated_font_size * line_height_multiplier)
-
-
-        # Helper for word wrapping + fallback truncation if a single word is too wide
-        # This version does word wrapping first, and if a single word is still too wide, it puts that word on a line
-        # and that single line might visually overflow the box if it's still too long after estimation.
-        def layout_text_lines(text, font, max_width_pixels, estimated_font_size): # Pass estimated_font_size
-            print(f"RENDER_DEBUG: layout_text_lines Input: '{text}', MaxWidth: {max_width_pixels}, EstFontSize: {estimated_font_size}")
-            if not text: return []
-
-            wrapped_lines = []
-            words = text.split()
-            current_line_words = []
-            # Safe max width uses the actual max_width_pixels calculated from percentage
-            # Add a small buffer to the safe width
-            safe_max_width = max_width_pixels * 0.98 # Use 98% of box width for safety margin
-
-
-            for word in words:
-                test_line = ' '.join(current_line_words + [word])
-                line_width_pixels = get_text_width(test_line, font, estimated_font_size)
-                print(f"RENDER_DEBUG:   Testing line '{test_line[:20]}...', Width: {line_width_pixels}, Safe Max: {safe_max_width}")
-
-
-                if line_width_pixels == -1 or line_width_pixels > safe_max_width:
-                    # If measurement failed OR adding the word makes the line too wide
-                    print(f"RENDER_DEBUG:   Line overflow or measurement failed. Current: '{' '.join(current_line_words)}', Next word: '{word}'")
-                    if current_line_words: # If there's content in the current line
-                         wrapped_lines.append(' '.join(current_line_words)) # Finalize the current line
-                         print(f"RENDER_DEBUG:   Wrapped line: '{wrapped_lines[-1]}'")
-                         current_line_words = [word] # Start a new line with the current word
-                         print(f"RENDER_DEBUG:   Starting new line with: '{word}'")
-                    else: # If the *single word itself* is too wide or measurement failed, add it as its own line
-                         # In this version, we allow single words to overflow visually if needed after measurement fallback
-                         # We should still ensure it's not an empty string if the word wasn't empty
-                         if word: # Only add the word if it's not empty
-                             wrapped_lines.append(word)
-                             print(f"RENDER_DEBUG:   Added single word line (might overflow): '{word}'")
-                         current_line_words = [] # Start a new empty line
-                         print(f"RENDER_DEBUG:   Starting new empty line.")
-                else:
-                    current_line_words.append(word) # Add word to current line
-                    # print(f"RENDER_DEBUG:   Added word '{word}' to current line. Current line: '{' '.join(current_line_words)}'") # Keep commented, too verbose
-
-
-            if current_line_words: # Add any remaining words as the last wrapped line
-                wrapped_lines.append(' '.join(current_line_words))
-                print(f"RENDER_DEBUG: Added remaining current line: '{wrapped_lines[-1]}'")
-
-            # Remove any purely empty strings that might have been generated by logic errors or multiple splits
-            final_lines = [line for line in wrapped_lines if line]
-
-            # If the original input text was NOT empty, but the final lines list IS empty,
-            # it indicates a layout/truncation failure resulted in everything being removed.
-            # In this specific case, add at least an empty line to maintain vertical flow.
-            if text and not final_lines:
-                 final_lines = [""]
-                 print("RENDER_DEBUG: Input text was not empty, but layout resulted in empty lines. Adding single empty line.")
-
-
-            print(f"RENDER_DEBUG: layout_text_lines Output (after cleaning empty): {final_lines}")
-            return final_lines
-
-
-        # Split input text by explicit newlines (\n) first, then layout each resulting part
-        text1_safe = text1 if text1 is not None else ''
-        text2_safe = text2 if text2 is not None else ''
-
-        # Process Text 1 (Title) - Apply layout to each line split by \n
-        processed_text1_lines = []
-        for part in text1_safe.upper().split('\n'):
-            processed_text1_lines.extend(layout_text_lines(part, title_font, title_box_width, title_font_size))
-
-        # Process Text 2 (Body) - Apply layout to each line split by \n
-        processed_text2_lines = []
-        for part in text2_safe.upper().split('\n'):
-             processed_text2_lines.extend(layout_text_lines(part, body_font, body_box_width, body_font_size))
-
-
-        print(f"RENDER_DEBUG: Final Processed Text 1 lines (for drawing): {processed_text1_lines}")
-        print(f"RENDER_DEBUG: Final Processed Text 2 lines (for drawing): {processed_text2_lines}")
-
-
-        # --- Draw Text with Inverted Color using Anchor (Color sampled ONCE per block) ---
-
-        # Text 1 (Title)
-        title_inverted_color = (255, 255, 255) # Default to white
-
-        # Sample color under the first *non-empty* processed line if it exists
-        first_title_line = next((line for line in processed_text1_lines if line), None)
-
-        if first_title_line:
-            first_line_height = get_text_height(first_title_line, title_font, title_font_size, 1.2)
-            # Calculate sample point (horizontal center of the image, vertical center of the first line)
-            sample_x = max(0, min(img_width - 1, center_x)) # Sample at horizontal image center
-            sample_y = max(0, min(img_height - 1, title_top_y + first_line_height // 2))
-
-            try:
-                bg_color = img.getpixel((sample_x, sample_y))
-                title_inverted_color = (255 - bg_color[0], 255 - bg_color[1], 255 - bg_color[2])
-            except Exception as e:
-                 print(f"RENDER_DEBUG: Error sampling pixel for T1 at ({sample_x}, {sample_y}): {e}. Defaulting color.")
-                 title_inverted_color = (255, 255, 255)
+    return game_state['players'].all_voted()
+
+def start_voting_phase(current_time):
+    """Moves from writing to voting and starts rendering every caption in the background."""
+    game_state['state'] = 'voting'
+    game_state['phase_end_time'] = current_time + VOTING_TIME_SECONDS # Start voting timer
+    game_state['players'].start_voting() # Reset voted status for the new voting phase
+    schedule_phase_deadline()
+    prerender_round_captions()
+    notify_state_change('phase_changed')
+
+def finish_voting_phase():
+    """Tallies the votes and moves from voting to round_results."""
+    tally_votes()
+    game_state['state'] = 'round_results'
+    game_state['phase_end_time'] = None
+    cancel_phase_deadline()
+    notify_state_change('phase_changed')
 
+def advance_expired_phase(current_time):
+    """Performs the transition for a writing/voting phase whose timer ran out."""
+    log.debug("Timer expired for state %s. Advancing state...", game_state['state'])
+    if game_state['state'] == 'writing':
+        log.info("Transitioning from writing to voting due to timer.")
+        start_voting_phase(current_time)
+        log.debug("Transitioned to voting. Voting timer set for %ds.", VOTING_TIME_SECONDS)
 
-        y_offset = title_top_y
-        for line in processed_text1_lines:
-            # Use actual title_font_size for get_text_height, even for empty lines
-            line_height = get_text_height(line, title_font, title_font_size, 1.2)
+    elif game_state['state'] == 'voting':
+        log.info("Transitioning from voting to round_results due to timer.")
+        finish_voting_phase() # Tally votes when voting time is up
 
-            if not line:
-                 # Even if line is empty, advance y_offset by height of an empty line for spacing
-                 y_offset += line_height
-                 continue
+def phase_timer_expired(current_time):
+    return (game_state['state'] in ['writing', 'voting'] and game_state.get('phase_end_time') is not None
+            and current_time > game_state['phase_end_time'])
 
-            line_center_y = y_offset + line_height // 2
+def check_and_advance_state_if_timer_expired():
+    """Checks if the current phase timer has expired and transitions the state.
 
+    The phase scheduler normally does this right at the deadline; this is the fallback
+    for requests that arrive before it has run.
+    """
+    current_time = time.time()
+    if phase_timer_expired(current_time):
+        advance_expired_phase(current_time)
+
+# --- Phase Scheduler ---
+
+class DeadlineScheduler:
+    """Runs callbacks at wall-clock deadlines on a single background thread.
+
+    Jobs are keyed; scheduling a key again replaces its pending job and cancel() drops it,
+    so a superseded deadline never fires. Callbacks run on the scheduler thread and must do
+    their own locking.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._condition = threading.Condition()
+        self._heap = [] # (deadline, seq, key), may contain superseded entries
+        self._jobs = {} # {key: (deadline, seq, callback)}, the live job per key
+        self._seq = itertools.count()
+        self._thread = None
+
+    def schedule(self, key, deadline, callback):
+        with self._condition:
+            seq = next(self._seq)
+            self._jobs[key] = (deadline, seq, callback)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            self._ensure_thread()
+            self._condition.notify()
+
+    def cancel(self, key):
+        with self._condition:
+            self._jobs.pop(key, None) # Its heap entry is skipped when it comes up
+
+    def pending(self):
+        with self._condition:
+            return len(self._jobs)
+
+    def is_scheduled(self, key):
+        with self._condition:
+            return key in self._jobs
+
+    def _ensure_thread(self):
+        # Started lazily (and restarted if needed) so it also exists in forked server workers
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _next_due_job(self):
+        """Blocks until a live job is due, then removes and returns its callback."""
+        with self._condition:
+            while True:
+                while self._heap:
+                    deadline, seq, key = self._heap[0]
+                    job = self._jobs.get(key)
+                    if job is None or job[1] != seq:
+                        heapq.heappop(self._heap) # Cancelled or superseded
+                        continue
+                    break
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._condition.wait(timeout=delay)
+                    continue # Re-check: an earlier job may have been added meanwhile
+                heapq.heappop(self._heap)
+                del self._jobs[key]
+                return key, job[2]
+
+    def _run(self):
+        while True:
+            key, callback = self._next_due_job()
             try:
-                # print(f"RENDER_DEBUG: Drawing T1 Line '{line}' at CENTER_X={center_x}, CENTER_Y={line_center_y} with color {title_inverted_color}")
-                draw.text((center_x, line_center_y), line, fill=title_inverted_color, font=title_font, anchor='mm')
+                callback()
             except Exception as e:
-                 print(f"RENDER_DEBUG: Error drawing Text 1 line '{line}': {e}")
-
-            y_offset += line_height
-
-
-        # Text 2 (Body)
-        body_inverted_color = (255, 255, 255) # Default to white
-
-        # Sample color under the first *non-empty* truncated line if it exists
-        first_body_line = next((line for line in processed_text2_lines if line), None)
-
-        if first_body_line:
-            first_line_height = get_text_height(first_body_line, body_font, body_font_size, BODY_LINE_HEIGHT_MULTIPLIER)
-            sample_x = max(0, min(img_width - 1, center_x))
-            sample_y = max(0, min(img_height - 1, body_top_y + first_line_height // 2))
-
+                log.exception("Scheduled job %r failed: %s", key, e)
+
+
+phase_scheduler = DeadlineScheduler('phase-scheduler')
+ROOM_GC_JOB = 'room_gc'
+POSTER_CATALOG_JOB = 'poster_catalog'
+
+def schedule_phase_deadline():
+    """Registers the current phase's deadline so it advances on time even if nobody is polling."""
+    room = current_room()
+    expected_state, deadline = game_state['state'], game_state.get('phase_end_time')
+    if deadline is None:
+        cancel_phase_deadline()
+        return
+    after_commit(lambda: phase_scheduler.schedule(
+        (room.code, 'phase_deadline'), deadline, lambda: run_scheduled_room_job(room, advance_phase_at_deadline, expected_state, deadline)))
+
+def cancel_phase_deadline():
+    """Drops the pending deadline, e.g. when everyone finished the phase early."""
+    job_key = (current_room().code, 'phase_deadline')
+    after_commit(lambda: phase_scheduler.cancel(job_key))
+
+def run_scheduled_room_job(room, func, *args):
+    """Runs a scheduler job inside the room's state transaction, unless the room is gone."""
+    try:
+        room.run(func, *args)
+    except RoomNotFoundError:
+        rooms.forget(room.code)
+
+def advance_phase_at_deadline(expected_state, deadline):
+    """Scheduler callback: advances the phase only if it's still the one this deadline was set for."""
+    if game_state['state'] != expected_state or game_state.get('phase_end_time') != deadline:
+        return # Finished early, reset, or already advanced by a request
+    advance_expired_phase(max(time.time(), deadline))
+
+# --- Caches ---
+
+class ByteLRUCache:
+    """Thread-safe in-process LRU cache bounded by the total size of its values.
+
+    sizeof(value) gives the number of bytes a value is charged for. Concurrent misses for
+    the same key are collapsed by get_or_create(), so expensive values (renders, decodes)
+    are only produced once even when many requests want them at the same moment.
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict() # {key: value}, oldest first
+        self._total_bytes = 0
+        self._in_flight = {} # {key: threading.Event} for values currently being produced
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value for key, or None. Counts as a hit/miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        """Stores a value, evicting least recently used entries to stay under max_bytes."""
+        size = self.sizeof(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return # Would evict everything and still not fit; just don't cache it
+            if key in self._entries:
+                self._total_bytes -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = value
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, evicted_value = self._entries.popitem(last=False)
+                self._total_bytes -= self.sizeof(evicted_value)
+                self.evictions += 1
+
+    def contains(self, key):
+        """True if key is cached. Doesn't touch LRU order or the hit/miss counters."""
+        with self._lock:
+            return key in self._entries
+
+    def is_pending(self, key):
+        """True if some thread is currently producing key."""
+        with self._lock:
+            return key in self._in_flight
+
+    def get_or_create(self, key, produce):
+        """Returns the cached value for key, calling produce() to create it on a miss.
+
+        If another thread is already producing the same key, waits for it instead of producing
+        a duplicate. Returns None if produce() failed (returned None).
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    is_producer = True
+                else:
+                    is_producer = False
+            if not is_producer:
+                event.wait()
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is not None:
+                    return entry
+                continue # Producer failed or entry was already evicted; try ourselves
             try:
-                bg_color = img.getpixel((sample_x, sample_y))
-                body_inverted_color = (255 - bg_color[0], 255 - bg_color[1], 255 - bg_color[2])
-            except Exception as e:
-                 print(f"RENDER_DEBUG: Error sampling pixel for T2 at ({sample_x}, {sample_y}): {e}. Defaulting color.")
-                 body_inverted_color = (255, 255, 255)
-
-
-        y_offset = body_top_y
-        for line in processed_text2_lines:
-             # Use actual body_font_size for get_text_height, even for empty lines
-            body_line_height = get_text_height(line, body_font, body_font_size, BODY_LINE_HEIGHT_MULTIPLIER)
+                entry = produce()
+                if entry is not None:
+                    self.put(key, entry)
+                return entry
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes,
+            }
+
+
+# Encoded caption images, {cache_key: (data, mimetype, stage_timings_ms)}. Keys are content-addressed (see
+# caption_cache_key) so identical captions share an entry and nothing ever needs invalidating.
+render_cache = ByteLRUCache(RENDER_CACHE_MAX_BYTES, sizeof=lambda entry: len(entry[0]))
+
+# Decoded RGB posters, {poster_path: Image}. Sized to hold the current round's poster plus the
+# prefetched next one; renders draw on a copy() so cached images are never modified.
+poster_image_cache = ByteLRUCache(POSTER_CACHE_MAX_BYTES, sizeof=lambda img: img.width * img.height * len(img.getbands()))
+
+def get_poster_image(source):
+    """Returns the decoded RGB poster (a PosterSource) from the cache, decoding it on a miss.
+
+    Callers must not draw on the returned image. Raises FileNotFoundError like Image.open().
+    """
+    def decode():
+        with Image.open(source.file_path) as img:
+            return img.convert("RGB") # Ensure RGB mode for inversion
+    poster_img = poster_image_cache.get_or_create(source.path, decode)
+    if poster_img is None:
+        raise FileNotFoundError(source.file_path)
+    return poster_img
+
+def warm_poster_cache(source):
+    """Render job: decodes a poster (a PosterSource) into the poster cache of the process running it."""
+    get_poster_image(source)
+
+def prefetch_poster(poster_path):
+    """Decodes a poster in the background so the round that uses it starts with a warm cache.
+
+    With several render processes only the one that takes the job is warmed; the others
+    decode the poster on their first render of the round.
+    """
+    if poster_path and not poster_image_cache.contains(poster_path):
+        render_service.submit(('poster', poster_path), warm_poster_cache, (poster_source(poster_path),), RENDER_PRIORITY_PREFETCH)
+
+def caption_cache_key(poster_path, text1, text2, encoding=None, layer=None):
+    """Content-addressed key (also used as the HTTP ETag) for a rendered caption, or for one
+    of its overlay layers ('title' or 'body').
+
+    With encoding=None the key identifies the caption itself rather than one encoded image,
+    which is what versioned caption URLs use.
+    """
+    encodings = OVERLAY_ENCODINGS if layer else CAPTION_ENCODINGS
+    encoding_settings = (encoding, encodings[encoding]) if encoding else None
+    layer_settings = (layer, CAPTION_LAYER_PADDING_PERCENT_OF_FONT) if layer else None
+    key_source = repr((poster_path, text1 or '', text2 or '', RENDER_CONFIG, encoding_settings, layer_settings))
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def negotiate_caption_encoding(accept_mimetypes, overlay=False):
+    """Picks the preferred caption (or overlay layer) encoding the client accepts, falling back to PNG."""
+    encodings, preference = (OVERLAY_ENCODINGS, OVERLAY_ENCODING_PREFERENCE) if overlay else (CAPTION_ENCODINGS, CAPTION_ENCODING_PREFERENCE)
+    best_mimetype = accept_mimetypes.best_match([encodings[name]['mimetype'] for name in preference])
+    for name in preference:
+        if encodings[name]['mimetype'] == best_mimetype:
+            return name
+    return CAPTION_FALLBACK_ENCODING
+
+_encode_stats_lock = threading.Lock()
+encode_stats = {} # {encoding: {'count': n, 'total_ms': float, 'total_bytes': n}}
+
+def record_encode(encoding, encode_ms, size):
+    with _encode_stats_lock:
+        stats = encode_stats.setdefault(encoding, {'count': 0, 'total_ms': 0.0, 'total_bytes': 0})
+        stats['count'] += 1
+        stats['total_ms'] += encode_ms
+        stats['total_bytes'] += size
+    encoded_bytes.inc(size, encoding=encoding)
+    render_stage_seconds.observe(encode_ms / 1000, stage='encode')
+
+_render_timing_lock = threading.Lock()
+render_timing_stats = {'count': 0, 'over_budget': 0, 'max_ms': 0.0, 'stages': {}} # stages: {stage: total_ms}
+
+def record_render_timing(timings):
+    """Adds one render's stage timings to render_timing_stats (see RENDER_BUDGET_MS)."""
+    render_ms = sum(ms for stage, ms in timings.items() if stage != 'encode')
+    for stage, ms in timings.items():
+        if stage != 'encode': # Observed by record_encode()
+            render_stage_seconds.observe(ms / 1000, stage=stage)
+    with _render_timing_lock:
+        render_timing_stats['count'] += 1
+        render_timing_stats['max_ms'] = max(render_timing_stats['max_ms'], render_ms)
+        if render_ms > RENDER_BUDGET_MS:
+            render_timing_stats['over_budget'] += 1
+        for stage, ms in timings.items():
+            render_timing_stats['stages'][stage] = render_timing_stats['stages'].get(stage, 0.0) + ms
+    if render_ms > RENDER_BUDGET_MS:
+        renders_over_budget.inc()
+        render_log.warning("Render took %.1f ms, over the %d ms budget: %s", render_ms, RENDER_BUDGET_MS, timings)
+
+def get_caption_cache_key(caption_author_id):
+    """Cache key for a caption in the current round, or None if it can't be rendered."""
+    caption = game_state['captions'].get(caption_author_id)
+    if not caption or not game_state.get('current_poster'):
+        return None
+    return caption_cache_key(game_state['current_poster'], caption.text1, caption.text2)
+
+@app.context_processor
+def inject_rendered_caption_url():
+    def rendered_caption_url(caption_author_id):
+        """URL for a caption image, versioned by its cache key so browsers can cache it long-term.
+
+        The version is the key of the full-size render; the per-width variant (?w=, added by
+        caption_loader.js) is derived from the same inputs, so the version covers it too.
+        """
+        return url_for('rendered_caption', caption_author_id=caption_author_id, v=get_caption_cache_key(caption_author_id))
+
+    def caption_overlay_layers(caption_author_id):
+        """[{'url', 'style'}] for each overlay layer of a caption, positioned in percentages of the poster."""
+        caption = game_state['captions'].get(caption_author_id)
+        poster_path = poster_render_source(game_state.get('current_poster'))
+        if not caption or not poster_path:
+            return []
+        width, height = poster_dimensions(poster_path)
+        layers = []
+        for layer, block_plan in caption_layer_plan(poster_path, width, height, caption.text1, caption.text2, wait=False).items():
+            left, top, right, _ = block_plan['box']
+            layers.append({
+                'url': url_for('caption_overlay', caption_author_id=caption_author_id, layer=layer, v=get_caption_cache_key(caption_author_id)),
+                'style': f'left: {100 * left / width:.3f}%; top: {100 * top / height:.3f}%; width: {100 * (right - left) / width:.3f}%;',
+            })
+        return layers
+
+    return {'rendered_caption_url': rendered_caption_url, 'caption_overlay_layers': caption_overlay_layers,
+            'caption_delivery_mode': CAPTION_DELIVERY_MODE}
+
+# Renders run in worker processes rather than in request threads, so a burst of voters never
+# waits on Pillow and nothing a render does holds up other requests. The workers import this
+# module for its renderer.
+render_service = RenderService(RENDER_PROCESSES, RENDER_QUEUE_MAX_JOBS, RENDER_JOB_TIMEOUT_SECONDS,
+                               preload=(__name__,), niceness=RENDER_PROCESS_NICENESS)
+
+def produce_caption_image(source, text1, text2, encoding, layer=None):
+    """Renders and encodes one caption, or just one of its overlay layers, on a PosterSource.
+
+    Returns (data, mimetype, stage_timings_ms) for the render cache, or None. Runs as a render
+    job, usually in a render process: it records no stats, see finish_caption_render().
+    """
+    poster_path = source.path
+    timings = {}
+    if layer:
+        rendered_img = render_caption_overlay(source, text1, text2, layer, timings)
+        if rendered_img is None:
+            return None # No text in this block (or an error, printed by the renderer)
+        encoding_config = OVERLAY_ENCODINGS[encoding]
+    else:
+        rendered_img = render_caption_on_image(source, text1, text2, timings)
+        if rendered_img is None:
+            render_log.warning("render_caption_on_image returned None for poster %s. Check the rendering errors logged above.", poster_path)
+            return None
+        encoding_config = CAPTION_ENCODINGS[encoding]
+    try:
+        encode_started = time.perf_counter()
+        img_byte_arr = io.BytesIO()
+        rendered_img.save(img_byte_arr, format=encoding_config['format'], **encoding_config['save_options'])
+        encode_ms = (time.perf_counter() - encode_started) * 1000
+    except Exception as e:
+        render_log.error("Error encoding rendered image for poster %s as %s: %s", poster_path, encoding, e)
+        return None
+    timings['encode'] = encode_ms
+    return img_byte_arr.getvalue(), encoding_config['mimetype'], timings
+
+def finish_caption_render(cache_key, encoding, layer, entry):
+    """Caches a finished render job's image and records its stats, in the server process."""
+    if entry is None:
+        return # Failed, timed out or displaced (logged by the render service); the next request queues it again
+    data, _, timings = entry
+    record_encode(f'{encoding} overlay' if layer else encoding, timings['encode'], len(data))
+    record_render_timing(timings)
+    render_cache.put(cache_key, entry)
+
+def queue_caption_render(poster_path, text1, text2, encoding=CAPTION_ENCODING_PREFERENCE[0], layer=None,
+                         priority=RENDER_PRIORITY_RESULTS):
+    """Schedules a background render unless the image (or overlay layer) is already cached or being rendered.
+
+    Returns False if the render queue is full (see RENDER_QUEUE_MAX_JOBS), True otherwise.
+    """
+    cache_key = caption_cache_key(poster_path, text1, text2, encoding, layer)
+    if render_cache.contains(cache_key):
+        return True
+    return render_service.submit(cache_key, produce_caption_image, (poster_source(poster_path), text1, text2, encoding, layer), priority,
+                                 on_done=functools.partial(finish_caption_render, cache_key, encoding, layer))
+
+def prerender_round_captions():
+    """Hands every caption of the current round to the background render pool, at each of
+    CAPTION_PRERENDER_WIDTHS. Widths after the first queue behind the other rounds' work.
+    """
+    if not game_state.get('current_poster'):
+        return
+    poster_paths = [poster_render_source(game_state['current_poster'], width) for width in CAPTION_PRERENDER_WIDTHS]
+    poster_paths = list(dict.fromkeys(poster_paths)) # Without derivatives every width renders on the original
+    captions = [(caption.text1, caption.text2) for caption in game_state['captions'].values()]
+    def queue_all():
+        for i, poster_path in enumerate(poster_paths):
+            if CAPTION_DELIVERY_MODE == 'overlay': # Voting needs these first; the full images are for the results
+                for text1, text2 in captions:
+                    for layer in ('title', 'body'):
+                        queue_caption_render(poster_path, text1, text2, OVERLAY_ENCODING_PREFERENCE[0], layer,
+                                             RENDER_PRIORITY_VOTING if i == 0 else RENDER_PRIORITY_PREFETCH)
+            for text1, text2 in captions:
+                queue_caption_render(poster_path, text1, text2,
+                                     priority=RENDER_PRIORITY_RESULTS if i == 0 else RENDER_PRIORITY_PREFETCH)
+        render_log.debug("Queued %d captions at %d widths for background rendering.", len(captions), len(poster_paths))
+    after_commit(queue_all)
+
+# --- Highlight Reel ---
+
+def highlight_reel_file_name(name):
+    """A player's name, cut down to what's safe in a file name on any system."""
+    return re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-')[:40] or 'player'
+
+def highlight_reel_entries(rounds, players, winners_only=True, folder=''):
+    """[ReelEntry] for a game's finished rounds (see highlight_reel.stream_zip): captions.txt,
+    then each round's winning caption, or every caption most votes first, as an image to render.
+
+    players is the game's Roster, for names; authors who left since are listed without one.
+    """
+    extension = 'jpg' if HIGHLIGHT_REEL_ENCODING == 'jpeg' else HIGHLIGHT_REEL_ENCODING
+    lines, images = [], []
+    for round_record in rounds:
+        if winners_only:
+            authors = [round_record.winner_id] if round_record.winner_id else []
+        else:
+            authors = sorted(round_record.captions, key=lambda a: round_record.vote_counts.get(a, 0), reverse=True)
+        source = poster_source(poster_render_source(round_record.poster, HIGHLIGHT_REEL_WIDTH))
+        lines.append(f"Round {round_record.number} ({round_record.poster})\n")
+        for rank, author_id in enumerate(authors, 1):
+            caption = round_record.captions.get(author_id)
+            if not caption:
+                continue
+            player = players.get(author_id) if players is not None else None
+            name = player.name if player else 'A departed player'
+            file_name = (f"{folder}round-{round_record.number}-{'' if winners_only else f'{rank:02d}-'}"
+                         f"{highlight_reel_file_name(name)}.{extension}")
+            votes = round_record.vote_counts.get(author_id, 0)
+            winner = ', winner' if author_id == round_record.winner_id else ''
+            lines.append(f"  {name} ({votes} votes{winner}): {caption.text1!r} / {caption.text2!r} -> {file_name}\n")
+            images.append(highlight_reel.ReelEntry(file_name, job=(
+                produce_caption_image, (source, caption.text1, caption.text2, HIGHLIGHT_REEL_ENCODING))))
+    return [highlight_reel.ReelEntry(f'{folder}captions.txt', data=''.join(lines).encode('utf-8'))] + images
+
+def stream_highlight_reel(entries):
+    """The ZIP archive of entries, as chunks rendered on the render service behind anything a round is waiting for."""
+    return highlight_reel.stream_zip(entries, render_service, RENDER_PRIORITY_EXPORT,
+                                     HIGHLIGHT_REEL_RENDER_WINDOW, HIGHLIGHT_REEL_RENDER_WAIT_SECONDS)
+
+# --- Game Events (Server-Sent Events) ---
+
+class GameEventBroker:
+    """Pushes game state snapshots to every connected /events stream.
+
+    Every event carries a full public snapshot, so a subscriber only ever needs the latest
+    one: instead of a queue per client we keep a single versioned payload and subscribers
+    wait on a condition until the version moves. Bursts of changes coalesce and memory per
+    subscriber is constant.
+
+    Threads (WSGI workers) use subscribe(); coroutines (the ASGI server, see asgi.py) use
+    subscribe_async(), which parks a future per waiting stream instead of a thread.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._version = 0
+        self._payload = None
+        self._closed = False
+        self._async_waiters = set() # (event loop, future) of subscribe_async() calls waiting for a change
+        self.subscribers = 0
+
+    def publish(self, payload):
+        """Serializes payload once and wakes every subscriber."""
+        data = json.dumps(payload)
+        with self._condition:
+            self._version += 1
+            self._payload = data
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def _wake_async_waiters(self):
+        # Called with self._condition held, from any thread
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+        self._async_waiters.clear()
+
+    def latest(self):
+        """Returns (version, serialized payload) of the most recent event."""
+        with self._condition:
+            return self._version, self._payload
+
+    def close(self):
+        """Ends every subscription, e.g. when the room is removed."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def subscribe(self, seen_version, keepalive_seconds, deadline=None):
+        """Generator yielding each newer serialized payload, or None after keepalive_seconds
+        without one. Runs until the consumer closes it (the client disconnects), close(), or
+        the deadline (a time.time() value) passes."""
+        with self._condition:
+            self.subscribers += 1
+        try:
+            while True:
+                timeout = keepalive_seconds if deadline is None else min(keepalive_seconds, deadline - time.time())
+                if timeout <= 0:
+                    return
+                with self._condition:
+                    self._condition.wait_for(lambda: self._closed or self._version != seen_version, timeout=timeout)
+                    if self._closed:
+                        return
+                    version, payload = self._version, self._payload
+                if version == seen_version:
+                    yield None
+                    continue
+                seen_version = version
+                yield payload
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+    async def subscribe_async(self, seen_version, keepalive_seconds):
+        """subscribe() for coroutines: an async generator with the same behavior."""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            self.subscribers += 1
+        try:
+            while True:
+                with self._condition:
+                    waiter = None
+                    if not self._closed and self._version == seen_version:
+                        waiter = loop.create_future()
+                        self._async_waiters.add((loop, waiter))
+                if waiter is not None:
+                    try:
+                        await asyncio.wait_for(waiter, keepalive_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    finally:
+                        with self._condition:
+                            self._async_waiters.discard((loop, waiter))
+                with self._condition:
+                    if self._closed:
+                        return
+                    version, payload = self._version, self._payload
+                if version == seen_version:
+                    yield None
+                    continue
+                seen_version = version
+                yield payload
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+
+def _resolve_waiter(waiter):
+    if not waiter.done(): # It may have timed out meanwhile
+        waiter.set_result(None)
+
+
+def public_state_snapshot(reason, state=game_state):
+    """Everything the lobby and wait pages show, safe to send to every player."""
+    players = sorted(
+        ({'player_id': player.player_id, 'name': player.name, 'score': player.score,
+          'submitted_this_round': player.submitted_this_round, 'voted_this_round': player.voted_this_round}
+         for player in state['players'].values()),
+        key=lambda p: p['name'])
+    return {
+        'reason': reason,
+        'state': state['state'],
+        'current_round': state['current_round'],
+        'phase_end_time': state.get('phase_end_time'),
+        'players': players,
+    }
+
+def notify_state_change(reason):
+    """Call after mutating game_state so connected pages update. reason is informational
+    (e.g. 'player_joined', 'caption_submitted', 'vote_cast', 'phase_changed').
+
+    The snapshot is taken and published once the change has been committed.
+    """
+    room, state = current_room(), current_game_state()
+    events = _pending_events.get()
+    if events is not None:
+        events.append(reason)
+    after_commit(lambda: room.events.publish(public_state_snapshot(reason, state)))
 
-            if not line:
-                 y_offset += body_line_height
-                 continue
+# --- Image Rendering Function ---
 
-            line_center_y = y_offset + body_line_height // 2
+# --- Caption Layout ---
 
+@functools.lru_cache(maxsize=None)
+def caption_font_path(configured_path):
+    """Full path of a configured caption font, or None (Pillow's built-in font) if it's missing."""
+    full_path = os.path.join(app.static_folder, configured_path.replace('static/', ''))
+    if not os.path.isfile(full_path):
+        render_log.warning("Font file %s not found. Rendering with default font.", full_path)
+        return None
+    return full_path
+
+def caption_geometry(img_width, img_height):
+    """Font, size range, box width and vertical extent of the title and body text on an image of this size.
+
+    The title may run down to where the body starts; the body to the bottom of the image.
+    """
+    def block(font_path, top_percent, width_percent, font_percent, min_font_percent, line_height_multiplier, bottom):
+        font_size = max(1, int(img_height * (font_percent / 100)))
+        top = max(0, int(img_height * (top_percent / 100)))
+        return {
+            'font_path': caption_font_path(font_path),
+            'font_size': font_size,
+            'min_font_size': max(1, min(font_size, int(img_height * (min_font_percent / 100)))),
+            'box_width': max(1, min(img_width, int(img_width * (width_percent / 100)))),
+            'top': top,
+            'line_height_multiplier': line_height_multiplier,
+            'max_height': max(0, bottom - top),
+        }
+    body_top = max(0, int(img_height * (BODY_TOP_PERCENT / 100)))
+    return {
+        'title': block(TITLE_FONT_PATH, TITLE_TOP_PERCENT, TITLE_WIDTH_PERCENT, TITLE_FONT_SIZE_PERCENT_OF_HEIGHT,
+                       TITLE_MIN_FONT_SIZE_PERCENT_OF_HEIGHT, TITLE_LINE_HEIGHT_MULTIPLIER, body_top),
+        'body': block(BODY_FONT_PATH, BODY_TOP_PERCENT, BODY_WIDTH_PERCENT, BODY_FONT_SIZE_PERCENT_OF_HEIGHT,
+                      BODY_MIN_FONT_SIZE_PERCENT_OF_HEIGHT, BODY_LINE_HEIGHT_MULTIPLIER, img_height),
+    }
+
+def caption_layouts(geometry, text1, text2):
+    """Wrapped (title, body) TextLayouts for a caption; both are drawn upper-case.
+
+    With CAPTION_AUTO_FIT, each block is shrunk to the largest font size that fits its area
+    (layout.font_size says which); otherwise both use the configured size.
+    """
+    layouts = []
+    for block, text in ((geometry['title'], text1), (geometry['body'], text2)):
+        text = (text or '').upper()
+        if CAPTION_AUTO_FIT:
+            layouts.append(fit_text(block['font_path'], block['font_size'], block['min_font_size'], block['box_width'],
+                                    block['max_height'], block['line_height_multiplier'], text))
+        else:
+            layouts.append(layout_text(block['font_path'], block['font_size'], block['box_width'], text))
+    return tuple(layouts)
+
+def poster_dimensions(poster_path):
+    """(width, height) of a poster or one of its derivatives, from the catalog or the derivatives manifest."""
+    entry = get_poster_catalog().get(poster_path)
+    if entry:
+        return entry['width'], entry['height']
+    get_poster_manifest()
+    return _poster_manifest['sizes'].get(poster_path) or image_header_size(poster_path)
+
+@functools.lru_cache(maxsize=256)
+def image_header_size(static_path):
+    """(width, height) of a static image, read from its header without decoding it."""
+    with Image.open(os.path.join(app.static_folder, static_path)) as img:
+        return img.size
+
+def caption_fit(poster_path, text1, text2):
+    """Whether a caption fits on a poster, without rendering it. Used for live previews."""
+    geometry = caption_geometry(*poster_dimensions(poster_render_source(poster_path)))
+    report = {}
+    for name, layout in zip(('title', 'body'), caption_layouts(geometry, text1, text2)):
+        block = geometry[name]
+        line_height = int(layout.font_size * block['line_height_multiplier'])
+        report[name] = {
+            'lines': list(layout.lines),
+            'line_count': layout.line_count,
+            'max_lines': block['max_height'] // max(1, line_height),
+            'font_scale': round(layout.font_size / block['font_size'], 2), # < 1 when auto-fit shrank it
+            'overflows_width': layout.overflows,
+            'fits': layout.fits(line_height, block['max_height']),
+        }
+    report['fits'] = report['title']['fits'] and report['body']['fits']
+    return report
+
+# --- Poster Layout Index ---
+
+_poster_layout_index = {'mtime': None, 'posters': {}}
+_analyzed_poster_layouts = OrderedDict() # {poster_path: blocks} for posters the index doesn't cover, least recent first
+_analyzed_poster_layouts_lock = threading.Lock()
+
+def caption_regions():
+    """{block: (left, top, right, bottom)} fractions of the poster each caption block may cover."""
+    def centered(width_percent, top_percent, bottom_percent):
+        margin = (1 - min(100, width_percent) / 100) / 2
+        return (margin, top_percent / 100, 1 - margin, bottom_percent / 100)
+    return {
+        'title': centered(TITLE_WIDTH_PERCENT, TITLE_TOP_PERCENT, BODY_TOP_PERCENT),
+        'body': centered(BODY_WIDTH_PERCENT, BODY_TOP_PERCENT, 100),
+    }
+
+def get_poster_layout_index():
+    """Returns {poster_path: blocks} from the layout index, or {} if it hasn't been built for
+    the current caption regions. Re-read whenever the index file changes."""
+    index_path = os.path.join(app.static_folder, POSTER_LAYOUT_INDEX_PATH)
+    try:
+        mtime = os.path.getmtime(index_path)
+    except OSError:
+        return {}
+    if mtime != _poster_layout_index['mtime']:
+        posters = poster_layout.load_layout_index(index_path, caption_regions()) or {}
+        _poster_layout_index['posters'] = {path: poster_layout.frozen_blocks(entry['blocks']) for path, entry in posters.items()}
+        _poster_layout_index['mtime'] = mtime
+    return _poster_layout_index['posters']
+
+def analyze_poster_layout(poster_path):
+    """Analyzes a poster the layout index doesn't cover. Run as a render job, or inline by renders."""
+    render_log.info("%s is not in the poster layout index; analyzing it now (run `flask posters build`).", poster_path)
+    return poster_layout.frozen_blocks(
+        poster_layout.analyze_poster_file(os.path.join(app.static_folder, poster_path), caption_regions()))
+
+def remember_poster_layout(poster_path, blocks):
+    """Keeps an on-demand analysis, dropping the least recently used beyond POSTER_LAYOUT_CACHE_SIZE."""
+    if blocks is None:
+        return
+    with _analyzed_poster_layouts_lock:
+        _analyzed_poster_layouts[poster_path] = blocks
+        _analyzed_poster_layouts.move_to_end(poster_path)
+        while len(_analyzed_poster_layouts) > POSTER_LAYOUT_CACHE_SIZE:
+            _analyzed_poster_layouts.popitem(last=False)
+
+def get_poster_layout(poster_path, wait=True):
+    """Band statistics of each caption region of a poster (see poster_layout.analyze_poster).
+
+    Posters missing from the index are analyzed from the original on demand; the result is
+    the same as the index would hold, so cached renders stay consistent. Renders (wait=True)
+    analyze inline. Requests pass wait=False: they get None and the analysis is queued on the
+    render service, so a room's lock is never held over it.
+    """
+    blocks = get_poster_layout_index().get(poster_path)
+    if blocks is not None:
+        return blocks
+    with _analyzed_poster_layouts_lock:
+        blocks = _analyzed_poster_layouts.get(poster_path)
+        if blocks is not None:
+            _analyzed_poster_layouts.move_to_end(poster_path)
+            return blocks
+    if not wait:
+        render_service.submit(('poster_layout', poster_path), analyze_poster_layout, (poster_path,), RENDER_PRIORITY_VOTING,
+                              on_done=functools.partial(remember_poster_layout, poster_path))
+        return None
+    blocks = analyze_poster_layout(poster_path)
+    remember_poster_layout(poster_path, blocks)
+    return blocks
+
+def caption_outline_width(font_size):
+    return max(1, round(font_size * TEXT_OUTLINE_WIDTH_PERCENT_OF_FONT / 100))
+
+def caption_text_styles(poster_path, geometry, layouts, img_height, wait=True):
+    """{block: {'fill', 'outline', 'outline_width'}} for drawing laid-out caption text on a poster.
+
+    Colors come from the poster layout over the rows the block's lines actually cover, or are
+    poster_layout.DEFAULT_TEXT_STYLE while a layout is still being analyzed (wait=False).
+    """
+    regions = get_poster_layout(poster_original(poster_path), wait)
+    styles = {}
+    for name, layout in zip(('title', 'body'), layouts):
+        block = geometry[name]
+        if regions is None:
+            style = poster_layout.DEFAULT_TEXT_STYLE
+        else:
+            text_bottom = min(img_height, block['top'] + max(1, layout.height(int(layout.font_size * block['line_height_multiplier']))))
+            style = poster_layout.text_style(regions[name], block['top'] / img_height, text_bottom / img_height)
+        styles[name] = {**style, 'outline_width': caption_outline_width(layout.font_size) if style['outline'] else 0}
+    return styles
+
+def caption_line_heights(layout, font, line_height_multiplier):
+    """Vertical space each laid-out line takes. Empty lines use the font's full ascent + descent."""
+    ascent, descent = font.getmetrics()
+    empty_line_height = int((ascent + descent) * line_height_multiplier)
+    return [int(layout.font_size * line_height_multiplier) if line else empty_line_height for line in layout.lines]
+
+def caption_layer_plan(poster_path, img_width, img_height, text1, text2, wait=True):
+    """Where and how each caption block is drawn on a poster of this size, without drawing it.
+
+    Returns {block: {'box', 'top', 'center_x', 'font', 'lines', 'line_heights', 'style'}} for the
+    blocks that have text. box is the (left, top, right, bottom) rectangle the block's text
+    layer covers: its lines plus room for glyph overhang and an outline (whether or not it has
+    one, so boxes don't depend on the colors), clipped to the image. Request handlers pass
+    wait=False and only use the boxes (see get_poster_layout).
+    """
+    geometry = caption_geometry(img_width, img_height)
+    layouts = caption_layouts(geometry, text1, text2)
+    styles = caption_text_styles(poster_path, geometry, layouts, img_height, wait)
+    center_x = img_width // 2
+    plan = {}
+    for name, layout in zip(('title', 'body'), layouts):
+        if not any(layout.lines):
+            continue
+        block, style = geometry[name], styles[name]
+        font = load_font(block['font_path'], layout.font_size)
+        line_heights = caption_line_heights(layout, font, block['line_height_multiplier'])
+        padding = caption_outline_width(layout.font_size) + math.ceil(layout.font_size * CAPTION_LAYER_PADDING_PERCENT_OF_FONT / 100)
+        half_width = math.ceil(max(layout.widths) / 2) + padding
+        box = (max(0, center_x - half_width), max(0, block['top'] - padding),
+               min(img_width, center_x + half_width), min(img_height, block['top'] + sum(line_heights) + padding))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue # Entirely off the image
+        plan[name] = {'box': box, 'top': block['top'], 'center_x': center_x, 'font': font,
+                      'lines': layout.lines, 'line_heights': line_heights, 'style': style}
+    return plan
+
+def draw_caption_layer(block_plan):
+    """Draws one block's lines onto a transparent RGBA image the size of its box."""
+    left, top, right, bottom = block_plan['box']
+    layer = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    style = block_plan['style']
+    center_x = block_plan['center_x'] - left
+    y_offset = block_plan['top'] - top
+    for line, line_height in zip(block_plan['lines'], block_plan['line_heights']):
+        if line: # Empty lines only take up space
             try:
-                 draw.text((center_x, line_center_y), line, fill=body_inverted_color, font=body_font, anchor='mm')
+                draw.text((center_x, y_offset + line_height // 2), line, fill=style['fill'], font=block_plan['font'], anchor='mm',
+                          stroke_width=style['outline_width'], stroke_fill=style['outline'])
             except Exception as e:
-                 print(f"RENDER_DEBUG: Error drawing Text 2 line '{line}': {e}")
+                render_log.error("Error drawing line %r: %s", line, e)
+        y_offset += line_height
+    return layer
+
+def _stage_timer(timings):
+    """Returns end_stage(name), which stores the ms since the previous call (or since now) in timings[name]."""
+    stage_started = time.perf_counter()
+    def end_stage(name):
+        nonlocal stage_started
+        now = time.perf_counter()
+        timings[name] = (now - stage_started) * 1000
+        stage_started = now
+    return end_stage
+
+def render_caption_on_image(source, text1, text2, timings=None):
+    """Renders text1 and text2 onto the poster image (a PosterSource): each block's text layer
+    composited onto a copy of the cached poster.
+
+    If a timings dict is passed, the milliseconds spent on each stage ('poster', 'layout',
+    'draw') are stored in it.
+    """
+    poster_path, full_poster_path = source.path, source.file_path
+    render_log.debug("Render start: poster %s, text 1 %r, text 2 %r", full_poster_path, text1, text2)
+    timings = {} if timings is None else timings
+    end_stage = _stage_timer(timings)
 
-            y_offset += body_line_height
-
-        print("--- RENDER END ---")
+    try:
+        img = get_poster_image(source).copy() # Draw on a copy, the cached poster is shared
+        render_log.debug("Opened image. Size: %dx%d, Mode: %s", img.width, img.height, img.mode)
+        end_stage('poster')
+
+        plan = caption_layer_plan(source.original, img.width, img.height, text1, text2)
+        if render_log.isEnabledFor(logging.DEBUG):
+            for name, block_plan in plan.items():
+                render_log.debug("%s: %dpx, box %s, style %s, lines %s", name, block_plan['font'].size,
+                                 block_plan['box'], block_plan['style'], list(block_plan['lines']))
+        end_stage('layout')
+
+        for block_plan in plan.values():
+            layer = draw_caption_layer(block_plan)
+            img.paste(layer, block_plan['box'][:2], layer) # The layer's alpha is the mask
+        end_stage('draw')
+        render_log.debug("Render end (%.1f ms)", sum(timings.values()))
         return img
 
     except FileNotFoundError:
-        print(f"RENDER_DEBUG: ERROR: Poster image not found at {full_poster_path}")
-        print("--- RENDER END ---")
+        render_log.error("Poster image not found at %s", full_poster_path)
         return None
     except Exception as e:
-        print(f"RENDER_DEBUG: ERROR during image rendering for {poster_path}: {e}")
-        print("--- RENDER END ---")
-        # Re-raise the exception here to get a full traceback if needed for deeper debugging
-        # raise e
+        render_log.exception("Error during image rendering for %s: %s", poster_path, e)
+        return None
+
+def render_caption_overlay(source, text1, text2, layer_name, timings=None):
+    """Renders one caption block ('title' or 'body') as a transparent RGBA image, or None if it has no text.
+
+    The poster (a PosterSource) is never decoded, so the cost depends on the text's area, not
+    the poster's. Same 'layout' / 'draw' timings as render_caption_on_image.
+    """
+    poster_path = source.path
+    timings = {} if timings is None else timings
+    end_stage = _stage_timer(timings)
+    try:
+        block_plan = caption_layer_plan(source.original, source.width, source.height, text1, text2).get(layer_name)
+        end_stage('layout')
+        if block_plan is None:
+            return None
+        layer = draw_caption_layer(block_plan)
+        end_stage('draw')
+        return layer
+    except Exception as e:
+        render_log.exception("Error rendering the %s overlay for %s: %s", layer_name, poster_path, e)
         return None
 
 
@@ -510,67 +1727,249 @@ def render_caption_on_image(poster_path, text1, text2):
 
 @app.route('/')
 def index():
-    return redirect(url_for('lobby'))
-
-@app.route('/game_state_check')
+    return render_template('index.html', room_count=len(rooms))
+
+@app.route('/rooms', methods=['POST'])
+def create_room():
+    room = rooms.create()
+    if not phase_scheduler.is_scheduled(ROOM_GC_JOB):
+        schedule_room_gc()
+    return redirect(url_for('lobby', room_code=room.code))
+
+@app.route('/join')
+def join_room():
+    room_code = request.args.get('room_code', '').strip().upper()
+    if not rooms.get(room_code):
+        flash(f"No room with code {room_code or '(blank)'}. Check the code or create a new room.")
+        return redirect(url_for('index'))
+    return redirect(url_for('lobby', room_code=room_code))
+
+@room_route('/game_state_check', read_only=True)
 def game_state_check():
+    if phase_timer_expired(time.time()):
+        return g.room.run(advance_and_check_game_state) # The scheduler hasn't got to it yet
+    return jsonify({'state': game_state['state'], 'phase_end_time': game_state.get('phase_end_time')})
+
+def advance_and_check_game_state():
     check_and_advance_state_if_timer_expired()
     return jsonify({'state': game_state['state'], 'phase_end_time': game_state.get('phase_end_time')})
 
-@app.route('/rendered_caption/<caption_author_id>')
+@room_route('/events')
+def events():
+    """Server-Sent Events stream of public game state snapshots (see GameEventBroker).
+
+    A stream holds its worker thread, so on a single-threaded worker (gunicorn -k sync) one
+    waiting player would stall every other request. There the response is just the current
+    snapshot and a short retry, and the browser's reconnects turn the stream into polling.
+    Elsewhere streams end after EVENT_STREAM_MAX_SECONDS, before a worker timeout can kill
+    them, and the browser reconnects to a fresh snapshot.
+    """
+    def stream(seen_version, payload):
+        yield f"retry: {EVENT_STREAM_RETRY_MILLISECONDS}\n"
+        yield f"event: state\ndata: {payload}\n\n"
+        # With a shared state store other workers change the room too, so look for their
+        # writes between events instead of only waking up for keepalives
+        wait_seconds = STATE_SYNC_INTERVAL_SECONDS if state_store.is_shared else EVENT_STREAM_KEEPALIVE_SECONDS
+        last_sent = time.time()
+        for payload in room.events.subscribe(seen_version, wait_seconds, deadline=last_sent + EVENT_STREAM_MAX_SECONDS):
+            if payload is not None:
+                yield f"event: state\ndata: {payload}\n\n"
+                last_sent = time.time()
+                continue
+            if state_store.is_shared:
+                try:
+                    room.sync_events() # Publishes to room.events; picked up by the next iteration
+                except RoomNotFoundError:
+                    rooms.forget(room.code)
+                    return
+            if time.time() - last_sent >= EVENT_STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+
+    room = current_room() # The generator runs after the request (and its transaction) is over
+    if request.environ.get('wsgi.multithread'):
+        body = stream(*open_event_stream())
+    else:
+        _, payload = open_event_stream()
+        body = f"retry: {EVENT_STREAM_POLL_RETRY_MILLISECONDS}\nevent: state\ndata: {payload}\n\n"
+    response = Response(body, mimetype='text/event-stream')
+    response.headers.update(EVENT_STREAM_HEADERS)
+    return response
+
+EVENT_STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no', # Stop nginx-style proxies from buffering the stream
+}
+
+def open_event_stream():
+    """(version, payload) to start an /events stream with. Runs in the room's transaction.
+
+    Every stream starts with a fresh snapshot so the page is correct even if it missed events.
+    """
+    check_and_advance_state_if_timer_expired()
+    version, _ = current_room().events.latest()
+    return version, json.dumps(public_state_snapshot('connected'))
+
+@room_route('/rendered_caption/<caption_author_id>', read_only=True)
 def rendered_caption(caption_author_id):
+    return serve_caption_render(caption_author_id)
+
+@room_route('/caption_overlay/<caption_author_id>/<layer>', read_only=True)
+def caption_overlay(caption_author_id, layer):
+    """One block of a caption as a transparent image, to lay over the shared poster (see CAPTION_DELIVERY_MODE)."""
+    if layer not in ('title', 'body'):
+        return "Unknown caption layer", 404
+    return serve_caption_render(caption_author_id, layer)
+
+def serve_caption_render(caption_author_id, layer=None):
+    """Response with a caption's rendered image, or one of its overlay layers, from the render cache."""
     if caption_author_id not in game_state['captions']:
-        print(f"RENDER_DEBUG: Caption author ID {caption_author_id} not found in captions.")
+        render_log.debug("Caption author ID %s not found in captions.", caption_author_id)
         return "Caption not found", 404
-    caption_data = game_state['captions'][caption_author_id]
-    text1 = caption_data.get('text1', '')
-    text2 = caption_data.get('text2', '')
+    caption = game_state['captions'][caption_author_id]
+    text1, text2 = caption.text1, caption.text2
 
     if not game_state.get('current_poster'):
-        print(f"RENDER_DEBUG: No current poster set for round {game_state.get('current_round')}.")
+        render_log.debug("No current poster set for round %s.", game_state.get('current_round'))
         return "No poster set for this round", 404
 
-    rendered_img = render_caption_on_image(game_state['current_poster'], text1, text2)
-
-    if rendered_img is None:
-        print(f"RENDER_DEBUG: render_caption_on_image returned None for author {caption_author_id}. Check rendering errors printed above.")
-        return "Could not render image", 500
+    # Render on the poster derivative matching the width the client will display the image at
+    display_width = caption_render_width(request.args.get('w', type=int))
+    poster_path = poster_render_source(game_state['current_poster'], display_width)
+    if layer and layer not in caption_layer_plan(poster_path, *poster_dimensions(poster_path), text1, text2, wait=False):
+        return "This caption has no text in that layer", 404
+    encoding = negotiate_caption_encoding(request.accept_mimetypes, overlay=bool(layer))
+    cache_key = caption_cache_key(poster_path, text1, text2, encoding, layer)
+
+    # Only let the browser keep the image if it asked for this exact version (see rendered_caption_url).
+    # The bare URL is reused by the same author next round, so it always has to be revalidated.
+    if request.args.get('v') == get_caption_cache_key(caption_author_id):
+        cache_control = f'private, max-age={RENDERED_CAPTION_MAX_AGE_SECONDS}, immutable'
     else:
-        try:
-            img_byte_arr = io.BytesIO()
-            rendered_img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-            print(f"RENDER_DEBUG: Successfully rendered and sending image for author {caption_author_id}.")
-            return send_file(img_byte_arr, mimetype='image/png', as_attachment=False)
-        except Exception as e:
-             print(f"RENDER_DEBUG: ERROR saving or sending rendered image for author {caption_author_id}: {e}")
-             return "Error saving/sending image", 500
+        cache_control = 'private, no-cache'
+
+    # The key is content-addressed, so a matching ETag means the client already has these exact bytes
+    if cache_key in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(cache_key)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept')
+        return response
+
+    entry = render_cache.get(cache_key)
+    if entry is None:
+        # Never render inline: make sure it's queued and let the page's loader retry shortly
+        if queue_caption_render(poster_path, text1, text2, encoding, layer, RENDER_PRIORITY_REQUESTED):
+            response = app.response_class("Caption is still rendering", status=503, mimetype='text/plain')
+            response.headers['Retry-After'] = str(RENDER_PENDING_RETRY_SECONDS)
+        else:
+            response = app.response_class("Render queue is full", status=503, mimetype='text/plain')
+            response.headers['Retry-After'] = str(RENDER_QUEUE_FULL_RETRY_SECONDS)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    data, mimetype, timings = entry
+    response = send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=False, etag=cache_key, max_age=None)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept') # Same URL, different bytes per encoding
+    # Cost of producing these bytes, per stage (measured when they were first rendered, before caching)
+    response.headers['Server-Timing'] = ', '.join(
+        f'{stage};dur={ms:.1f}' + (f';desc="{mimetype}"' if stage == 'encode' else '') for stage, ms in timings.items())
+    response.headers['X-Encoded-Bytes'] = str(len(data))
+    return response
+
+@room_route('/caption_fit', read_only=True)
+def caption_fit_preview():
+    """Live "will it fit?" check for the writing page: wraps the caption without rendering it."""
+    if not game_state.get('current_poster'):
+        return jsonify({'error': 'No poster this round'}), 409
+    text1 = request.args.get('text1', '')[:CAPTION_PREVIEW_MAX_CHARS]
+    text2 = request.args.get('text2', '')[:CAPTION_PREVIEW_MAX_CHARS]
+    return jsonify(caption_fit(game_state['current_poster'], text1, text2))
+
+
+@app.route('/render_cache_stats')
+def render_cache_stats():
+    return jsonify({
+        'captions': render_cache.stats(),
+        'posters': poster_image_cache.stats(),
+        'text_layout': text_layout.cache_stats(),
+        'encodings': encode_stats,
+        'render_timing': {**render_timing_stats, 'budget_ms': RENDER_BUDGET_MS},
+        'render_service': render_service.stats(),
+    })
 
 
-@app.route('/lobby', methods=['GET', 'POST'])
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: request, render and game counters for this process."""
+    return Response(metrics_registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@metrics_registry.collector
+def collect_cache_and_room_metrics():
+    render_jobs = render_service.stats()
+    samples = {'hits': [], 'misses': [], 'evictions': [], 'bytes': []}
+    for name, cache in (('captions', render_cache), ('posters', poster_image_cache)):
+        stats = cache.stats()
+        for field in samples:
+            samples[field].append(({'cache': name}, stats[field]))
+    for name, info in text_layout.cache_stats().items():
+        samples['hits'].append(({'cache': f'text_layout_{name}'}, info['hits']))
+        samples['misses'].append(({'cache': f'text_layout_{name}'}, info['misses']))
+    return [
+        ('cache_hits_total', 'counter', 'Cache lookups that found an entry.', samples['hits']),
+        ('cache_misses_total', 'counter', 'Cache lookups that had to produce the entry.', samples['misses']),
+        ('cache_evictions_total', 'counter', 'Entries dropped to stay under the size limit.', samples['evictions']),
+        ('cache_bytes', 'gauge', 'Current size of the cached entries.', samples['bytes']),
+        ('rooms_open', 'gauge', 'Rooms in the state store.', [({}, len(rooms))]),
+        ('posters_cataloged', 'gauge', 'Posters in the poster catalog.', [({}, len(all_posters))]),
+        ('poster_catalog_scan_seconds', 'gauge', 'Duration of the last poster catalog scan.', [({}, (_poster_catalog['scan_ms'] or 0) / 1000)]),
+        ('poster_placeholders_missing', 'gauge', 'Cataloged posters without a placeholder yet.',
+         [({}, sum('placeholder' not in entry for entry in get_poster_catalog().values()))]),
+        ('startup_first_request_seconds', 'gauge', 'Time from app.py starting to load (after its imports) to its first response.',
+         [({}, startup_timing['first_request_ms'] / 1000)] if startup_timing['first_request_ms'] is not None else []),
+        ('render_queue_pending', 'gauge', 'Render jobs waiting for a render process.', [({}, render_jobs['queued'])]),
+        ('render_queue_running', 'gauge', 'Render jobs being run.', [({}, render_jobs['running'])]),
+        ('render_jobs_total', 'counter', 'Render jobs by how they ended (rejected: refused by a full queue).',
+         [({'outcome': outcome}, render_jobs[outcome]) for outcome in ('completed', 'failed', 'timed_out', 'rejected', 'displaced')]),
+    ] + journal_metrics()
+
+def journal_metrics():
+    if GAME_STATE_BACKEND != 'journal':
+        return []
+    stats = state_store.log.stats()
+    return [
+        ('game_journal_records_total', 'counter', 'Changes written to the game journal.', [({}, stats['records'])]),
+        ('game_journal_bytes_total', 'counter', 'Bytes written to the game journal.', [({}, stats['bytes'])]),
+        ('game_journal_fsyncs_total', 'counter', 'Batches of journal records written and fsynced.', [({}, stats['fsyncs'])]),
+        ('game_journal_pending_records', 'gauge', 'Changes waiting for the journal writer.', [({}, stats['pending'])]),
+        ('game_journal_write_errors_total', 'counter', 'Journal batches that could not be written.', [({}, stats['write_errors'])]),
+    ]
+
+@room_route('/lobby', methods=['GET', 'POST'])
 def lobby():
     player_id = get_player_id()
     if game_state['state'] != 'lobby':
         current_player = get_current_player()
         if current_player:
-             print(f"Game in progress ({game_state['state']}), redirecting player {current_player.get('name')} ({player_id}) from lobby.")
+             log.debug("Game in progress (%s), redirecting player %s (%s) from lobby.", game_state['state'], current_player.name, player_id)
              return redirect(url_for(game_state['state']))
         else:
-             print(f"Game in progress ({game_state['state']}), new/unknown session {player_id} trying to join lobby.")
+             log.debug("Game in progress (%s), new/unknown session %s trying to join lobby.", game_state['state'], player_id)
              flash("A game is currently in progress. Please wait for it to finish.")
              return render_template('lobby.html', game_state=game_state, current_player=None, game_in_progress=True)
 
     if player_id not in game_state['players']:
-         game_state['players'][player_id] = {
-             'name': 'Unnamed Player', 'score': 0, 'submitted_this_round': False, 'voted_this_round': False
-         }
+         game_state['players'].join(player_id)
+         notify_state_change('player_joined')
 
     current_player = game_state['players'][player_id]
 
     if request.method == 'POST':
         player_name = request.form.get('player_name', '').strip()
         if player_name:
-            current_player['name'] = player_name
+            game_state['players'].rename(player_id, player_name)
+            notify_state_change('player_renamed')
             flash(f"Your name is now {player_name}!")
         else:
              flash("Name cannot be empty. Using default name.")
@@ -580,86 +1979,84 @@ def lobby():
     return render_template('lobby.html', game_state=game_state, current_player=current_player, game_in_progress=False, current_session_id=session.get('player_id'))
 
 
-@app.route('/start_game', methods=['POST'])
+@room_route('/start_game', methods=['POST'])
 def start_game():
     player_id = get_player_id()
     current_player = get_current_player()
-    print(f"Attempting to start game by player {player_id}. State: {game_state['state']}")
+    log.debug("Attempting to start game by player %s. State: %s", player_id, game_state['state'])
 
     if game_state['state'] == 'lobby' and current_player:
         named_players_count = len(get_named_players())
-        print(f"Start game check: Named player count: {named_players_count}")
+        log.debug("Start game check: Named player count: %d", named_players_count)
 
         if named_players_count < 2:
             flash("Need at least 2 players with names to start!")
-            print("Start game failed: Not enough named players.")
+            log.debug("Start game failed: Not enough named players.")
             return redirect(url_for('lobby'))
 
-        if current_player.get('name') == 'Unnamed Player':
+        if not current_player.is_named:
              flash("Please set your name before starting the game.")
-             print(f"Start game failed: Player {player_id} is unnamed.")
+             log.debug("Start game failed: Player %s is unnamed.", player_id)
              return redirect(url_for('lobby'))
 
-        if not game_state['all_posters']:
+        if not all_posters:
              flash("Error: No posters found in static/posters directory! Cannot start game.")
-             print("ERROR: game_state['all_posters'] is empty in start_game despite before_request.")
+             log.error("all_posters is empty in start_game; the poster catalog found no posters.")
              game_state['state'] = 'lobby'
              return redirect(url_for('lobby'))
 
-        print("Starting game...")
+        log.info("Starting game in room %s.", g.room.code)
         if start_new_round():
             return redirect(url_for('writing'))
         else:
             flash("Could not start a new round. Check server logs.")
-            print("Failed to start new round.")
+            log.error("Failed to start new round.")
             return redirect(url_for('lobby'))
 
     if not current_player:
         flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
     else:
-        print(f"Start game request denied: player {current_player.get('name')} on wrong page, state {game_state['state']}.")
+        log.debug("Start game request denied: player %s on wrong page, state %s.", current_player.name, game_state['state'])
         return redirect(url_for(game_state['state']))
 
 
-@app.route('/writing')
+@room_route('/writing')
 def writing():
     player_id = get_player_id()
     current_player = get_current_player()
-    if game_state['state'] != 'writing' or not current_player or current_player.get('submitted_this_round'):
+    if game_state['state'] != 'writing' or not current_player or current_player.submitted_this_round:
          if not current_player: flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
-         elif game_state['state'] == 'writing' and current_player.get('submitted_this_round'): return redirect(url_for('wait'))
+         elif game_state['state'] == 'writing' and current_player.submitted_this_round: return redirect(url_for('wait'))
          else: return redirect(url_for(game_state['state']))
 
-    if current_player.get('name') == 'Unnamed Player':
+    if not current_player.is_named:
          flash("Please set your name in the lobby to participate in the round."); return redirect(url_for('lobby'))
 
     return render_template('writing.html', game_state=game_state, current_player=current_player, phase_end_time=game_state.get('phase_end_time', 0))
 
-@app.route('/submit_caption', methods=['POST'])
+@room_route('/submit_caption', methods=['POST'])
 def submit_caption():
     player_id = get_player_id()
     current_player = get_current_player()
     current_time = time.time()
     timer_expired = game_state.get('phase_end_time') is not None and current_time > game_state['phase_end_time']
 
-    if game_state['state'] == 'writing' and current_player and not current_player.get('submitted_this_round') and current_player.get('name') != 'Unnamed Player' and not timer_expired:
+    if game_state['state'] == 'writing' and current_player and not current_player.submitted_this_round and current_player.is_named and not timer_expired:
         caption_text1 = request.form.get('caption_text1', '').strip()
         caption_text2 = request.form.get('caption_text2', '').strip()
 
         if caption_text1 or caption_text2:
-            game_state['captions'][player_id] = {'text1': caption_text1, 'text2': caption_text2}
-            current_player['submitted_this_round'] = True
-            print(f"Player {current_player['name']} ({player_id}) submitted caption.")
+            game_state['captions'][player_id] = Caption(caption_text1, caption_text2)
+            game_state['players'].mark_submitted(player_id)
+            log.debug("Player %s (%s) submitted caption.", current_player.name, player_id)
+            notify_state_change('caption_submitted')
 
             if check_all_submitted():
-                print("All named players submitted early. Moving to voting.")
-                game_state['state'] = 'voting'
-                game_state['phase_end_time'] = current_time + VOTING_TIME_SECONDS
-                for player_data in game_state['players'].values():
-                     player_data['voted_this_round'] = False
+                log.debug("All named players submitted early. Moving to voting.")
+                start_voting_phase(current_time)
                 return redirect(url_for('voting'))
             else:
-                 print("Waiting for more submissions or timer.")
+                 log.debug("Waiting for more submissions or timer.")
                  return redirect(url_for('wait'))
 
         else:
@@ -672,55 +2069,51 @@ def submit_caption():
          return redirect(url_for(game_state['state']))
 
 
-@app.route('/voting')
+@room_route('/voting')
 def voting():
     player_id = get_player_id()
     current_player = get_current_player()
-    if game_state['state'] != 'voting' or not current_player or current_player.get('voted_this_round'):
+    if game_state['state'] != 'voting' or not current_player or current_player.voted_this_round:
          if not current_player: flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
-         elif game_state['state'] == 'voting' and current_player.get('voted_this_round'): return redirect(url_for('wait'))
+         elif game_state['state'] == 'voting' and current_player.voted_this_round: return redirect(url_for('wait'))
          else: return redirect(url_for(game_state['state']))
 
-    if current_player.get('name') == 'Unnamed Player':
+    if not current_player.is_named:
          flash("Please set your name in the lobby to participate in the round."); return redirect(url_for('lobby'))
 
-    voteable_caption_authors = [p_id for p_id, caption_data in game_state['captions'].items() if p_id in get_named_players() and p_id != player_id and (caption_data.get('text1') or caption_data.get('text2'))]
+    voteable_caption_authors = [p_id for p_id, caption in game_state['captions'].items() if p_id in get_named_players() and p_id != player_id and caption]
 
     shuffled_voteable_authors = voteable_caption_authors.copy()
     random.shuffle(shuffled_voteable_authors)
 
     if not shuffled_voteable_authors and player_id in game_state['captions'] and player_id in get_named_players():
-        print(f"Player {current_player['name']} ({player_id}) submitted but had no one else to vote for. Auto-marking as voted.")
-        current_player['voted_this_round'] = True
+        log.debug("Player %s (%s) submitted but had no one else to vote for. Auto-marking as voted.", current_player.name, player_id)
+        game_state['players'].mark_voted(player_id)
         if check_all_voted():
-            print("Voting complete (auto-skipped for one). Tallying results.")
-            tally_votes()
-            game_state['state'] = 'round_results'
-            game_state['phase_end_time'] = None
+            log.debug("Voting complete (auto-skipped for one). Tallying results.")
+            finish_voting_phase()
             return redirect(url_for('round_results'))
 
     return render_template('voting.html', game_state=game_state, current_player=current_player, voteable_author_ids=shuffled_voteable_authors, phase_end_time=game_state.get('phase_end_time'))
 
-@app.route('/submit_vote', methods=['POST'])
+@room_route('/submit_vote', methods=['POST'])
 def submit_vote():
     player_id = get_player_id()
     current_player = get_current_player()
     current_time = time.time()
     timer_expired = game_state.get('phase_end_time') is not None and current_time > game_state['phase_end_time']
 
-    if game_state['state'] == 'voting' and current_player and not current_player.get('voted_this_round') and current_player.get('name') != 'Unnamed Player' and not timer_expired:
+    if game_state['state'] == 'voting' and current_player and not current_player.voted_this_round and current_player.is_named and not timer_expired:
         voted_for_id = request.form.get('vote')
 
         if voted_for_id and voted_for_id in game_state['captions'] and voted_for_id in get_named_players() and voted_for_id != player_id and voted_for_id in game_state['players']:
-            game_state['votes'][player_id] = voted_for_id
-            current_player['voted_this_round'] = True
-            print(f"Player {current_player['name']} ({player_id}) voted.")
+            game_state['players'].record_vote(player_id, voted_for_id)
+            log.debug("Player %s (%s) voted.", current_player.name, player_id)
+            notify_state_change('vote_cast')
 
             if check_all_voted():
-                print("All relevant players voted early. Tallying results.")
-                tally_votes()
-                game_state['state'] = 'round_results'
-                game_state['phase_end_time'] = None
+                log.debug("All relevant players voted early. Tallying results.")
+                finish_voting_phase()
                 return redirect(url_for('round_results'))
 
         else:
@@ -736,7 +2129,7 @@ def submit_vote():
     return redirect(url_for(game_state['state']))
 
 
-@app.route('/round_results')
+@room_route('/round_results')
 def round_results():
     player_id = get_player_id()
     current_player = get_current_player()
@@ -745,83 +2138,78 @@ def round_results():
         else: return redirect(url_for(game_state['state']))
 
     results = []
-    vote_counts = {}
-    for voter_id, voted_for_id in game_state['votes'].items():
-        if voter_id in get_named_players() and voted_for_id in game_state['captions'] and voted_for_id in get_named_players():
-             vote_counts[voted_for_id] = vote_counts.get(voted_for_id, 0) + 1
+    finished_round = game_state['rounds'][-1] # Recorded by tally_votes()
 
-    named_caption_authors = [p_id for p_id, caption_data in game_state['captions'].items() if p_id in get_named_players() and (caption_data.get('text1') or caption_data.get('text2'))]
-
-    for author_id in named_caption_authors:
-         caption_data = game_state['captions'][author_id]
-         author_name = game_state['players'][author_id]['name']
+    for author_id, caption in finished_round.captions.items():
+         if author_id not in get_named_players() or not caption:
+             continue
          results.append({
              'author_id': author_id,
-             'author_name': author_name,
-             'caption_text1': caption_data.get('text1', ''),
-             'caption_text2': caption_data.get('text2', ''),
-             'votes': vote_counts.get(author_id, 0),
-             'is_winner': (author_id == game_state['winning_caption_id'])
+             'author_name': game_state['players'][author_id].name,
+             'caption_text1': caption.text1,
+             'caption_text2': caption.text2,
+             'votes': finished_round.vote_counts.get(author_id, 0),
+             'is_winner': (author_id == finished_round.winner_id)
          })
 
     results.sort(key=lambda x: x['votes'], reverse=True)
-    sorted_players = sorted([p for p in game_state['players'].values() if p.get('name') != 'Unnamed Player'], key=lambda x: x['score'], reverse=True)
+    sorted_players = sorted([p for p in game_state['players'].values() if p.is_named], key=lambda p: p.score, reverse=True)
 
     is_game_over = game_state['current_round'] >= 5
 
     # --- NEW: If game is over, set the state to 'game_over' now ---
     if is_game_over:
-        print(f"Round {game_state['current_round']} is the final round. Setting state to 'game_over'.")
+        log.info("Round %d is the final round. Setting state to 'game_over'.", game_state['current_round'])
         game_state['state'] = 'game_over'
         game_state['phase_end_time'] = None # Clear timer
+        notify_state_change('phase_changed')
 
     return render_template('round_results.html',
                            game_state=game_state, current_player=current_player,
                            results=results, sorted_players=sorted_players,
                            is_game_over=is_game_over) # is_game_over still used by template to show correct button/message
 
-@app.route('/next_round', methods=['POST'])
+@room_route('/next_round', methods=['POST'])
 def next_round():
     player_id = get_player_id()
     current_player = get_current_player()
-    print(f"Next round request: player_id={player_id}, state={game_state['state']}")
+    log.debug("Next round request: player_id=%s, state=%s", player_id, game_state['state'])
 
     if game_state['state'] == 'round_results' and current_player:
         if game_state['current_round'] < 5:
-            if current_player.get('name') == 'Unnamed Player':
+            if not current_player.is_named:
                flash("Please set your name to proceed."); return redirect(url_for('round_results'))
 
-            players_to_remove = [p_id for p_id, p_data in game_state['players'].items() if p_data.get('name') == 'Unnamed Player']
+            players_to_remove = [p_id for p_id, player in game_state['players'].items() if not player.is_named]
             for p_id in players_to_remove:
-                 print(f"Removing inactive player: {p_id}")
+                 log.debug("Removing inactive player: %s", p_id)
                  if p_id != player_id:
-                    del game_state['players'][p_id]
+                    game_state['players'].remove(p_id)
 
             named_players_count = len(get_named_players())
-            print(f"Checking player count for next round: {named_players_count}")
+            log.debug("Checking player count for next round: %d", named_players_count)
             if named_players_count < 2:
-                 flash("Not enough players to continue. Returning to lobby."); print("Less than 2 named players, resetting game.")
-                 game_state.update({
-                     'players': {}, 'state': 'lobby', 'current_round': 0, 'current_poster': None,
-                     'captions': {}, 'votes': {}, 'posters_used': [], 'winning_caption_id': None,
-                     'phase_end_time': None
-                 })
+                 flash("Not enough players to continue. Returning to lobby."); log.info("Less than 2 named players, resetting game.")
+                 game_state.update(new_game_state())
+                 cancel_phase_deadline()
+                 notify_state_change('game_reset')
                  return redirect(url_for('lobby'))
 
             if start_new_round():
-                print("Starting next round."); return redirect(url_for('writing'))
+                log.debug("Starting next round."); return redirect(url_for('writing'))
             else:
-                 flash("Could not start next round. Check server logs."); print("Failed to start next round.")
+                 flash("Could not start next round. Check server logs."); log.error("Failed to start next round.")
                  return redirect(url_for('round_results'))
         else:
-            print("Game is over, redirecting to game over page."); game_state['state'] = 'game_over'; game_state['phase_end_time'] = None
+            log.debug("Game is over, redirecting to game over page."); game_state['state'] = 'game_over'; game_state['phase_end_time'] = None
+            notify_state_change('phase_changed')
             return redirect(url_for('game_over'))
 
     if not current_player: flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
     else: return redirect(url_for(game_state['state']))
 
 
-@app.route('/game_over')
+@room_route('/game_over')
 def game_over():
     player_id = get_player_id()
     current_player = get_current_player()
@@ -829,28 +2217,42 @@ def game_over():
         if not current_player: flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
         else: return redirect(url_for(game_state['state']))
 
-    final_scores = sorted([p for p in game_state['players'].values() if p.get('name') != 'Unnamed Player'], key=lambda x: x['score'], reverse=True)
+    final_scores = sorted([p for p in game_state['players'].values() if p.is_named], key=lambda p: p.score, reverse=True)
     return render_template('game_over.html', final_scores=final_scores, current_player=current_player)
 
-@app.route('/reset_game', methods=['POST'])
+@room_route('/highlights.zip')
+def download_highlights():
+    """The game's winning captions (every caption with ?all=1) as a ZIP archive, streamed as it renders."""
+    if not get_current_player():
+        flash("Please join the game in the lobby first."); return redirect(url_for('lobby'))
+    if not game_state['rounds']:
+        return "No finished rounds yet", 404
+    # Built from this transaction's copy of the state; the download itself outlives the transaction
+    entries = highlight_reel_entries(game_state['rounds'], game_state['players'], winners_only=not request.args.get('all', type=int))
+    response = Response(stream_highlight_reel(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{current_room().code}-highlights.zip"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no' # Stream through nginx as the images are ready
+    return response
+
+@room_route('/reset_game', methods=['POST'])
 def reset_game():
     player_id = get_player_id()
-    print(f"Resetting game state requested by {player_id}")
-    game_state.update({
-        'players': {}, 'state': 'lobby', 'current_round': 0, 'current_poster': None,
-        'captions': {}, 'votes': {}, 'posters_used': [], 'winning_caption_id': None, 'phase_end_time': None
-    })
+    log.info("Resetting game state requested by %s", player_id)
+    game_state.update(new_game_state())
+    cancel_phase_deadline()
+    notify_state_change('game_reset')
     flash("Game state has been reset. Starting a new game!"); return redirect(url_for('lobby'))
 
 
-@app.route('/wait')
+@room_route('/wait')
 def wait():
      player_id = get_player_id()
      current_player = get_current_player()
      check_and_advance_state_if_timer_expired()
 
      if game_state['state'] != 'writing' and game_state['state'] != 'voting':
-         print(f"Wait page: State is now {game_state['state']}, redirecting player {current_player.get('name', 'Unknown') if current_player else 'Unknown Player'}.")
+         log.debug("Wait page: State is now %s, redirecting player %s.", game_state['state'], current_player.name if current_player else 'Unknown Player')
          return redirect(url_for(game_state['state']))
 
      if not current_player:
@@ -858,21 +2260,15 @@ def wait():
 
      message = "Please wait..."
      if game_state['state'] == 'writing':
-         if not current_player.get('submitted_this_round'):
-             print(f"Wait page: Player {current_player.get('name')} hasn't submitted, redirecting to writing."); return redirect(url_for('writing'))
+         if not current_player.submitted_this_round:
+             log.debug("Wait page: Player %s hasn't submitted, redirecting to writing.", current_player.name); return redirect(url_for('writing'))
          message = "Waiting for other players to submit their captions..."
      elif game_state['state'] == 'voting':
-          if not current_player.get('voted_this_round'):
-              print(f"Wait page: Player {current_player.get('name')} hasn't voted, redirecting to voting."); return redirect(url_for('voting'))
+          if not current_player.voted_this_round:
+              log.debug("Wait page: Player %s hasn't voted, redirecting to voting.", current_player.name); return redirect(url_for('voting'))
           message = "Waiting for other players to vote..."
 
-     players_for_wait_list = []
-     for p_id, p_data in game_state['players'].items():
-          player_entry = p_data.copy()
-          player_entry['player_id'] = p_id
-          players_for_wait_list.append(player_entry)
-
-     sorted_wait_players = sorted(players_for_wait_list, key=lambda x: x.get('name', 'Unnamed Player'))
+     sorted_wait_players = sorted(game_state['players'].values(), key=lambda p: p.name) # The records themselves; nothing is copied
 
      return render_template('wait.html', message=message, game_state=game_state, current_player=current_player, sorted_players=sorted_wait_players, session_id=player_id, refresh_seconds=WAIT_PAGE_REFRESH_SECONDS)
 
@@ -882,13 +2278,133 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 @app.before_request
-def initialize_player_session_and_posters():
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' in g:
+        elapsed = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else 'unmatched' # The pattern, so room codes and IDs don't add series
+        http_requests.inc(method=request.method, route=route, status=response.status_code)
+        http_request_seconds.observe(elapsed, method=request.method, route=route)
+        log.debug("request method=%s route=%s status=%d ms=%.1f", request.method, route, response.status_code, elapsed * 1000)
+    if startup_timing['first_request_ms'] is None:
+        startup_timing['first_request_ms'] = (time.perf_counter() - _app_load_started) * 1000
+        log.info("First request served %.0f ms after the app started loading (poster catalog ready at %.0f ms).",
+                 startup_timing['first_request_ms'], startup_timing['catalog_ms'] or 0)
+    return response
+
+@app.before_request
+def initialize_player_session():
     get_player_id()
-    if not game_state['all_posters']:
-        print("DEBUG: game_state['all_posters'] is empty. Attempting to load posters in before_request...")
-        loaded_posters = load_all_posters()
-        if loaded_posters: game_state['all_posters'] = loaded_posters; print(f"DEBUG: Successfully loaded {len(game_state['all_posters'])} posters in before_request.")
-        else: print("DEBUG: Still no posters loaded after attempt in before_request.")
+
+_placeholders_queued = False
+
+@app.before_request
+def queue_placeholders_on_first_request():
+    """Starts making missing poster placeholders once this process serves, not in CLI commands
+    that merely load the app. Later catalog checks queue whatever is still missing."""
+    global _placeholders_queued
+    if not _placeholders_queued:
+        _placeholders_queued = True
+        queue_missing_placeholders()
+
+
+# --- Game Journal (GAME_STATE_BACKEND=journal, see event_log.py) ---
+
+_recovered_rooms_resumed = False
+
+@app.before_request
+def resume_recovered_rooms():
+    """Re-arms the phase deadlines of rooms recovered from the journal, on this process's first
+    request, so CLI commands that load the app never advance anyone's game."""
+    global _recovered_rooms_resumed
+    if _recovered_rooms_resumed or GAME_STATE_BACKEND != 'journal':
+        return
+    _recovered_rooms_resumed = True # Scheduling is keyed, so a racing first request does no harm
+    for code in state_store.recovery['room_codes']:
+        room = rooms.get(code)
+        if room is not None:
+            run_scheduled_room_job(room, schedule_phase_deadline)
+    if state_store.recovery['room_codes'] and not phase_scheduler.is_scheduled(ROOM_GC_JOB):
+        schedule_room_gc()
+
+def journal_round_history(directory, room_code=None):
+    """Yields (timestamp, room_code, players, Round) for every finished round in the journal, oldest first.
+
+    Includes the rounds of games that were reset or played before a restart.
+    """
+    players, rounds = {}, {}
+    for _, timestamp, kind, code, _, _, changes in event_log.iter_records(directory):
+        if room_code and code != room_code:
+            continue
+        if kind == 'delete':
+            players.pop(code, None)
+            rounds.pop(code, None)
+            continue
+        if 'players' in changes:
+            players[code] = changes['players']
+        if 'rounds' in changes:
+            previous, current = rounds.get(code, []), changes['rounds']
+            for round_record in current[len(previous):]: # Shorter means the game was reset
+                yield timestamp, code, players.get(code), round_record
+            rounds[code] = current
+
+journal_cli = AppGroup('journal', help='Game journal commands (GAME_STATE_BACKEND=journal).')
+
+@journal_cli.command('rounds')
+@click.option('--room', 'room_code', default=None, help='Only this room code.')
+def journal_rounds_command(room_code):
+    """Lists every finished round in the journal, with its winning caption."""
+    count = 0
+    for timestamp, code, players, round_record in journal_round_history(GAME_STATE_JOURNAL_DIR, room_code and room_code.upper()):
+        winner = players.get(round_record.winner_id) if players is not None and round_record.winner_id else None
+        caption = round_record.captions.get(round_record.winner_id)
+        won_by = (f"{winner.name if winner else 'a departed player'}: "
+                  f"{caption.text1!r} / {caption.text2!r} ({round_record.vote_counts.get(round_record.winner_id, 0)} votes)"
+                  if caption else 'no winner')
+        click.echo(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))}  {code}  round {round_record.number}  "
+                   f"{round_record.poster}  {won_by}")
+        count += 1
+    click.echo(f"{count} rounds in {GAME_STATE_JOURNAL_DIR}.")
+
+@journal_cli.command('export')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--room', 'room_code', required=True, help='Room code.')
+@click.option('--all', 'all_captions', is_flag=True, help='Every caption, not just the winners.')
+def journal_export_command(output, room_code, all_captions):
+    """Writes every game a room played, from the journal, as a highlight reel ZIP with a folder per game."""
+    games = [] # [[players, [Round]]]
+    for _, _, players, round_record in journal_round_history(GAME_STATE_JOURNAL_DIR, room_code.upper()):
+        if not games or round_record.number <= games[-1][1][-1].number: # Round numbers restart with each game
+            games.append([players, []])
+        games[-1][0] = players
+        games[-1][1].append(round_record)
+    if not games:
+        raise click.ClickException(f"No finished rounds for room {room_code.upper()} in {GAME_STATE_JOURNAL_DIR}.")
+    entries = []
+    for number, (players, rounds) in enumerate(games, 1):
+        entries += highlight_reel_entries(rounds, players, winners_only=not all_captions, folder=f'game-{number}/')
+    with open(output, 'wb') as f:
+        for chunk in stream_highlight_reel(entries):
+            f.write(chunk)
+    click.echo(f"Wrote {len(games)} games, {sum(len(rounds) for _, rounds in games)} rounds, to {output}.")
+
+app.cli.add_command(journal_cli)
+
+
+# --- Startup ---
+
+if not in_worker_process(): # Render processes only render; their jobs carry resolved paths (see PosterSource)
+    refresh_poster_catalog()
+    startup_timing['catalog_ms'] = (time.perf_counter() - _app_load_started) * 1000
+    schedule_poster_catalog_check()
+    install_sighup_handler()
+if GAME_STATE_BACKEND == 'journal' and not in_worker_process():
+    log.info("Game journal: recovered %d rooms in %.0f ms (snapshot at record %d, then %d records replayed).",
+             state_store.recovery['rooms'], state_store.recovery['ms'], state_store.recovery['snapshot_seq'],
+             state_store.recovery['records_replayed'])
 
 
 if __name__ == '__main__':
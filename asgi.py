@@ -0,0 +1,266 @@
+"""ASGI entry point: the same game, served from an asyncio event loop.
+
+Under gunicorn's sync workers every open /events stream pins a worker, and the lobby and
+wait pages, where players spend most of a game, keep one open the whole time. Threaded
+workers only move the limit to one thread per waiting player. Here:
+
+- /room/<code>/events streams are coroutines parked on GameEventBroker.subscribe_async().
+  An idle player costs a future and a few kilobytes, not a thread, so one process holds
+  thousands of them.
+- Every other request goes to the Flask app unchanged, on a thread pool of
+  ASGI_REQUEST_THREADS. Page rendering, state transactions and the Pillow renders behind
+  /rendered_caption never block the event loop. Caption renders run on the render service's
+  worker processes, as under gunicorn.
+  Bodies the app streams (highlight reel downloads) are sent chunk by chunk as they are
+  produced, not collected first.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --timeout-graceful-shutdown 5
+
+Streams never end on their own, so without a shutdown timeout uvicorn waits for every
+player to leave before it exits. As with gunicorn, run one process with the default in-memory state, or several with
+GAME_STATE_BACKEND=sqlite (uvicorn --workers N).
+"""
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as game_app
+from state_store import RoomNotFoundError, StaleStateError
+
+ASGI_REQUEST_THREADS = 32 # Threads running ordinary Flask requests; each one is short
+ASGI_MAX_BODY_BYTES = 1024 * 1024 # Larger request bodies get a 413; the game only posts small forms
+EVENTS_PATH = re.compile(r'^/room/(?P<room_code>[^/]+)/events$')
+EVENTS_ROUTE = '/room/<room_code>/events' # Label for request metrics, as Flask would report it
+
+request_executor = ThreadPoolExecutor(max_workers=ASGI_REQUEST_THREADS, thread_name_prefix='asgi-request')
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http':
+        match = EVENTS_PATH.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            await serve_event_stream(match['room_code'], receive, send)
+        else:
+            await serve_wsgi(scope, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            request_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_response(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# --- Event Streams ---
+
+def _open_stream(room_code):
+    """(room, version, payload) to start a stream with, or None if the room doesn't exist. Runs on a pool thread."""
+    room = game_app.rooms.get(room_code)
+    if room is None:
+        return None
+    try:
+        return (room, *room.run(game_app.open_event_stream))
+    except RoomNotFoundError:
+        game_app.rooms.forget(room_code)
+        return None
+
+
+async def serve_event_stream(room_code, receive, send):
+    """The /events view (see app.events) as a coroutine."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        opened = await loop.run_in_executor(request_executor, _open_stream, room_code)
+    except StaleStateError:
+        opened, status = None, 503
+    else:
+        status = 200 if opened else 404
+    game_app.http_requests.inc(method='GET', route=EVENTS_ROUTE, status=status)
+    game_app.http_request_seconds.observe(time.perf_counter() - started, method='GET', route=EVENTS_ROUTE)
+    if opened is None:
+        await _send_response(send, status, [(b'content-type', b'text/plain; charset=utf-8')], f'{status}\n'.encode())
+        return
+
+    room, version, payload = opened
+    headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+    headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in game_app.EVENT_STREAM_HEADERS.items()]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+    async def stream():
+        await send_text(f"retry: {game_app.EVENT_STREAM_RETRY_MILLISECONDS}\nevent: state\ndata: {payload}\n\n")
+        # With a shared state store other workers change the room too, so look for their
+        # writes between events instead of only waking up for keepalives
+        shared = game_app.state_store.is_shared
+        wait_seconds = game_app.STATE_SYNC_INTERVAL_SECONDS if shared else game_app.EVENT_STREAM_KEEPALIVE_SECONDS
+        last_sent = time.time()
+        async for event_payload in room.events.subscribe_async(version, wait_seconds):
+            if event_payload is not None:
+                await send_text(f"event: state\ndata: {event_payload}\n\n")
+                last_sent = time.time()
+                continue
+            if shared:
+                try:
+                    await loop.run_in_executor(request_executor, room.sync_events) # Queries the store
+                except RoomNotFoundError:
+                    game_app.rooms.forget(room.code)
+                    return
+            if time.time() - last_sent >= game_app.EVENT_STREAM_KEEPALIVE_SECONDS:
+                await send_text(": keepalive\n\n")
+                last_sent = time.time()
+
+    async def send_text(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    # Servers don't necessarily fail send() once the client is gone, so watch receive() too
+    stream_task = asyncio.ensure_future(stream())
+    disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait((stream_task, disconnect_task), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stream_task.cancel()
+        disconnect_task.cancel()
+    if stream_task.done() and not stream_task.cancelled() and stream_task.exception() is None:
+        await send({'type': 'http.response.body', 'body': b''}) # The room was closed; end the response
+
+
+# --- Everything Else (WSGI on a thread pool) ---
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive):
+    """The request body, or None if the client disconnected. Raises _BodyTooLarge past ASGI_MAX_BODY_BYTES."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY_BYTES:
+            raise _BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def wsgi_environ(scope, body):
+    """A WSGI environ for an ASGI http scope (PEP 3333 strings: latin-1 decoded bytes)."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """Runs one request through the Flask app on a pool thread. Returns (status, headers, chunks, rest).
+
+    chunks is the start of the body. Pages, JSON documents and images are a single chunk, so
+    that's all of it and rest is None. Otherwise (a highlight reel download, see
+    highlight_reel.py, which produces its chunks as images render) rest is
+    (chunk_iterator, wsgi_result), for _send_rest() to carry on with.
+    """
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    result = game_app.app(environ, start_response)
+    try:
+        chunk_iterator = iter(result)
+        chunks = [chunk for chunk in (next(chunk_iterator, None), next(chunk_iterator, None)) if chunk is not None]
+    except BaseException:
+        _close_wsgi_result(result)
+        raise
+    if len(chunks) < 2:
+        _close_wsgi_result(result)
+        return response['status'], response['headers'], chunks, None
+    return response['status'], response['headers'], chunks, (chunk_iterator, result)
+
+
+def _close_wsgi_result(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+async def _send_rest(rest, receive, send):
+    """Sends the rest of a WSGI body chunk by chunk, each read on a pool thread, until it ends
+    or the client disconnects."""
+    loop = asyncio.get_running_loop()
+    chunk_iterator, result = rest
+    disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while not disconnect_task.done():
+            chunk = await loop.run_in_executor(request_executor, next, chunk_iterator, None)
+            if chunk is None:
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        disconnect_task.cancel()
+        await loop.run_in_executor(request_executor, _close_wsgi_result, result) # Not while a pool thread reads it
+
+
+async def serve_wsgi(scope, receive, send):
+    try:
+        body = await _read_body(receive)
+    except _BodyTooLarge:
+        await _send_response(send, 413, [(b'content-type', b'text/plain; charset=utf-8')], b'413\n')
+        return
+    if body is None:
+        return
+    status, headers, chunks, rest = await asyncio.get_running_loop().run_in_executor(
+        request_executor, call_wsgi, wsgi_environ(scope, body))
+    if rest is None:
+        await _send_response(send, status, headers, b''.join(chunks))
+        return
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    for chunk in chunks:
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await _send_rest(rest, receive, send)
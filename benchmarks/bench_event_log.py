@@ -0,0 +1,191 @@
+"""Game journal benchmark: what logging every change costs, and how long recovery takes.
+
+Plays simulated games straight against the state stores (no HTTP): players join and name
+themselves, then each round every player submits a caption and a vote, as the app's
+transactions do, each commit labelled like the app labels it.
+
+  write      per-commit latency with the in-memory store and with the journal store (at
+             each --fsync-intervals), the journal's overhead per commit, and its bytes per
+             record and records per fsync
+  recovery   for each history length in --histories (games played, one room each, idle
+             rooms collected as the app does), the time to rebuild the state store from
+             the journal, with snapshots every SNAPSHOT_EVERY_RECORDS records and without
+             any. The last game is left unfinished, so there is a game in progress to recover.
+
+    python benchmarks/bench_event_log.py [--players 8] [--write-games 20] [--fsync-intervals 0,0.05]
+                                         [--histories 100,1000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+import event_log
+from app import new_game_state
+from records import Caption, Round
+from state_store import InMemoryStateStore, JournaledStateStore
+
+ROUNDS_PER_GAME = 5
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def game_steps(code, players, rounds):
+    """The commits of one game, as (event, mutate(state)) pairs, in the order the app makes them."""
+    player_ids = [f'{code}-{i:04d}-0000-0000-000000000000' for i in range(players)]
+    for i, player_id in enumerate(player_ids):
+        yield 'player_joined', lambda state, p=player_id: state['players'].join(p)
+        yield 'player_renamed', lambda state, p=player_id, i=i: state['players'].rename(p, f'Player {i}')
+    for number in range(1, rounds + 1):
+        def start_round(state, number=number):
+            state['players'].start_round()
+            state.update(state='writing', current_round=number, current_poster=f'posters/{number:03d}.png',
+                         captions={}, winning_caption_id=None, phase_end_time=time.time() + 60)
+            state['posters_used'] = state['posters_used'] + [state['current_poster']]
+        yield 'phase_changed', start_round
+        for player_id in player_ids:
+            def submit(state, p=player_id, number=number):
+                state['captions'][p] = Caption(f'Round {number} title', f'A caption by {p[:8]}, for the record')
+                state['players'].mark_submitted(p)
+            yield 'caption_submitted', submit
+        def start_voting(state):
+            state.update(state='voting', phase_end_time=time.time() + 60)
+            state['players'].start_voting()
+        yield 'phase_changed', start_voting
+        for i, player_id in enumerate(player_ids):
+            yield 'vote_cast', lambda state, p=player_id, a=player_ids[(i + 1) % players]: state['players'].record_vote(p, a)
+        def tally(state, number=number):
+            vote_counts = state['players'].award_votes()
+            winner = max(vote_counts, key=vote_counts.get) if vote_counts else None
+            state['rounds'].append(Round(number, state['current_poster'], state['captions'], vote_counts, winner))
+            state.update(state='round_results', winning_caption_id=winner, phase_end_time=None)
+        yield 'phase_changed', tally
+
+
+def play(store, code, players, rounds, stop_after=None, latencies=None):
+    """Plays one game in a new room; stop_after leaves it unfinished after that many commits."""
+    store.create(code, new_game_state())
+    for index, (event, mutate) in enumerate(game_steps(code, players, rounds)):
+        if stop_after is not None and index >= stop_after:
+            return
+        started = time.perf_counter()
+        with store.transaction(code, [event]) as state:
+            mutate(state)
+        if latencies is not None:
+            latencies.append((time.perf_counter() - started) * 1e6)
+
+
+def measure_writes(players, games, fsync_intervals):
+    scenarios = [('memory', None)] + [('journal', interval) for interval in fsync_intervals]
+    results = {}
+    for backend, interval in scenarios:
+        directory = tempfile.mkdtemp(prefix='bench-event-log-')
+        try:
+            store = InMemoryStateStore() if backend == 'memory' else JournaledStateStore(directory, fsync_interval=interval)
+            latencies = []
+            started = time.perf_counter()
+            for game in range(games):
+                play(store, f'W{game:05d}', players, ROUNDS_PER_GAME, latencies=latencies)
+            if backend == 'journal':
+                store.flush()
+            elapsed = time.perf_counter() - started
+            name = backend if interval is None else f'journal fsync {interval:g}s'
+            results[name] = {'commits': len(latencies), 'mean_us': statistics.fmean(latencies),
+                             'p50_us': percentile(latencies, 50), 'p99_us': percentile(latencies, 99),
+                             'commits_per_second': len(latencies) / elapsed}
+            if backend == 'journal':
+                stats = store.log.stats()
+                results[name].update(bytes_per_record=stats['bytes'] / stats['records'], fsyncs=stats['fsyncs'],
+                                     records_per_fsync=stats['records'] / max(1, stats['fsyncs']), snapshots=stats['snapshots'])
+                store.log.close()
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+def write_history(directory, players, games, snapshot_every):
+    store = JournaledStateStore(directory, snapshot_every=snapshot_every)
+    for game in range(games):
+        code = f'H{game:06d}'
+        finished = game < games - 1
+        play(store, code, players, ROUNDS_PER_GAME, stop_after=None if finished else players * 2 + 3)
+        if finished:
+            store.delete_idle(time.time() + 1) # The app collects idle rooms; the journal keeps their history
+    store.flush()
+    store.log.close()
+    return store.log.stats()
+
+
+def measure_recovery(players, histories):
+    results = []
+    for games in histories:
+        row = {'games': games}
+        for scenario, snapshot_every in (('snapshots', event_log.SNAPSHOT_EVERY_RECORDS), ('no_snapshots', 0)):
+            directory = tempfile.mkdtemp(prefix='bench-event-log-')
+            try:
+                stats = write_history(directory, players, games, snapshot_every)
+                journal_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+                store = JournaledStateStore(directory)
+                recovery = store.recovery
+                if recovery['rooms'] != 1:
+                    raise RuntimeError(f"Recovered {recovery['rooms']} rooms, expected the one game in progress")
+                row[scenario] = {'records': stats['records'], 'journal_mb': journal_bytes / 1e6, 'recovery_ms': recovery['ms'],
+                                 'records_replayed': recovery['records_replayed']}
+            finally:
+                shutil.rmtree(directory)
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=8, help='Players per game.')
+    parser.add_argument('--write-games', type=int, default=20, help='Games played for the write measurements.')
+    parser.add_argument('--fsync-intervals', default=f'0,{event_log.FSYNC_INTERVAL_SECONDS:g}',
+                        help='Comma-separated journal fsync intervals (seconds) to measure writes with.')
+    parser.add_argument('--histories', default='100,1000', help='Comma-separated history lengths (games) to recover.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+    fsync_intervals = [float(i) for i in args.fsync_intervals.split(',')]
+    histories = [int(h) for h in args.histories.split(',')]
+
+    writes = measure_writes(args.players, args.write_games, fsync_intervals)
+    memory_mean = writes['memory']['mean_us']
+    print(f"Writes: {args.write_games} games of {args.players} players, {writes['memory']['commits']} commits per store")
+    print(f"  {'store':<20} {'mean us':>8} {'p50 us':>8} {'p99 us':>8} {'overhead us':>12} {'commits/s':>10} "
+          f"{'B/record':>9} {'records/fsync':>14}")
+    for name, result in writes.items():
+        overhead = f"{result['mean_us'] - memory_mean:.1f}" if name != 'memory' else '-'
+        per_record = f"{result['bytes_per_record']:.0f}" if 'bytes_per_record' in result else '-'
+        per_fsync = f"{result['records_per_fsync']:.1f}" if 'records_per_fsync' in result else '-'
+        print(f"  {name:<20} {result['mean_us']:>8.1f} {result['p50_us']:>8.1f} {result['p99_us']:>8.1f} {overhead:>12} "
+              f"{result['commits_per_second']:>10.0f} {per_record:>9} {per_fsync:>14}")
+
+    recovery = measure_recovery(args.players, histories)
+    print(f"\nRecovery: snapshots every {event_log.SNAPSHOT_EVERY_RECORDS} records vs none")
+    print(f"  {'games':>7} {'records':>9} {'journal MB':>11} {'snapshots ms':>13} {'replayed':>9} {'no snapshots ms':>16} {'replayed':>9}")
+    for row in recovery:
+        with_snapshots, without = row['snapshots'], row['no_snapshots']
+        print(f"  {row['games']:>7} {with_snapshots['records']:>9} {with_snapshots['journal_mb']:>11.1f} "
+              f"{with_snapshots['recovery_ms']:>13.1f} {with_snapshots['records_replayed']:>9} "
+              f"{without['recovery_ms']:>16.1f} {without['records_replayed']:>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'players': args.players, 'cpu_count': os.cpu_count(), 'writes': writes, 'recovery': recovery}, f, indent=1)
+        print(f"\nWrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
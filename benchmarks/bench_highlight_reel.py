@@ -0,0 +1,172 @@
+"""Highlight reel benchmark: does exporting a long game stream, and stay small in memory?
+
+Builds games of each length in --rounds (finished Round records with --captions captions
+each, every caption distinct) and exports every caption as app.download_highlights does,
+consuming the archive as a client would. For each game and each --processes setting it
+reports:
+
+  first byte   seconds until the first image is in the archive (captions.txt comes first)
+  total        seconds for the whole archive, and images per second
+  archive      size of the archive
+  peak held    the peak of Python allocations in this (the server) process while exporting
+               (tracemalloc), which should depend on HIGHLIGHT_REEL_RENDER_WINDOW, not on
+               the game's length. With --processes 0 it includes the renders themselves.
+
+Before that it exports one image whose first render fails, which the retry must put in the
+archive. Exits non-zero if that image is missing, if any archive doesn't hold every image,
+or if, at any --processes setting, the longest game's peak is more than --max-peak-growth
+times the shortest game's.
+
+    python benchmarks/bench_highlight_reel.py [--rounds 5,40] [--captions 8] [--processes 0,2]
+                                              [--json out.json]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+import app as game_app
+import highlight_reel
+from records import Caption, Round
+from render_service import RenderService
+from roster import Roster
+
+
+def make_game(rounds, captions):
+    players = Roster()
+    author_ids = [f'{i:08d}-0000-0000-0000-000000000000' for i in range(captions)]
+    for i, author_id in enumerate(author_ids):
+        players.join(author_id)
+        players.rename(author_id, f'Player {i}')
+    records = []
+    for number in range(1, rounds + 1):
+        poster = game_app.all_posters[number % len(game_app.all_posters)]
+        round_captions = {a: Caption(f'Round {number}, caption {i}', f'Written by player {i} for the highlight reel')
+                          for i, a in enumerate(author_ids)}
+        records.append(Round(number, poster, round_captions, {a: i % 3 for i, a in enumerate(author_ids)}, author_ids[0]))
+    return records, players
+
+
+def export(records, players):
+    entries = game_app.highlight_reel_entries(records, players, winners_only=False)
+    images = len(entries) - 1
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_image, size = None, 0
+    with tempfile.TemporaryFile() as archive: # Kept to check it, on disk rather than in the traced heap
+        for chunk in game_app.stream_highlight_reel(entries):
+            size += len(chunk)
+            archive.write(chunk)
+            if first_image is None and size > len(entries[0].data) + 1024:
+                first_image = time.perf_counter() - started
+        total = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        names = zipfile.ZipFile(archive).namelist()
+    return {'images': images, 'first_image_s': first_image, 'total_s': total, 'images_per_second': images / total,
+            'archive_mb': size / 1e6, 'peak_mb': peak / 1e6, 'complete': len(names) == len(entries) and 'missing.txt' not in names}
+
+
+class LingeringRenderService(RenderService):
+    """Keeps each finished job's key running for a moment after its on_done returns, so a retry
+    submitted as soon as on_done wakes the export reliably lands while it's still held."""
+
+    def _finish(self, job, count, result):
+        if job.on_done:
+            on_done = job.on_done
+            def then_linger(result):
+                on_done(result)
+                time.sleep(0.5)
+            job.on_done = then_linger
+        super()._finish(job, count, result)
+
+
+def check_retry():
+    """True if an image whose first render fails is in the archive, from the second attempt."""
+    calls = []
+    def flaky_render():
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            raise RuntimeError("the first attempt fails")
+        return b'rendered on the second attempt'
+    service = LingeringRenderService(0, game_app.RENDER_QUEUE_MAX_JOBS, game_app.RENDER_JOB_TIMEOUT_SECONDS)
+    entries = [highlight_reel.ReelEntry('image.jpg', job=(flaky_render, ()))]
+    render_log = logging.getLogger('render_service')
+    level = render_log.level
+    render_log.setLevel(logging.CRITICAL) # The forced failure's traceback isn't news
+    try:
+        archive = b''.join(highlight_reel.stream_zip(entries, service, 0, 1, wait_seconds=10))
+    finally:
+        render_log.setLevel(level)
+    names = zipfile.ZipFile(io.BytesIO(archive)).namelist()
+    return len(calls) == 2 and names == ['image.jpg']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', default='5,40', help='Comma-separated game lengths (rounds).')
+    parser.add_argument('--captions', type=int, default=8, help='Captions per round.')
+    parser.add_argument('--processes', default=f'0,{game_app.RENDER_PROCESSES}',
+                        help='Comma-separated render process counts (0: threads of this process).')
+    parser.add_argument('--max-peak-growth', type=float, default=2, help="Allowed ratio of the longest game's peak to the shortest's.")
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+    if not game_app.all_posters:
+        parser.error("no posters in static/posters")
+
+    retried = check_retry()
+    results = []
+    for processes in (int(p) for p in args.processes.split(',')):
+        game_app.render_service = RenderService(processes, game_app.RENDER_QUEUE_MAX_JOBS, game_app.RENDER_JOB_TIMEOUT_SECONDS,
+                                                preload=('app',), niceness=game_app.RENDER_PROCESS_NICENESS)
+        game_app.HIGHLIGHT_REEL_RENDER_WINDOW = 2 * max(1, processes)
+        game_app.render_service.submit('warm-up', game_app.warm_poster_cache, (game_app.poster_source(game_app.all_posters[0]),), 0)
+        game_app.render_service.wait_idle(120) # Worker processes started before anything is timed
+        for rounds in (int(r) for r in args.rounds.split(',')):
+            result = export(*make_game(rounds, args.captions))
+            results.append({'processes': processes, 'rounds': rounds, 'window': game_app.HIGHLIGHT_REEL_RENDER_WINDOW, **result})
+
+    print(f"Every caption of games with {args.captions} captions per round, {os.cpu_count()} CPUs")
+    print(f"  {'processes':>9} {'rounds':>6} {'images':>6} {'window':>6} {'first s':>8} {'total s':>8} {'images/s':>9} "
+          f"{'archive MB':>11} {'peak MB':>8}")
+    for r in results:
+        print(f"  {r['processes']:>9} {r['rounds']:>6} {r['images']:>6} {r['window']:>6} {r['first_image_s']:>8.2f} "
+              f"{r['total_s']:>8.2f} {r['images_per_second']:>9.1f} {r['archive_mb']:>11.1f} {r['peak_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'captions': args.captions, 'cpu_count': os.cpu_count(), 'results': results}, f, indent=1)
+        print(f"\nWrote {args.json}")
+
+    failed = False
+    if not retried:
+        print("FAIL: an image whose first render failed isn't in the archive")
+        failed = True
+    for r in results:
+        if not r['complete']:
+            print(f"FAIL: the {r['rounds']}-round archive with {r['processes']} processes is missing images")
+            failed = True
+    for processes in {r['processes'] for r in results}:
+        runs = sorted((r for r in results if r['processes'] == processes), key=lambda r: r['rounds'])
+        shortest, longest = runs[0], runs[-1]
+        if longest['peak_mb'] > args.max_peak_growth * shortest['peak_mb']:
+            print(f"FAIL: with {processes} processes, exporting {longest['rounds']} rounds held {longest['peak_mb']:.1f} MB, "
+                  f"{shortest['rounds']} rounds {shortest['peak_mb']:.1f} MB")
+            failed = True
+    if not failed:
+        print("\nOK: every archive is complete (a failed render included, on its retry), and memory held doesn't grow "
+              "with the game's length")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""Idle connection benchmark: how many waiting players one server process can hold.
+
+Starts a server, opens a room and connects --connections clients to its /events stream, as
+players sitting on the lobby or wait page do. For each deployment it reports:
+
+  served       streams that received their first event within --timeout (the rest are
+               stuck in the accept queue behind busy workers). A single-threaded worker
+               answers /events with the current state and ends the response; those
+               connections are closed on the spot, as a browser does, and count as served
+  rss          server memory (all of its processes) with the streams open, and per stream
+  probe        latency of an ordinary page request while the streams are open
+  fan-out      time from a player joining until every served stream has the update (for
+               answered-and-ended connections: until reconnecting after the server's
+               retry delay, as a browser does, returns the new state)
+
+Deployments (--servers):
+
+  sync       gunicorn, one single-threaded sync worker (/events falls back to polling)
+  gthread    gunicorn, one worker with --threads threads (gunicorn.conf.py's deployment)
+  asgi       uvicorn asgi:app, one process (see asgi.py)
+
+    python benchmarks/bench_idle.py [--connections 100,1000] [--servers sync,gthread,asgi]
+                                    [--threads 64] [--timeout 5] [--json out.json]
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONNECT_BATCH = 200 # Connections opened at once, so the listen backlog isn't the limit being measured
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(server, port, threads):
+    if server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--log-level', 'warning', '--no-access-log', '--backlog', str(CONNECT_BATCH * 4), '--timeout-graceful-shutdown', '5']
+    worker_threads = threads if server == 'gthread' else 1
+    return [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(worker_threads), '--worker-class', server,
+            '--bind', f'127.0.0.1:{port}', '--timeout', '300', '--graceful-timeout', '5', '--backlog', str(CONNECT_BATCH * 4), 'app:app']
+
+
+def start_server(server, threads):
+    """Starts a server on a free port and waits until it answers. Returns (process, port)."""
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    process = subprocess.Popen(server_command(server, port, threads), cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} server exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{server} server did not start within 30s")
+
+
+def process_tree_rss_mb(root_pid):
+    """Resident memory of a process and all its descendants (gunicorn's master and workers), from /proc."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as f:
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    pids, frontier = {root_pid}, [root_pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [pid for pid, ppid in parents.items() if ppid == parent and pid not in pids]
+        pids.update(children)
+        frontier.extend(children)
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            continue
+    return total_kb / 1024
+
+
+class Player:
+    """A browser with a session cookie, for the requests around the streams."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, path, data=None, timeout=10):
+        """Returns (status, Location header, elapsed ms), or (None, None, elapsed ms) on a timeout."""
+        started = time.perf_counter()
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=timeout) as response:
+                response.read()
+                status, location = response.status, response.headers.get('Location')
+        except urllib.error.HTTPError as e:
+            status, location = e.code, e.headers.get('Location')
+        except OSError:
+            status, location = None, None
+        return status, location, (time.perf_counter() - started) * 1000
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+async def open_stream(port, path, timeout):
+    """Connects and waits for the first event. Returns (reader, writer, event), or None if it wasn't served in time.
+
+    If the server ended the response after that event, the connection is closed here and
+    reader and writer are None: gunicorn's sync worker lingers on a connection until the
+    client closes it, as browsers do once a response ends.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    # HTTP/1.0, so the stream isn't chunked and events can be read straight off the socket
+    writer.write(f'GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        if b' 200 ' not in head.split(b'\r\n', 1)[0]:
+            raise OSError(head.split(b'\r\n', 1)[0].decode())
+        event = await asyncio.wait_for(read_event(reader, b'"reason": "connected"'), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        writer.close()
+        return None
+    if b'\r\ncontent-length:' in head.lower(): # Not a stream: the server answered and ended the response
+        writer.close()
+        return None, None, event
+    return reader, writer, event
+
+
+async def read_event(reader, marker):
+    """Reads events until one contains marker, and returns it."""
+    while True:
+        event = await reader.readuntil(b'\n\n')
+        if marker in event:
+            return event
+
+
+async def poll_update(port, path, event, timeout):
+    """Reconnects, after the retry delay the server sent, until the state differs from event's."""
+    retry = next((int(line[6:]) for line in event.split(b'\n') if line.startswith(b'retry:')), 1000)
+    state = event.rsplit(b'data:', 1)[1]
+    while True:
+        await asyncio.sleep(retry / 1000)
+        stream = await open_stream(port, path, timeout)
+        if stream is not None and stream[2].rsplit(b'data:', 1)[1] != state:
+            return
+
+
+async def measure(server, port, connections, timeout):
+    host = Player(f'http://127.0.0.1:{port}')
+    status, location, _ = host.request('/rooms', data={})
+    if status != 302:
+        raise RuntimeError(f"Creating a room returned {status}")
+    room_path = urllib.parse.urlparse(location).path.rsplit('/', 1)[0]
+    rss_before = process_tree_rss_mb(server.pid)
+
+    started = time.perf_counter()
+    streams = []
+    for batch_start in range(0, connections, CONNECT_BATCH):
+        batch = min(CONNECT_BATCH, connections - batch_start)
+        streams += await asyncio.gather(*(open_stream(port, f'{room_path}/events', timeout) for _ in range(batch)))
+    served = [s for s in streams if s is not None]
+    connect_seconds = time.perf_counter() - started
+    try:
+        await asyncio.sleep(1) # Let the server settle before reading its memory
+        rss_after = process_tree_rss_mb(server.pid)
+
+        loop = asyncio.get_running_loop()
+        probe_status, _, probe_ms = await loop.run_in_executor(None, lambda: host.request('/', timeout=timeout))
+
+        # A player joining is pushed to every stream
+        fan_out_ms = []
+        async def await_update(reader, event):
+            try:
+                if reader is None:
+                    await asyncio.wait_for(poll_update(port, f'{room_path}/events', event, timeout), timeout)
+                else:
+                    await asyncio.wait_for(read_event(reader, b'"reason": "player_joined"'), timeout)
+                fan_out_ms.append((time.perf_counter() - joined) * 1000)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+        player = Player(f'http://127.0.0.1:{port}')
+        waiters = [asyncio.ensure_future(await_update(reader, event)) for reader, _, event in served]
+        joined = time.perf_counter()
+        join_status, _, _ = await loop.run_in_executor(None, lambda: player.request(f'{room_path}/lobby', timeout=timeout))
+        await asyncio.gather(*waiters)
+    finally:
+        for _, writer, _ in served:
+            if writer is not None:
+                writer.close()
+    return {
+        'connections': connections,
+        'served': len(served),
+        'connect_seconds': connect_seconds,
+        'rss_before_mb': rss_before,
+        'rss_after_mb': rss_after,
+        'kb_per_stream': (rss_after - rss_before) * 1024 / len(served) if served else None,
+        'probe_status': probe_status,
+        'probe_ms': probe_ms if probe_status == 200 else None,
+        'join_status': join_status,
+        'fan_out_received': len(fan_out_ms),
+        'fan_out_p50_ms': statistics.median(fan_out_ms) if fan_out_ms else None,
+        'fan_out_max_ms': max(fan_out_ms) if fan_out_ms else None,
+    }
+
+
+def format_ms(value):
+    return f'{value:.0f}' if value is not None else 'timeout'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', default='100,1000', help='Comma-separated numbers of streams to hold, one run each.')
+    parser.add_argument('--servers', default='sync,gthread,asgi', help='Comma-separated deployments: sync, gthread, asgi.')
+    parser.add_argument('--threads', type=int, default=64, help='Threads for the gthread deployment.')
+    parser.add_argument('--timeout', type=float, default=5, help='Seconds a stream or request may wait to be served.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+    servers = args.servers.split(',')
+    unknown = [s for s in servers if s not in ('sync', 'gthread', 'asgi')]
+    if unknown:
+        parser.error(f"unknown servers: {', '.join(unknown)}")
+    counts = [int(c) for c in args.connections.split(',')]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)) # One socket per stream; servers inherit it
+    if max(counts) + 64 > hard:
+        parser.error(f"--connections {max(counts)} needs more file descriptors than the limit of {hard}")
+
+    results = {}
+    print(f"{os.cpu_count()} CPUs; each stream must get its first event within {args.timeout:g}s")
+    print(f"  {'server':<8} {'streams':>8} {'served':>7} {'connect s':>10} {'rss MB':>7} {'KB/stream':>10} "
+          f"{'probe ms':>9} {'fan-out p50':>12} {'fan-out max':>12}")
+    for server in servers:
+        results[server] = []
+        for count in counts:
+            process, port = start_server(server, args.threads) # A fresh server per run, so memory isn't carried over
+            try:
+                run = asyncio.run(measure(process, port, count, args.timeout))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            results[server].append(run)
+            per_stream = f"{run['kb_per_stream']:.1f}" if run['kb_per_stream'] is not None else '-'
+            print(f"  {server:<8} {count:>8} {run['served']:>7} {run['connect_seconds']:>10.1f} {run['rss_after_mb']:>7.0f} "
+                  f"{per_stream:>10} {format_ms(run['probe_ms']):>9} {format_ms(run['fan_out_p50_ms']):>12} "
+                  f"{format_ms(run['fan_out_max_ms']):>12}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'timeout': args.timeout, 'threads': args.threads, 'servers': results}, f, indent=1)
+        print(f"\nWrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Game state memory benchmark: bytes per player and per room, dict records vs. slotted records.
+
+Builds rooms whose round has just been tallied (every player named, with a caption and a
+vote in) two ways and measures them with tracemalloc, plus the pickled size a shared state
+store writes per room:
+
+  dicts    - the previous layout: a dict per player and per caption, and a separate copy of
+             the player's ID string wherever it was stored (each request decoded its own)
+  records  - Roster of Player records, Caption records, interned IDs, the round's Round record
+
+    python benchmarks/bench_memory.py [--rooms 200] [--players 8,50]
+"""
+import argparse
+import os
+import pickle
+import sys
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from records import Caption, Player, Round, intern_id # noqa: E402
+from roster import Roster # noqa: E402
+
+
+def fresh(player_id):
+    """A new string object equal to player_id, like one decoded from a request's session cookie."""
+    return str(uuid.UUID(player_id))
+
+
+def dict_room(ids):
+    state = {'players': {}, 'captions': {}, 'votes': {}}
+    for i, p_id in enumerate(ids):
+        state['players'][fresh(p_id)] = {'name': f'Player {i}', 'score': 0, 'submitted_this_round': True, 'voted_this_round': True}
+    for i, p_id in enumerate(ids):
+        state['captions'][fresh(p_id)] = {'text1': f'top {i}', 'text2': f'bottom {i}'}
+    for i, p_id in enumerate(ids):
+        state['votes'][fresh(p_id)] = fresh(ids[(i + 1) % len(ids)])
+        state['players'][p_id]['score'] += 1
+    return state
+
+
+def record_room(ids):
+    roster = Roster()
+    state = {'players': roster, 'captions': {}, 'rounds': []}
+    for i, p_id in enumerate(ids):
+        p_id = intern_id(fresh(p_id))
+        roster.join(p_id)
+        roster.rename(p_id, f'Player {i}')
+    roster.start_round()
+    for i, p_id in enumerate(ids):
+        p_id = intern_id(fresh(p_id))
+        state['captions'][p_id] = Caption(f'top {i}', f'bottom {i}')
+        roster.mark_submitted(p_id)
+    roster.start_voting()
+    for i, p_id in enumerate(ids):
+        roster.record_vote(intern_id(fresh(p_id)), fresh(ids[(i + 1) % len(ids)]))
+    counts = roster.award_votes()
+    state['rounds'].append(Round(1, 'posters/001.png', state['captions'], counts, None))
+    return state
+
+
+def measure(build, rooms, players):
+    ids = [[str(uuid.uuid4()) for _ in range(players)] for _ in range(rooms)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    states = [build(room_ids) for room_ids in ids]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    pickled = sum(len(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)) for state in states) / rooms
+    return allocated / rooms, pickled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=200, help='Rooms built per measurement.')
+    parser.add_argument('--players', default='8,50', help='Comma-separated players per room.')
+    args = parser.parse_args()
+
+    player_dict = {'name': 'Player 0', 'score': 0, 'submitted_this_round': True, 'voted_this_round': True}
+    caption_dict = {'text1': 'top', 'text2': 'bottom'}
+    print(f"Per object: player dict {sys.getsizeof(player_dict)} B, Player {sys.getsizeof(Player('x'))} B; "
+          f"caption dict {sys.getsizeof(caption_dict)} B, Caption {sys.getsizeof(Caption('top', 'bottom'))} B")
+    print(f"{'players':>8} {'layout':>8} {'bytes/room':>11} {'bytes/player':>13} {'pickled/room':>13}")
+    for players in (int(p) for p in args.players.split(',')):
+        for name, build in (('dicts', dict_room), ('records', record_room)):
+            per_room, pickled = measure(build, args.rooms, players)
+            print(f"{players:>8} {name:>8} {per_room:>11,.0f} {per_room / players:>13,.0f} {pickled:>13,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Caption rendering benchmark: latency, memory and output size across every poster.
+
+Renders and encodes a corpus of short, long and multi-line captions on each poster in
+static/posters, in each encoding, exactly as the background render pool does
+(produce_caption_image: render_caption_on_image, then encode). Reports p50/p95/max latency
+per stage, peak RSS and output bytes per encoding.
+
+--jobs runs the whole corpus once per listed worker count, with a process pool for counts
+above 1, to show how throughput scales with cores. --json writes the results for comparing
+between commits, and --compare prints how this run differs from such a file.
+
+    python benchmarks/bench_render.py [--posters 0] [--encodings webp,jpeg] [--mode composite|overlay]
+                                      [--jobs 1,2,4] [--json out.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # Keep per-render debug logging out of the timings; pool workers inherit it
+
+import app as game_app # noqa: E402
+
+# (name, text1, text2): what players actually type, from one word to the longest the form allows
+CAPTIONS = [
+    ('short', 'Be honest', 'Even when it hurts.'),
+    ('long', 'Some things are better left unsaid, especially at the dinner table with the bishop',
+     'When your mother asks who ate the last of the funeral potatoes, look her in the eye and blame '
+     'the missionaries. They will understand. They always understand. That is their calling.'),
+    ('multiline', 'Line one\nLine two\n\nLine four', 'First\nSecond\n \nFourth, after a blank line'),
+    ('single-word', 'Antidisestablishmentarianism', 'Supercalifragilisticexpialidocious'),
+]
+STAGES = ('poster', 'layout', 'draw', 'encode', 'total')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(values):
+    return {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'max': max(values), 'mean': statistics.fmean(values)}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KB on Linux
+
+
+def render_poster(poster_path, encodings, mode):
+    """Every caption in every encoding on one poster. Returns (samples, peak RSS in MB)."""
+    source = game_app.poster_source(game_app.poster_render_source(poster_path))
+    layers = ('title', 'body') if mode == 'overlay' else (None,)
+    samples = []
+    for caption_name, text1, text2 in CAPTIONS:
+        for encoding in encodings:
+            for layer in layers:
+                started = time.perf_counter()
+                result = game_app.produce_caption_image(source, text1, text2, encoding, layer)
+                total_ms = (time.perf_counter() - started) * 1000
+                if result is None:
+                    raise RuntimeError(f"Rendering {caption_name!r} on {poster_path} as {encoding} failed")
+                data, _, timings = result
+                samples.append({'poster_path': poster_path, 'caption': caption_name, 'layer': layer,
+                                'encoding': f'{encoding} overlay' if layer else encoding,
+                                'bytes': len(data), **timings, 'total': total_ms})
+    game_app.poster_image_cache.clear() # Each poster is decoded once, as in a real round; don't hoard them
+    return samples, peak_rss_mb()
+
+
+def run_corpus(posters, encodings, mode, jobs):
+    started = time.perf_counter()
+    if jobs <= 1:
+        results = [render_poster(poster, encodings, mode) for poster in posters]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(render_poster, posters, [encodings] * len(posters), [mode] * len(posters)))
+    wall_seconds = time.perf_counter() - started
+
+    samples = [sample for poster_samples, _ in results for sample in poster_samples]
+    by_encoding = {}
+    for encoding in sorted({s['encoding'] for s in samples}):
+        sizes = [s['bytes'] for s in samples if s['encoding'] == encoding]
+        by_encoding[encoding] = {'count': len(sizes), 'bytes': summarize(sizes),
+                                 'encode_ms': summarize([s['encode'] for s in samples if s['encoding'] == encoding])}
+    return {
+        'jobs': jobs,
+        'renders': len(samples),
+        'wall_seconds': wall_seconds,
+        'renders_per_second': len(samples) / wall_seconds,
+        'peak_rss_mb': max(rss for _, rss in results), # Per process: the main one, or the largest worker
+        'latency_ms': {stage: summarize([s.get(stage, 0.0) for s in samples]) for stage in STAGES},
+        'by_encoding': by_encoding,
+        'by_caption': {name: summarize([s['total'] for s in samples if s['caption'] == name]) for name, _, _ in CAPTIONS},
+        'slowest': sorted(({k: s[k] for k in ('poster_path', 'caption', 'encoding', 'total')} for s in samples),
+                          key=lambda s: s['total'], reverse=True)[:5],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run, out, baseline_run=None):
+    print(f"\njobs={run['jobs']}: {run['renders']} renders in {run['wall_seconds']:.1f}s "
+          f"({run['renders_per_second']:.1f}/s), peak RSS {run['peak_rss_mb']:.0f} MB", file=out)
+    print(f"  {'stage':<8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}" + (f" {'p50 vs base':>12} {'p95 vs base':>12}" if baseline_run else ''), file=out)
+    for stage, stats in run['latency_ms'].items():
+        line = f"  {stage:<8} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['max']:>9.1f}"
+        base = baseline_run and baseline_run['latency_ms'].get(stage)
+        if base:
+            line += ''.join(f" {change(stats[k], base[k]):>12}" for k in ('p50', 'p95'))
+        print(line, file=out)
+    print(f"  {'encoding':<13} {'count':>6} {'mean bytes':>11} {'max bytes':>10} {'encode p50':>11} {'encode p95':>11}", file=out)
+    for encoding, stats in run['by_encoding'].items():
+        print(f"  {encoding:<13} {stats['count']:>6} {stats['bytes']['mean']:>11,.0f} {stats['bytes']['max']:>10,} "
+              f"{stats['encode_ms']['p50']:>9.1f}ms {stats['encode_ms']['p95']:>9.1f}ms", file=out)
+    print("  by caption (total p50 / p95 ms): " + ', '.join(
+        f"{name} {stats['p50']:.0f}/{stats['p95']:.0f}" for name, stats in run['by_caption'].items()), file=out)
+    print("  slowest: " + ', '.join(f"{s['poster_path']} {s['caption']} {s['encoding']} {s['total']:.0f}ms" for s in run['slowest'][:3]), file=out)
+
+
+def change(value, base):
+    return f"{(value - base) / base * 100:+.0f}%" if base else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posters', type=int, default=0, help='Only the first N posters (0: all of them).')
+    parser.add_argument('--encodings', help="Comma-separated encodings (default: webp,jpeg; overlays: webp,png). "
+                                             "Composite PNG is slow: ~2s per render.")
+    parser.add_argument('--mode', choices=('composite', 'overlay'), default='composite',
+                        help='Full poster images, or just the text layers (see CAPTION_DELIVERY_MODE).')
+    parser.add_argument('--jobs', default='1', help='Comma-separated worker process counts to run the corpus with.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    parser.add_argument('--compare', help='A previous --json file to report changes against.')
+    args = parser.parse_args()
+    encoding_table = game_app.OVERLAY_ENCODINGS if args.mode == 'overlay' else game_app.CAPTION_ENCODINGS
+    encodings = args.encodings.split(',') if args.encodings else [e for e in encoding_table if e != 'png' or args.mode == 'overlay']
+    unknown = [e for e in encodings if e not in encoding_table]
+    if unknown:
+        parser.error(f"unknown encodings for {args.mode} mode: {', '.join(unknown)}")
+
+    posters = list(game_app.all_posters) # Sorted, from the poster catalog
+    if args.posters:
+        posters = posters[:args.posters]
+    if not posters:
+        print("No posters found in static/posters.")
+        return 1
+    settings = {'posters': len(posters), 'captions': [name for name, _, _ in CAPTIONS], 'encodings': encodings, 'mode': args.mode}
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline_report = json.load(f)
+        baseline = {run['jobs']: run for run in baseline_report['runs']}
+        print(f"Comparing against {args.compare} (commit {baseline_report.get('commit') or 'unknown'})")
+        if baseline_report.get('settings') != settings:
+            print(f"  Note: it was run with different settings: {baseline_report.get('settings')}")
+
+    print(f"{len(posters)} posters x {len(CAPTIONS)} captions x {len(encodings)} encodings ({args.mode}), "
+          f"{os.cpu_count()} CPUs, commit {git_commit() or 'unknown'}")
+    runs = []
+    for jobs in (int(j) for j in args.jobs.split(',')):
+        run = run_corpus(posters, encodings, args.mode, jobs)
+        if runs:
+            run['speedup'] = run['renders_per_second'] / runs[0]['renders_per_second']
+        runs.append(run)
+        print_run(run, sys.stdout, baseline and baseline.get(jobs))
+        if 'speedup' in run:
+            print(f"  {run['speedup']:.2f}x the throughput of jobs={runs[0]['jobs']}")
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'cpu_count': os.cpu_count(),
+            'settings': settings,
+            'runs': runs,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f"\nWrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
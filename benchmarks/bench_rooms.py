@@ -0,0 +1,86 @@
+"""Room scaling benchmark: request latency and memory as the number of open rooms grows.
+
+Opens increasing numbers of idle rooms in one process and times requests against a room
+with a game in progress, through the Flask test client (no network). Latency should stay
+flat with the room count, since every request only touches its own room.
+
+    python benchmarks/bench_rooms.py [--counts 1,10,100,1000,5000] [--requests 500]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+import app as game_app # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_requests(client, urls, count):
+    """Issues count GETs cycling through urls; returns per-request latencies in ms."""
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        response = client.get(urls[i % len(urls)])
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{urls[i % len(urls)]} returned {response.status_code}")
+    return latencies
+
+
+def open_idle_rooms(count):
+    for _ in range(count):
+        game_app.rooms.create()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', default='1,10,100,1000,5000', help='Comma-separated room counts to measure at.')
+    parser.add_argument('--requests', type=int, default=500, help='Requests timed at each room count.')
+    args = parser.parse_args()
+    counts = sorted(int(c) for c in args.counts.split(','))
+
+    # Keep per-request console chatter out of the timings
+    sys.stdout, real_stdout = open(os.devnull, 'w'), sys.stdout
+    try:
+        host = game_app.app.test_client()
+        guest = game_app.app.test_client()
+        lobby_url = host.post('/rooms').location
+        base = lobby_url.rsplit('/', 1)[0]
+        for client, name in ((host, 'Host'), (guest, 'Guest')):
+            client.post(base + '/lobby', data={'player_name': name})
+        urls = [base + '/game_state_check', base + '/lobby']
+
+        results = []
+        for count in counts:
+            open_idle_rooms(max(0, count - len(game_app.rooms)))
+            time_requests(host, urls, 50) # Warm up
+            latencies = time_requests(host, urls, args.requests)
+            results.append((len(game_app.rooms), statistics.median(latencies), percentile(latencies, 95), max(latencies)))
+
+        # Memory per idle room, measured once over a fixed batch
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        open_idle_rooms(1000)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        bytes_per_room = sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / 1000
+    finally:
+        sys.stdout = real_stdout
+
+    print(f"Memory per idle room: {bytes_per_room:,.0f} bytes")
+    print(f"{'rooms':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for rooms_open, p50, p95, worst in results:
+        print(f"{rooms_open:>8} {p50:>8.2f} {p95:>8.2f} {worst:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
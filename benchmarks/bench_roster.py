@@ -0,0 +1,119 @@
+"""Roster micro-benchmark: cost of a voting round's checks at 10/100/1000 players.
+
+Plays one round's submissions and votes straight against a Roster (no Flask), running the
+"has everyone submitted/voted?" check after each one the way the views do, then tallies.
+The same work is timed against the list scans the roster replaced (kept below as the
+baseline), which rebuild the named-player list for every membership test.
+
+The baseline's checks cost O(players^2) each, so a full round is cubic (about 90 s at 1000
+players). Only --sample submissions, votes and tallied votes, spread evenly over the round,
+are timed, and the round's time is extrapolated from them; the rest are still applied, so
+each timed check sees the state it would in a full round. Rounds of --sample players or
+fewer are timed in full.
+
+    python benchmarks/bench_roster.py [--counts 10,100,1000] [--repeat 3] [--sample 20]
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from roster import Roster # noqa: E402
+
+
+# --- Baseline: the per-call scans over a plain players dict ---
+
+def scan_named(players):
+    return [p_id for p_id, p in players.items() if p.get('name') and p['name'] != 'Unnamed Player']
+
+
+def scan_all_submitted(players, captions):
+    named = scan_named(players)
+    return bool(named) and all(captions.get(p_id) for p_id in named)
+
+
+def scan_all_voted(players, captions):
+    authors = [p_id for p_id in captions if p_id in scan_named(players)]
+    return all(players[p_id]['voted_this_round'] for p_id in authors)
+
+
+def scan_tally(players, captions, votes):
+    counts = {}
+    for voter_id, author_id in votes.items():
+        if voter_id in scan_named(players) and author_id in captions and author_id in scan_named(players):
+            counts[author_id] = counts.get(author_id, 0) + 1
+    for author_id, count in counts.items():
+        players[author_id]['score'] += count
+    return counts
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def baseline_round(ids, sample):
+    """Seconds for the baseline's round, extrapolated from `sample` operations per phase."""
+    players = {p_id: {'name': f'Player {p_id}', 'score': 0, 'submitted_this_round': False, 'voted_this_round': False} for p_id in ids}
+    captions, votes = {}, {}
+    step = max(1, len(ids) // sample)
+    sampled = range(0, len(ids), step)
+    scale = len(ids) / len(sampled)
+    submit_seconds = vote_seconds = 0.0
+    for i, p_id in enumerate(ids):
+        captions[p_id] = {'text1': 'top', 'text2': 'bottom'}
+        players[p_id]['submitted_this_round'] = True
+        if i % step == 0:
+            submit_seconds += timed(scan_all_submitted, players, captions)
+    for i, p_id in enumerate(ids):
+        votes[p_id] = ids[(i + 1) % len(ids)]
+        players[p_id]['voted_this_round'] = True
+        if i % step == 0:
+            vote_seconds += timed(scan_all_voted, players, captions)
+    # Every vote costs the tally the same two scans, so a sample of them scales up too
+    tally_seconds = timed(scan_tally, players, captions, dict(itertools.islice(votes.items(), 0, None, step)))
+    return (submit_seconds + vote_seconds + tally_seconds) * scale
+
+
+def roster_round(ids):
+    roster = Roster()
+    for p_id in ids:
+        roster.join(p_id)
+        roster.rename(p_id, f'Player {p_id}')
+    roster.start_round()
+    started = time.perf_counter()
+    for p_id in ids:
+        roster.mark_submitted(p_id)
+        roster.all_submitted()
+    roster.start_voting()
+    for i, p_id in enumerate(ids):
+        roster.record_vote(p_id, ids[(i + 1) % len(ids)])
+        roster.all_voted()
+    roster.award_votes()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', default='10,100,1000', help='Comma-separated player counts.')
+    parser.add_argument('--repeat', type=int, default=3, help='Roster rounds timed per count (best is reported).')
+    parser.add_argument('--sample', type=int, default=20, help='Baseline operations timed per phase; the rest are extrapolated.')
+    args = parser.parse_args()
+    if args.sample < 1:
+        parser.error("--sample must be at least 1")
+
+    print(f"{'players':>8} {'scan ms':>10} {'roster ms':>10} {'speedup':>8} {'roster us/op':>13}")
+    for count in (int(c) for c in args.counts.split(',')):
+        ids = [f'{i:08x}' for i in range(count)]
+        scan = baseline_round(ids, args.sample) # Extrapolated past --sample players
+        indexed = min(roster_round(ids) for _ in range(args.repeat))
+        per_op_us = indexed / (2 * count) * 1e6 # One submission and one vote per player
+        print(f"{count:>8} {scan * 1000:>10.2f} {indexed * 1000:>10.2f} {scan / indexed:>7.0f}x {per_op_us:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Cold-start benchmark: time from launching a fresh process to its first served request.
+
+Each run starts a new interpreter that imports the app and requests the index page through
+the Flask test client (no network), so the time includes interpreter start, imports, the
+poster catalog scan and the first request. Two scenarios are measured:
+
+  warm   the persisted poster catalog index is used; only changed posters are read
+  cold   the index is ignored, so every poster is opened and hashed (a first deploy)
+
+The cold scenario leaves the index file untouched.
+
+    python benchmarks/bench_startup.py [--runs 5] [--scenarios warm,cold] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in the child process. Prints one JSON line with its timings.
+CHILD_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo_dir!r})
+if {cold!r}:
+    import poster_catalog
+    poster_catalog.load_catalog = lambda index_path: None
+    poster_catalog.save_catalog = lambda index_path, posters: None
+import app as game_app
+imported = time.perf_counter()
+response = game_app.app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({{
+    'served_at': time.time(),
+    'status': response.status_code,
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'catalog_scan_ms': game_app._poster_catalog['scan_ms'],
+    'posters': len(game_app.all_posters),
+}}))
+"""
+METRICS = ('launch_to_first_response_ms', 'import_ms', 'catalog_scan_ms', 'first_request_ms')
+
+
+def run_once(cold):
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    launched = time.time()
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT.format(repo_dir=REPO_DIR, cold=cold)],
+                            capture_output=True, text=True, env=env, cwd=REPO_DIR, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup run failed:\n{result.stderr}")
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    if sample['status'] != 200:
+        raise RuntimeError(f"First request returned {sample['status']}")
+    sample['launch_to_first_response_ms'] = (sample['served_at'] - launched) * 1000
+    return sample
+
+
+def summarize(values):
+    return {'p50': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes started per scenario.')
+    parser.add_argument('--scenarios', default='warm,cold', help='Comma-separated scenarios: warm, cold.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(',')
+    unknown = [s for s in scenarios if s not in ('warm', 'cold')]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    run_once(cold=False) # Makes sure the index exists and the OS file cache is warm for every scenario
+    report = {'runs': args.runs, 'cpu_count': os.cpu_count(), 'scenarios': {}}
+    for scenario in scenarios:
+        samples = [run_once(cold=scenario == 'cold') for _ in range(args.runs)]
+        report['scenarios'][scenario] = {metric: summarize([s[metric] for s in samples]) for metric in METRICS}
+        report['scenarios'][scenario]['posters'] = samples[0]['posters']
+
+    print(f"{args.runs} fresh processes per scenario, {os.cpu_count()} CPUs")
+    print(f"  {'scenario':<9} {'metric':<28} {'p50 ms':>9} {'min ms':>9} {'max ms':>9}")
+    for scenario, results in report['scenarios'].items():
+        for metric in METRICS:
+            stats = results[metric]
+            print(f"  {scenario:<9} {metric:<28} {stats['p50']:>9.1f} {stats['min']:>9.1f} {stats['max']:>9.1f}")
+        print(f"  {scenario:<9} {results['posters']} posters cataloged")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f"\nWrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
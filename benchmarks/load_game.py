@@ -0,0 +1,485 @@
+"""Load test: bot players playing complete games, to see how many players one server handles.
+
+Each bot is a player with its own session cookie that plays like a browser: it names itself
+in the lobby, writes a caption, holds the room's /events stream on the wait page until the
+phase changes (as the page's script does, reconnecting after the server's retry delay when a
+stream ends), loads the voting page's caption images (retrying while they render, as
+caption_loader.js does), votes, loads the results and moves on, for all five rounds. One bot
+per room is the host, who starts the game and presses "next round". Redirects are followed
+one hop at a time, so every request is timed under its own route; a stream is timed until
+its first event. --wait poll has bots refresh /wait and poll /game_state_check every --poll
+seconds instead, to compare against the pages before they used /events.
+
+Bots run in threads, in rooms of --room-size, against either the Flask test client (in
+process, no network), a server already running at --url, or a gunicorn that --gunicorn
+starts for the run. For each bot count in --bots it reports throughput, latency percentiles
+per route and error rates; --json writes the same for comparing runs.
+
+    python benchmarks/load_game.py [--bots 8,32,64] [--room-size 8] [--think 0.5] [--wait events|poll] [--poll 1]
+                                   [--url http://127.0.0.1:8000 | --gunicorn [--workers 1] [--threads 64]]
+"""
+import argparse
+import html
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+ROUNDS_PER_GAME = 5
+MAX_REDIRECTS = 10
+EVENT_STREAM_READ_BYTES = 65536
+PAGE_STATE = re.compile(r'const pageState = "([a-z_]+)"') # The state the wait page was rendered in
+IMAGE_RETRIES = 30 # Same as caption_loader.js
+IMAGE_ACCEPT = 'image/avif,image/webp,image/png,image/*;q=0.8,*/*;q=0.5' # What browsers send for <img>
+ROOM_PATH = re.compile(r'^/room/[A-Z0-9]+')
+ID_SEGMENT = re.compile(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+CAPTIONS = [
+    ('Be honest', 'Even when it hurts.'),
+    ('Modesty', 'Is always in fashion'),
+    ('Choose the right', 'Or at least the less wrong'),
+    ('Family home evening', 'Attendance is mandatory. Snacks are not guaranteed.'),
+    ('', 'Just the bottom line this time'),
+]
+
+
+class BotError(Exception):
+    pass
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def route_label(path):
+    """/room/ABCD/rendered_caption/<uuid>?v=.. -> /rendered_caption/<id>"""
+    path = urllib.parse.urlsplit(path).path
+    if path.startswith('/static/'):
+        return '/static'
+    return ID_SEGMENT.sub('/<id>', ROOM_PATH.sub('', path)) or '/'
+
+
+# --- Transports: one per bot, each with its own cookies ---
+
+class TestClientTransport:
+    """Requests through the Flask test client, in process."""
+
+    def __init__(self, game_app):
+        self.client = game_app.app.test_client()
+        self.client.environ_base['wsgi.multithread'] = True # Bots are threads, so /events streams rather than polls
+
+    def request(self, method, path, data=None, headers=None):
+        """Returns (status, headers, body bytes) without following redirects."""
+        split = urllib.parse.urlsplit(path)
+        response = self.client.open(split.path, method=method, data=data, headers=headers,
+                                    query_string=split.query or None, follow_redirects=False)
+        return response.status_code, response.headers, response.get_data()
+
+    def stream(self, path):
+        """Yields the status, then the body in chunks as the server produces them, until it ends."""
+        response = self.client.get(path, headers={'Accept': 'text/event-stream'}, buffered=False)
+        try:
+            yield response.status_code
+            yield from response.iter_encoded()
+        finally:
+            response.close()
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None # Hand 3xx responses back to the bot, which follows them itself
+
+
+class HttpTransport:
+    """Requests to a real server over HTTP."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirects)
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(urllib.parse.urljoin(self.base_url, path), data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e: # 3xx (not followed), 4xx and 5xx
+            return e.code, e.headers, e.read()
+
+    def stream(self, path):
+        """Yields the status, then the body in chunks as they arrive, until the server ends it."""
+        req = urllib.request.Request(urllib.parse.urljoin(self.base_url, path), headers={'Accept': 'text/event-stream'})
+        try:
+            response = self.opener.open(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            yield e.code
+            return
+        with response:
+            yield response.status
+            yield from iter(lambda: response.read1(EVENT_STREAM_READ_BYTES), b'')
+
+
+# --- Results ---
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {} # {route: [ms]}
+        self.statuses = {} # {route: {status: count}}
+        self.failures = [] # Bot-level errors (stuck, unexpected page, connection failures)
+        self.games = 0
+
+    def record(self, route, status, ms):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(ms)
+            counts = self.statuses.setdefault(route, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def fail(self, message):
+        with self.lock:
+            self.failures.append(message)
+
+    def summary(self, bots, wall_seconds):
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            statuses = self.statuses[route]
+            routes[route] = {
+                'count': len(samples),
+                'p50_ms': percentile(samples, 50), 'p95_ms': percentile(samples, 95), 'p99_ms': percentile(samples, 99),
+                'max_ms': max(samples), 'mean_ms': statistics.fmean(samples),
+                'errors_5xx': sum(n for status, n in statuses.items() if status >= 500 and status != 503),
+                'retry_503': statuses.get(503, 0), # Caption still rendering; expected, retried like a browser
+                'errors_4xx': sum(n for status, n in statuses.items() if 400 <= status < 500),
+            }
+        requests = sum(r['count'] for r in routes.values())
+        all_samples = [ms for samples in self.latencies.values() for ms in samples]
+        return {
+            'bots': bots,
+            'wall_seconds': wall_seconds,
+            'games_completed': self.games,
+            'requests': requests,
+            'requests_per_second': requests / wall_seconds if wall_seconds else 0.0,
+            'p50_ms': percentile(all_samples, 50) if all_samples else None,
+            'p95_ms': percentile(all_samples, 95) if all_samples else None,
+            'error_rate': sum(r['errors_5xx'] + r['errors_4xx'] for r in routes.values()) / requests if requests else 0.0,
+            'bot_failures': len(self.failures),
+            'failure_samples': self.failures[:5],
+            'routes': routes,
+        }
+
+
+# --- Bots ---
+
+class Room:
+    def __init__(self, size):
+        self.base = None # /room/CODE, set by the host
+        self.joined = threading.Barrier(size)
+
+
+class Bot:
+    def __init__(self, transport, name, room, is_host, stats, args, seed):
+        self.transport = transport
+        self.name = name
+        self.room = room
+        self.is_host = is_host
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(seed)
+        self.seen_static = set() # Static files the browser would have cached
+        self.deadline = None
+
+    # --- HTTP ---
+
+    def send(self, method, path, data=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, response_headers, body = self.transport.request(method, path, data, headers)
+        except (OSError, urllib.error.URLError) as e:
+            self.stats.record(route_label(path), 599, (time.perf_counter() - started) * 1000)
+            raise BotError(f"{method} {route_label(path)}: {e}") from e
+        self.stats.record(route_label(path), status, (time.perf_counter() - started) * 1000)
+        if status >= 500 and status != 503:
+            raise BotError(f"{method} {route_label(path)} returned {status}")
+        return status, response_headers, body
+
+    def navigate(self, method, path, data=None):
+        """Requests a page, following redirects. Returns (page name, final path, html)."""
+        for _ in range(MAX_REDIRECTS):
+            status, headers, body = self.send(method, path, data)
+            if status not in (301, 302, 303, 307, 308):
+                if status >= 400:
+                    raise BotError(f"{method} {route_label(path)} returned {status}")
+                page = urllib.parse.urlsplit(path).path.rstrip('/').rsplit('/', 1)[-1]
+                return page, path, body.decode('utf-8', 'replace')
+            path = urllib.parse.urljoin(path, headers['Location'])
+            method, data = 'GET', None
+        raise BotError(f"Too many redirects ending at {route_label(path)}")
+
+    def load_images(self, page_html):
+        """Fetches a page's images the way a browser with caption_loader.js would."""
+        for src in re.findall(r'<img[^>]*\ssrc="(/static/[^"]+)"', page_html):
+            src = html.unescape(src)
+            if src not in self.seen_static:
+                self.seen_static.add(src)
+                self.send('GET', src)
+        for src in re.findall(r'data-caption-src="([^"]+)"', page_html):
+            src = html.unescape(src)
+            for _ in range(IMAGE_RETRIES):
+                status, headers, _ = self.send('GET', src, headers={'Accept': IMAGE_ACCEPT})
+                if status != 503:
+                    break
+                time.sleep(min(float(headers.get('Retry-After', 1)), 3.0))
+            else:
+                self.stats.fail(f"{self.name}: gave up on {route_label(src)}")
+
+    def pause(self, seconds):
+        if seconds > 0:
+            time.sleep(self.rng.uniform(0.5, 1.5) * seconds)
+        if time.time() > self.deadline:
+            raise BotError(f"{self.name} timed out")
+
+    def wait_while(self, state, then=None):
+        """Waits until the room leaves state, then loads then (default: the new state's page) and returns it.
+
+        Holds /events, or with --wait poll polls /game_state_check every --poll seconds.
+        """
+        if self.args.wait == 'poll':
+            while True:
+                self.pause(self.args.poll)
+                _, _, body = self.send('GET', f'{self.room.base}/game_state_check')
+                current = json.loads(body)['state']
+                if current != state:
+                    return self.navigate('GET', then or f'{self.room.base}/{current}')
+        retry_seconds = 1.0
+        while True:
+            path = f'{self.room.base}/events'
+            started = time.perf_counter()
+            chunks = self.transport.stream(path)
+            try:
+                try:
+                    status = next(chunks)
+                except (OSError, urllib.error.URLError) as e:
+                    self.stats.record(route_label(path), 599, (time.perf_counter() - started) * 1000)
+                    raise BotError(f"GET {route_label(path)}: {e}") from e
+                if status != 200:
+                    self.stats.record(route_label(path), status, (time.perf_counter() - started) * 1000)
+                    raise BotError(f"GET {route_label(path)} returned {status}")
+                buffer = b''
+                for chunk in chunks:
+                    buffer += chunk
+                    while b'\n\n' in buffer:
+                        event, buffer = buffer.split(b'\n\n', 1)
+                        fields = dict(line.split(': ', 1) for line in event.decode().split('\n') if ': ' in line)
+                        if 'retry' in fields:
+                            retry_seconds = int(fields['retry']) / 1000
+                        if fields.get('event') != 'state':
+                            continue # A keepalive comment
+                        if started is not None:
+                            self.stats.record(route_label(path), status, (time.perf_counter() - started) * 1000)
+                            started = None
+                        current = json.loads(fields['data'])['state']
+                        if current != state:
+                            return self.navigate('GET', then or f'{self.room.base}/{current}')
+                    if time.time() > self.deadline:
+                        raise BotError(f"{self.name} timed out")
+            except (OSError, urllib.error.URLError) as e:
+                pass # Dropped like any stream; reconnect as EventSource does
+            finally:
+                chunks.close()
+            time.sleep(retry_seconds) # The stream ended (the server's time limit, or a polling fallback)
+            if time.time() > self.deadline:
+                raise BotError(f"{self.name} timed out")
+
+    # --- Game ---
+
+    def play(self):
+        self.deadline = time.time() + self.args.timeout
+        try:
+            if self.is_host:
+                _, path, _ = self.navigate('POST', '/rooms')
+                self.room.base = ROOM_PATH.match(urllib.parse.urlsplit(path).path).group(0)
+            self.room.joined.wait(timeout=self.args.timeout) # Everyone's in the room before anyone names themselves
+            page, _, body = self.navigate('POST', f'{self.room.base}/lobby', {'player_name': self.name})
+            self.room.joined.wait(timeout=self.args.timeout) # ... and named before the host starts
+            if self.is_host:
+                page, _, body = self.navigate('POST', f'{self.room.base}/start_game')
+            else:
+                page, _, body = self.wait_while('lobby')
+
+            while page != 'game_over':
+                if page == 'writing':
+                    self.pause(self.args.think)
+                    text1, text2 = self.rng.choice(CAPTIONS)
+                    page, _, body = self.navigate('POST', f'{self.room.base}/submit_caption',
+                                                  {'caption_text1': text1, 'caption_text2': f'{text2} ({self.name})'})
+                elif page == 'wait':
+                    if self.args.wait == 'poll':
+                        self.pause(self.args.poll)
+                        page, _, body = self.navigate('GET', f'{self.room.base}/wait')
+                    else: # The page's script goes back to /wait, which redirects, once the phase changes
+                        page, _, body = self.wait_while(PAGE_STATE.search(body).group(1), then=f'{self.room.base}/wait')
+                elif page == 'voting':
+                    self.load_images(body)
+                    choices = re.findall(r'name="vote" value="([^"]+)"', body)
+                    self.pause(self.args.think)
+                    if choices:
+                        page, _, body = self.navigate('POST', f'{self.room.base}/submit_vote', {'vote': self.rng.choice(choices)})
+                    else:
+                        page, _, body = self.navigate('GET', f'{self.room.base}/wait')
+                elif page == 'round_results':
+                    self.load_images(body)
+                    self.pause(self.args.think)
+                    if 'name="next_round"' in body or f'{self.room.base}/next_round' in body:
+                        if self.is_host:
+                            page, _, body = self.navigate('POST', f'{self.room.base}/next_round')
+                        else:
+                            page, _, body = self.wait_while('round_results')
+                    else: # Last round: the results page links to the final scores
+                        page, _, body = self.navigate('GET', f'{self.room.base}/game_over')
+                else:
+                    raise BotError(f"{self.name} ended up on unexpected page {page!r}")
+            with self.stats.lock:
+                self.stats.games += self.is_host # One game per room
+        except (BotError, threading.BrokenBarrierError, ValueError, KeyError) as e:
+            self.stats.fail(f"{self.name}: {type(e).__name__}: {e}")
+            self.room.joined.abort() # Don't leave room-mates waiting for us
+
+
+def run_load(make_transport, bots, args):
+    stats = LoadStats()
+    rooms = []
+    threads = []
+    for start in range(0, bots, args.room_size):
+        size = min(args.room_size, bots - start)
+        if size < 2:
+            break # A game needs two players
+        room = Room(size)
+        rooms.append(room)
+        for i in range(size):
+            bot = Bot(make_transport(), f'Bot {start + i}', room, i == 0, stats, args, seed=start + i)
+            threads.append(threading.Thread(target=bot.play, name=bot.name, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.summary(len(threads), time.perf_counter() - started)
+
+
+# --- Gunicorn ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, threads, log):
+    """Starts gunicorn on a free port and waits until it accepts connections. Returns (process, base URL)."""
+    port = free_port()
+    env = dict(os.environ)
+    if workers > 1: # In-memory state is per process; workers must share SQLite (see README)
+        env['GAME_STATE_BACKEND'] = 'sqlite'
+        env['GAME_STATE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='load_game_'), 'game_state.sqlite3')
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--timeout', '120', 'app:app']
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=log)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start listening within 30s")
+
+
+def print_summary(summary, out, top_routes=12):
+    print(f"\n{summary['bots']} bots: {summary['games_completed']} games, {summary['requests']} requests in "
+          f"{summary['wall_seconds']:.1f}s ({summary['requests_per_second']:.0f} req/s), p50 {summary['p50_ms']:.1f} ms, "
+          f"p95 {summary['p95_ms']:.1f} ms, error rate {summary['error_rate']:.2%}, bot failures {summary['bot_failures']}", file=out)
+    print(f"  {'route':<28} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'5xx':>5} {'4xx':>5} {'503':>5}", file=out)
+    routes = sorted(summary['routes'].items(), key=lambda item: item[1]['count'], reverse=True)[:top_routes]
+    for route, r in routes:
+        print(f"  {route:<28} {r['count']:>6} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['max_ms']:>8.1f} "
+              f"{r['errors_5xx']:>5} {r['errors_4xx']:>5} {r['retry_503']:>5}", file=out)
+    for failure in summary['failure_samples']:
+        print(f"  failure: {failure}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bots', default='8,32,64', help='Comma-separated bot counts to run, one after another.')
+    parser.add_argument('--room-size', type=int, default=8, help='Players per room.')
+    parser.add_argument('--think', type=float, default=0.5, help='Average seconds a bot spends on a page before acting.')
+    parser.add_argument('--wait', choices=('events', 'poll'), default='events',
+                        help='How bots wait for the room: hold /events as the pages do, or poll (for comparison).')
+    parser.add_argument('--poll', type=float, default=1.0, help='With --wait poll, seconds between /wait refreshes and state checks.')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds before a bot gives up on its game.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='Play against a server already running here instead of the in-process test client.')
+    target.add_argument('--gunicorn', action='store_true', help='Start gunicorn on a free port for the run.')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes (more than 1 uses SQLite state).')
+    parser.add_argument('--threads', type=int, default=64, help="gunicorn threads per worker (each waiting bot's stream holds one).")
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+
+    real_stdout = sys.stdout
+    server = None
+    log = open(os.devnull, 'w')
+    try:
+        if args.gunicorn:
+            server, base_url = start_gunicorn(args.workers, args.threads, log)
+            target_name = f'gunicorn ({args.workers} workers x {args.threads} threads) at {base_url}'
+        else:
+            base_url = args.url
+            target_name = base_url or 'the Flask test client'
+        if base_url:
+            make_transport = lambda: HttpTransport(base_url, timeout=60)
+        else:
+            sys.stdout = log # The app prints a line or more for every render and phase change
+            import app as game_app
+            make_transport = lambda: TestClientTransport(game_app)
+
+        waiting = 'hold /events' if args.wait == 'events' else f'poll every {args.poll}s'
+        print(f"Load test against {target_name}: rooms of {args.room_size}, think {args.think}s, bots {waiting}", file=real_stdout)
+        summaries = []
+        for bots in (int(b) for b in args.bots.split(',')):
+            summary = run_load(make_transport, bots, args)
+            summaries.append(summary)
+            print_summary(summary, real_stdout)
+    finally:
+        sys.stdout = real_stdout
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'target': target_name, 'settings': {k: v for k, v in vars(args).items() if k != 'json'},
+                       'runs': summaries}, f, indent=1)
+        print(f"\nWrote {args.json}")
+    return 1 if any(s['bot_failures'] for s in summaries) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Concurrency stress test: many threads submitting captions and votes into one room at once.
+
+Every player runs on its own thread with its own test client; a barrier releases them
+together at each phase so the "last" submissions race each other (and, with
+--phase-seconds, the phase scheduler's deadline). After every round the stored state is
+checked:
+
+  * each phase advanced exactly once (one round per next_round, voting before results)
+  * every accepted caption and vote was kept
+  * scores went up by exactly the votes recorded for the round, so a double tally
+    or a lost vote is caught
+
+With --backend journal, the journal is then replayed into a fresh store, which must hold
+exactly the room's final state. With --backend sqlite, a second process with a different
+hash seed (so its sets iterate, and pickle, in another order) reads the room the way other
+workers do, which must not write it.
+
+Exits non-zero on the first inconsistency.
+
+    python benchmarks/stress_game_state.py [--players 16] [--games 3] [--backend memory|journal|sqlite]
+    python benchmarks/stress_game_state.py --phase-seconds 0.05   # race the deadline too
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+ROUNDS_PER_GAME = 5
+
+# Runs in the other worker process. Prints one JSON line with the room's version before and after.
+OTHER_WORKER_SCRIPT = """
+import json, sys
+sys.path.insert(0, {repo_dir!r})
+import app as game_app
+code = {code!r}
+before = game_app.state_store.version(code)
+with game_app.state_store.transaction(code) as state:
+    len(state['players'])
+game_app.rooms.get(code).sync_events()
+print(json.dumps({{'before': before, 'after': game_app.state_store.version(code)}}))
+"""
+
+
+class Inconsistent(AssertionError):
+    pass
+
+
+def check(condition, message):
+    if not condition:
+        raise Inconsistent(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=16, help='Concurrent players in the room.')
+    parser.add_argument('--games', type=int, default=3, help=f'Full games ({ROUNDS_PER_GAME} rounds each) to play.')
+    parser.add_argument('--backend', choices=('memory', 'journal', 'sqlite'), default='memory', help='Game state store to test.')
+    parser.add_argument('--phase-seconds', type=float, default=None,
+                        help='Shorten the writing/voting timers so deadlines fire mid-submission.')
+    args = parser.parse_args()
+
+    os.environ['GAME_STATE_BACKEND'] = args.backend
+    if args.backend == 'sqlite':
+        os.environ['GAME_STATE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'stress.sqlite3')
+    if args.backend == 'journal':
+        os.environ['GAME_STATE_JOURNAL_DIR'] = tempfile.mkdtemp()
+    import app as game_app # Imported here so the backend settings above take effect
+
+    if args.phase_seconds is not None:
+        game_app.WRITING_TIME_SECONDS = game_app.VOTING_TIME_SECONDS = args.phase_seconds
+    sys.setswitchinterval(1e-5) # Switch threads often so races actually interleave
+
+    # Keep the game's console chatter (including background renders still finishing) out of the report
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        stats = run(game_app, args)
+        if args.backend == 'journal':
+            check_journal_replay(game_app)
+        if args.backend == 'sqlite':
+            check_other_worker_reads(stats['room'])
+    except Inconsistent as e:
+        print(f"FAILED: {e}", file=real_stdout)
+        sys.exit(1)
+
+    print(f"OK: {stats['rounds']} rounds with {args.players} players on the {args.backend} backend "
+          f"({stats['requests']} racing requests, {stats['errors']} 5xx responses) in {stats['seconds']:.1f}s", file=real_stdout)
+    print(f"    captions kept: {stats['captions']}, votes kept: {stats['votes']}, points awarded: {stats['points']}", file=real_stdout)
+
+
+def check_journal_replay(game_app):
+    from state_store import JournaledStateStore
+    check(game_app.state_store.flush(timeout=30), "journal writes didn't finish")
+    replayed = JournaledStateStore(game_app.GAME_STATE_JOURNAL_DIR)
+    check(replayed.count() == game_app.state_store.count(), "the journal replays to a different number of rooms")
+    for code in replayed.recovery['room_codes']:
+        check(replayed.load(code) == game_app.state_store.load(code), f"room {code} replayed from the journal differs from the live state")
+
+
+def check_other_worker_reads(code):
+    """A read-only transaction and an event sync from another worker must leave the stored room alone."""
+    seed = int(os.environ.get('PYTHONHASHSEED') or 0) + 1 # Differs from this process's, random or not
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    result = subprocess.run([sys.executable, '-c', OTHER_WORKER_SCRIPT.format(repo_dir=REPO_DIR, code=code)],
+                            capture_output=True, text=True, env=env, check=False, timeout=60)
+    check(result.returncode == 0, f"the other worker process failed:\n{result.stderr}")
+    versions = json.loads(result.stdout.strip().splitlines()[-1])
+    check(versions['after'] == versions['before'],
+          f"reads from a worker with another hash seed wrote room {code} (version {versions['before']} -> {versions['after']})")
+
+
+def run(game_app, args):
+    clients = [game_app.app.test_client() for _ in range(args.players)]
+    base = clients[0].post('/rooms').location.rsplit('/', 1)[0]
+    code = base.rsplit('/', 1)[1]
+    for i, client in enumerate(clients):
+        client.post(base + '/lobby', data={'player_name': f'Player {i}'})
+
+    def load_state():
+        return game_app.state_store.load(code)[1]
+
+    ids = {p.name: p_id for p_id, p in load_state()['players'].items()}
+    player_ids = [ids[f'Player {i}'] for i in range(args.players)]
+    barrier = threading.Barrier(args.players)
+    stats = {'room': code, 'rounds': 0, 'requests': 0, 'errors': 0, 'captions': 0, 'votes': 0, 'points': 0}
+    stats_lock = threading.Lock()
+
+    def race(make_request):
+        """Runs make_request(i, client) for every player at the same instant."""
+        def worker(i):
+            barrier.wait()
+            return make_request(i, clients[i]).status_code
+        with ThreadPoolExecutor(max_workers=args.players) as pool:
+            statuses = list(pool.map(worker, range(args.players)))
+        with stats_lock:
+            stats['requests'] += len(statuses)
+            stats['errors'] += sum(1 for status in statuses if status >= 500)
+
+    def wait_for_state(wanted):
+        """Waits for the scheduler to leave a timed phase (only with --phase-seconds)."""
+        deadline = time.time() + 10
+        while load_state()['state'] not in wanted:
+            check(time.time() < deadline, f"stuck in {load_state()['state']!r}, expected one of {wanted}")
+            clients[0].get(base + '/game_state_check')
+            time.sleep(0.01)
+
+    started = time.perf_counter()
+    for game in range(args.games):
+        clients[0].post(base + '/start_game')
+        for round_number in range(1, ROUNDS_PER_GAME + 1):
+            state = load_state()
+            # With short timers the scheduler may already have moved on from writing
+            expected = ('writing',) if args.phase_seconds is None else ('writing', 'voting', 'round_results')
+            check(state['state'] in expected, f"game {game} round {round_number}: expected writing, got {state['state']!r}")
+            check(state['current_round'] == round_number, f"round counter is {state['current_round']}, expected {round_number}")
+            scores_before = {p_id: p.score for p_id, p in state['players'].items()}
+
+            race(lambda i, client: client.post(base + '/submit_caption', data={'caption_text1': f'top {i}', 'caption_text2': f'bottom {i}'}))
+            if args.phase_seconds is not None:
+                wait_for_state(('voting', 'round_results'))
+            state = load_state()
+            check(state['current_round'] == round_number, "a submission advanced the round")
+            submitted = {p_id for p_id, p in state['players'].items() if p.submitted_this_round}
+            check(set(state['captions']) == submitted, "captions and submitted flags disagree")
+            if args.phase_seconds is None:
+                check(state['state'] == 'voting', f"expected voting after all captions, got {state['state']!r}")
+                check(len(state['captions']) == args.players, f"{len(state['captions'])} of {args.players} captions kept")
+
+            # Everyone votes for the next player's caption
+            race(lambda i, client: client.post(base + '/submit_vote', data={'vote': player_ids[(i + 1) % args.players]}))
+            if args.phase_seconds is not None:
+                wait_for_state(('round_results', 'game_over'))
+            state = load_state()
+            check(state['state'] == 'round_results', f"expected round_results, got {state['state']!r}")
+            check(state['current_round'] == round_number, "voting advanced the round")
+            voted = {p_id for p_id, p in state['players'].items() if p.voted_this_round}
+            check(set(state['players'].votes) == voted, "votes and voted flags disagree")
+            if args.phase_seconds is None:
+                check(len(state['players'].votes) == args.players, f"{len(state['players'].votes)} of {args.players} votes kept")
+
+            received = {}
+            for voter_id, author_id in state['players'].votes.items():
+                if author_id in state['captions']:
+                    received[author_id] = received.get(author_id, 0) + 1
+            for p_id, p in state['players'].items():
+                gained = p.score - scores_before.get(p_id, 0)
+                check(gained == received.get(p_id, 0),
+                      f"{p.name} gained {gained} points for {received.get(p_id, 0)} votes (double or missed tally)")
+
+            stats['rounds'] += 1
+            stats['captions'] += len(state['captions'])
+            stats['votes'] += len(state['players'].votes)
+            stats['points'] += sum(received.values())
+
+            # Every player presses "next round" at once; exactly one may advance it. With short
+            # timers a whole round can expire inside that window, so only one player presses.
+            if args.phase_seconds is None:
+                race(lambda i, client: client.post(base + '/next_round'))
+            else:
+                clients[0].post(base + '/next_round')
+            state = load_state()
+            if round_number < ROUNDS_PER_GAME:
+                check(state['current_round'] == round_number + 1,
+                      f"next_round moved round {round_number} to {state['current_round']}")
+            else:
+                check(state['state'] == 'game_over', f"expected game_over after the last round, got {state['state']!r}")
+
+        clients[0].post(base + '/reset_game')
+        for i, client in enumerate(clients):
+            client.post(base + '/lobby', data={'player_name': f'Player {i}'})
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+if __name__ == '__main__':
+    main()
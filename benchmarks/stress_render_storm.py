@@ -0,0 +1,172 @@
+"""Render storm test: does a burst of caption renders slow down the rest of the server?
+
+Serves the app on a local threaded server and polls one room's /game_state_check (the
+cheapest request a player's page makes) for --seconds without any rendering, then again
+while --renders distinct full caption renders are queued at once. That is a room's worth of
+captions arriving just as voting opens, many times over. For each mode it reports the poll
+latency percentiles and the number of renders finished during the storm:
+
+  threads     renders on threads of the server process (RENDER_PROCESSES=0, as before the
+              render service)
+  processes   renders on --processes render worker processes (the default)
+
+Exits non-zero if, in the processes mode, the storm's p95 poll latency is more than
+--max-slowdown-ms above the baseline's.
+
+    python benchmarks/stress_render_storm.py [--renders 200] [--seconds 5] [--processes 2]
+                                             [--modes threads,processes] [--json out.json]
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # The game logs every phase change at INFO
+
+from werkzeug.serving import make_server
+
+import app as game_app
+from render_service import RenderService
+
+POLL_INTERVAL_SECONDS = 0.02 # Far more often than a page polls, for enough samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples):
+    return {'count': len(samples), 'p50': percentile(samples, 50), 'p95': percentile(samples, 95), 'max': max(samples)}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def create_room(base_url):
+    try:
+        urllib.request.build_opener(NoRedirect()).open(base_url + '/rooms', data=b'', timeout=10)
+    except urllib.error.HTTPError as e:
+        if e.code == 302:
+            return urllib.parse.urlparse(e.headers['Location']).path.rsplit('/', 1)[0]
+        raise
+    raise RuntimeError("Creating a room didn't redirect to its lobby")
+
+
+def poll_latencies(url, seconds):
+    """Latencies (ms) of polling url for seconds."""
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+        samples.append((time.perf_counter() - started) * 1000)
+        time.sleep(POLL_INTERVAL_SECONDS)
+    return samples
+
+
+def run_mode(service, poll_url, poster_path, renders, seconds, run_index):
+    game_app.render_service = service # queue_caption_render() looks it up on every call
+    # Start the service (and its worker processes) before measuring anything
+    game_app.queue_caption_render(poster_path, 'Warm up', f'Run {run_index}')
+    service.wait_idle(120)
+    baseline = poll_latencies(poll_url, seconds)
+
+    completed_before = service.stats()['completed']
+    storm_started = time.perf_counter()
+    for i in range(renders): # Distinct texts, so none is a cache hit or a duplicate job
+        game_app.queue_caption_render(poster_path, f'Storm {run_index}', f'Caption number {i} of the storm',
+                                      priority=game_app.RENDER_PRIORITY_RESULTS)
+    storm = poll_latencies(poll_url, seconds)
+    storm_seconds = time.perf_counter() - storm_started
+    stats = service.stats()
+    rendered = stats['completed'] - completed_before
+    service.wait_idle(300) # Let the rest finish before the next mode
+    return {
+        'baseline_ms': summarize(baseline),
+        'storm_ms': summarize(storm),
+        'renders_finished_during_storm': rendered,
+        'renders_per_second': rendered / storm_seconds,
+        'rejected': stats['rejected'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--renders', type=int, default=200, help='Caption renders queued at once.')
+    parser.add_argument('--seconds', type=float, default=5, help='Length of the baseline and of the storm.')
+    parser.add_argument('--processes', type=int, default=game_app.RENDER_PROCESSES or 1, help='Render processes for the processes mode.')
+    parser.add_argument('--modes', default='threads,processes', help='Comma-separated modes: threads, processes.')
+    parser.add_argument('--max-slowdown-ms', type=float, default=25, help='Allowed p95 increase in the processes mode.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+    unknown = [m for m in modes if m not in ('threads', 'processes')]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+    if not game_app.all_posters:
+        parser.error("no posters in static/posters")
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # One line per poll otherwise
+    port = free_port()
+    server = make_server('127.0.0.1', port, game_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{port}'
+    poll_url = base_url + create_room(base_url) + '/game_state_check'
+    poster_path = game_app.poster_render_source(game_app.all_posters[0])
+
+    queue_size = max(args.renders, game_app.RENDER_QUEUE_MAX_JOBS)
+    results = {}
+    for run_index, mode in enumerate(modes):
+        if mode == 'threads':
+            service = RenderService(0, queue_size, game_app.RENDER_JOB_TIMEOUT_SECONDS)
+        else:
+            service = RenderService(args.processes, queue_size, game_app.RENDER_JOB_TIMEOUT_SECONDS,
+                                    preload=('app',), niceness=game_app.RENDER_PROCESS_NICENESS)
+        results[mode] = run_mode(service, poll_url, poster_path, args.renders, args.seconds, run_index)
+    server.shutdown()
+
+    print(f"{args.renders} renders queued at once on {poster_path}, {os.cpu_count()} CPUs, "
+          f"{args.processes} render processes in the processes mode")
+    print(f"  {'mode':<10} {'phase':<9} {'polls':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'renders/s':>10}")
+    for mode, result in results.items():
+        for phase in ('baseline', 'storm'):
+            stats = result[f'{phase}_ms']
+            rate = f"{result['renders_per_second']:.1f}" if phase == 'storm' else ''
+            print(f"  {mode:<10} {phase:<9} {stats['count']:>6} {stats['p50']:>8.1f} {stats['p95']:>8.1f} {stats['max']:>8.1f} {rate:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'renders': args.renders, 'seconds': args.seconds, 'processes': args.processes,
+                       'cpu_count': os.cpu_count(), 'modes': results}, f, indent=1)
+        print(f"\nWrote {args.json}")
+
+    if 'processes' in results:
+        slowdown = results['processes']['storm_ms']['p95'] - results['processes']['baseline_ms']['p95']
+        if slowdown > args.max_slowdown_ms:
+            print(f"\nFAIL: with render processes, p95 poll latency rose {slowdown:.1f} ms during the storm "
+                  f"(allowed: {args.max_slowdown_ms:g} ms)")
+            return 1
+        print(f"\nOK: with render processes, p95 poll latency rose {slowdown:.1f} ms during the storm")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""Event log: an append-only, on-disk history of every change to every room.
+
+The in-memory state store loses every game when the process exits, and reset_game drops a
+room's finished rounds. With the journal backend (see state_store.JournaledStateStore) each
+committed change is also appended here as a record:
+
+    (seq, timestamp, kind, room_code, version, events, changes)
+
+kind is 'put' (changes is the room's whole state, e.g. when it's created), 'update'
+(changes holds only the top-level state keys that changed) or 'delete'. events are the
+labels the app gave the change: 'player_joined', 'caption_submitted', 'vote_cast',
+'phase_changed' and so on.
+
+Writing:
+- append() only queues the record; a writer thread pickles queued records, appends them to
+  the current segment file and fsyncs once per batch, at most every fsync_interval seconds.
+  A crash loses at most the last interval's changes, and request threads never wait on the
+  disk.
+- Each record is framed with its length and a CRC, so a record torn by a crash is detected
+  and replay stops cleanly before it.
+- Every snapshot_every records the store hands over a copy of all rooms. The writer saves
+  it as a snapshot and starts a new segment file. Segments are never rewritten or deleted:
+  together they are the full history (see iter_records).
+
+Recovery loads the newest readable snapshot and replays only the segments written after
+it, so it costs at most snapshot_every records on top of the snapshot however long the
+history is.
+"""
+import atexit
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+FSYNC_INTERVAL_SECONDS = 0.05 # Queued records are written and fsynced together at most this often
+SNAPSHOT_EVERY_RECORDS = 2000 # Records between snapshots, which bounds replay at startup
+SNAPSHOTS_KEPT = 2 # Older snapshots are deleted; the segments keep the history
+SEGMENT_PREFIX, SEGMENT_SUFFIX = 'segment-', '.log'
+SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX = 'snapshot-', '.pickle'
+FRAME_HEADER = struct.Struct('>II') # Payload length, CRC-32 of the payload
+
+log = logging.getLogger(__name__)
+
+
+def _file_seq(name, prefix, suffix):
+    """Sequence number in a segment or snapshot file name, or None for other files."""
+    if name.startswith(prefix) and name.endswith(suffix):
+        number = name[len(prefix):-len(suffix)]
+        if number.isdigit():
+            return int(number)
+    return None
+
+
+def _files(directory, prefix, suffix):
+    """[(seq, path)] of the segment or snapshot files in directory, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    found = [(_file_seq(name, prefix, suffix), os.path.join(directory, name)) for name in names]
+    return sorted((seq, path) for seq, path in found if seq is not None)
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_segment(path):
+    """Yields the records in one segment file, stopping at the first torn or corrupt one."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            length, crc = FRAME_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            yield pickle.loads(payload)
+
+
+def iter_records(directory):
+    """Yields every record in the log, oldest first: the whole history, not just what replay needs."""
+    for _, path in _files(directory, SEGMENT_PREFIX, SEGMENT_SUFFIX):
+        yield from read_segment(path)
+
+
+def apply_record(rooms, record):
+    """Applies one record to {room_code: [version, state, last_write_time]}."""
+    seq, timestamp, kind, code, version, events, changes = record
+    if kind == 'delete':
+        rooms.pop(code, None)
+    elif kind == 'put':
+        rooms[code] = [version, changes, timestamp]
+    elif code in rooms:
+        state = dict(rooms[code][1]) # Stored states are never modified in place
+        state.update(changes)
+        rooms[code] = [version, state, timestamp]
+
+
+class EventLog:
+    def __init__(self, directory, fsync_interval=FSYNC_INTERVAL_SECONDS, snapshot_every=SNAPSHOT_EVERY_RECORDS):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        self._condition = threading.Condition()
+        self._pending = [] # ('record', record) and ('snapshot', seq, rooms) items, in order
+        self._next_seq = 0
+        self._since_snapshot = 0 # Records appended (or replayed) since the last snapshot
+        self._queued = 0 # Items ever queued, and items written and fsynced, for flush()
+        self._done = 0
+        self._segment = None
+        self._last_fsync = 0.0
+        self._pid = None
+        self._closing = False
+        self._stats = {'records': 0, 'bytes': 0, 'fsyncs': 0, 'max_batch': 0, 'snapshots': 0, 'write_errors': 0}
+
+    def recover(self):
+        """Rebuilds every room from the newest snapshot and the records after it.
+
+        Returns (rooms, summary), rooms being {room_code: [version, state, last_write_time]}.
+        Call before the first append().
+        """
+        rooms, snapshot_seq, unreadable = {}, 0, 0
+        for seq, path in reversed(_files(self.directory, SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)):
+            try:
+                with open(path, 'rb') as f:
+                    rooms = pickle.load(f)
+                snapshot_seq = seq
+                break
+            except (OSError, EOFError, pickle.UnpicklingError):
+                unreadable += 1 # Fall back to the one before, and replay more records
+        replayed, next_seq = 0, snapshot_seq
+        for seq, path in _files(self.directory, SEGMENT_PREFIX, SEGMENT_SUFFIX):
+            if seq < snapshot_seq:
+                continue # Covered by the snapshot; segments start at snapshot boundaries
+            for record in read_segment(path):
+                if record[0] < next_seq:
+                    continue
+                apply_record(rooms, record)
+                next_seq = record[0] + 1
+                replayed += 1
+        with self._condition:
+            self._next_seq = next_seq
+            self._since_snapshot = replayed
+        return rooms, {'rooms': len(rooms), 'snapshot_seq': snapshot_seq, 'records_replayed': replayed,
+                       'unreadable_snapshots': unreadable}
+
+    def append(self, kind, code, version, events, changes, timestamp):
+        """Queues a record for the writer thread. Returns True when a snapshot is due (see snapshot()).
+
+        changes must not be modified afterwards: it's pickled later, on the writer thread.
+        """
+        with self._condition:
+            self._ensure_writer()
+            record = (self._next_seq, timestamp, kind, code, version, tuple(events), changes)
+            self._next_seq += 1
+            self._since_snapshot += 1
+            self._pending.append(('record', record))
+            self._queued += 1
+            self._condition.notify()
+            return self.snapshot_every > 0 and self._since_snapshot >= self.snapshot_every
+
+    def snapshot(self, rooms):
+        """Queues a snapshot of every room as of the records appended so far.
+
+        rooms is {room_code: [version, state, last_write_time]}; call while holding the lock
+        that orders append() calls, so nothing slips in between.
+        """
+        with self._condition:
+            self._ensure_writer()
+            self._pending.append(('snapshot', self._next_seq, rooms))
+            self._since_snapshot = 0
+            self._queued += 1
+            self._condition.notify()
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is on disk. Returns False on timeout."""
+        with self._condition:
+            target = self._queued
+            return self._condition.wait_for(lambda: self._done >= target or self._pid != os.getpid(), timeout)
+
+    def close(self):
+        """Writes out what's queued and stops the writer thread."""
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._condition:
+            return {**self._stats, 'next_seq': self._next_seq, 'pending': len(self._pending)}
+
+    def _ensure_writer(self):
+        # Called with the condition held. Started lazily, in the process that writes
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._segment, self._closing = None, False # A parent's open segment isn't ours to append to
+        self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    break
+                closing = self._closing
+            delay = self._last_fsync + self.fsync_interval - time.monotonic()
+            if delay > 0 and not closing:
+                time.sleep(delay) # Group commit: let more records join this batch
+            with self._condition:
+                batch, self._pending = self._pending, []
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                # Nothing to retry with; the game carries on in memory. Reported through stats
+                with self._condition:
+                    self._stats['write_errors'] += 1
+                log.error("Couldn't write %d event log items: %s", len(batch), e)
+            with self._condition:
+                self._done += len(batch)
+                self._condition.notify_all()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _write_batch(self, batch):
+        written = 0
+        for item in batch:
+            if item[0] == 'snapshot':
+                self._write_snapshot(item[1], item[2])
+                continue
+            record = item[1]
+            if self._segment is None:
+                self._open_segment(record[0])
+            payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            self._segment.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            written += 1
+            with self._condition:
+                self._stats['records'] += 1
+                self._stats['bytes'] += FRAME_HEADER.size + len(payload)
+        if self._segment is not None and written:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            with self._condition:
+                self._stats['fsyncs'] += 1
+                self._stats['max_batch'] = max(self._stats['max_batch'], written)
+        self._last_fsync = time.monotonic()
+
+    def _open_segment(self, first_seq):
+        path = os.path.join(self.directory, f'{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}')
+        # A file already there holds nothing replayable (recovery would have moved first_seq
+        # past it), only a record torn by a crash, which must not hide the ones written after it
+        self._segment = open(path, 'wb')
+        _fsync_directory(self.directory) # So the new file itself survives a crash
+
+    def _write_snapshot(self, seq, rooms):
+        # Records from here on go to a new segment, so replay can skip everything before
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment.close()
+            self._segment = None
+        path = os.path.join(self.directory, f'{SNAPSHOT_PREFIX}{seq:012d}{SNAPSHOT_SUFFIX}')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(rooms, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_directory(self.directory)
+        for _, old_path in _files(self.directory, SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)[:-SNAPSHOTS_KEPT]:
+            os.remove(old_path)
+        with self._condition:
+            self._stats['snapshots'] += 1
@@ -0,0 +1,12 @@
+"""gunicorn settings, read by `gunicorn app:app` when it's started from this directory.
+
+Players on the lobby and wait pages hold an /events stream open, and a sync worker serves
+one request at a time: a single waiting player would stall everyone else. Threaded workers
+give each stream a thread of its own. (gunicorn treats -k sync with more than one thread as
+gthread; with --threads 1 as well, /events answers at once and browsers poll it instead,
+see app.events.) For thousands of waiting players, serve asgi.py with uvicorn.
+"""
+import os
+
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 64)) # Per worker: waiting players, plus everyone else's requests
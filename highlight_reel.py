@@ -0,0 +1,126 @@
+"""Highlight reel: a finished game's captions as one ZIP archive, rendered in parallel and streamed.
+
+A game keeps its finished rounds (records.Round), so at game over every caption can be drawn
+again, long after its round's images left the render cache. stream_zip() turns a list of
+entries (images to render, plus any ready-made files) into the bytes of a ZIP archive,
+yielded piece by piece as they're ready:
+
+- Images are render jobs on the render service, at most `window` of them queued or running
+  at once, so they render in parallel across its processes. Each goes into the archive, in
+  the entries' order, as soon as it and everything before it are done: the download starts
+  after the first render, and at most `window` images are held in memory however long the
+  game was.
+- zipfile writes to a stream that can't seek, so each file's sizes and CRC follow it in a
+  data descriptor and nothing is buffered to be rewritten. Images are stored, not deflated;
+  JPEGs don't compress further.
+- A render that fails (or is displaced by more urgent renders) is tried again once. Images
+  still missing after that are listed in missing.txt at the end of the archive.
+
+If the client goes away, no more jobs are queued; the ones already queued still run.
+"""
+import itertools
+import logging
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+
+RENDER_ATTEMPTS = 2 # Submissions per image before it's left out
+QUEUE_FULL_RETRY_SECONDS = 0.25 # Pause between submissions while the render queue is full
+
+log = logging.getLogger(__name__)
+
+_export_ids = itertools.count() # Job keys are per export, so two downloads never share (or drop) a job
+
+
+@dataclass(slots=True)
+class ReelEntry:
+    """One file in the archive: data as is, or the image a render job returns.
+
+    job is (func, args) for RenderService.submit(); func returns the image's bytes, a tuple
+    starting with them (as app.produce_caption_image does), or None if it failed.
+    """
+    name: str
+    data: bytes = None
+    job: tuple = None
+
+
+class _ChunkSink:
+    """Write-only file for zipfile. It has no tell() or seek(), so zipfile streams."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def stream_zip(entries, service, priority, window, wait_seconds):
+    """Yields a ZIP archive of entries, in order, in chunks (one or more per file).
+
+    wait_seconds bounds the wait for each render, including time spent in the render queue.
+    """
+    entries = list(entries)
+    export_id = next(_export_ids)
+    condition = threading.Condition()
+    results = {} # {index: image bytes, or None if the render failed}
+
+    def submit(index, attempt):
+        func, args = entries[index].job
+        def on_done(result):
+            data = result[0] if isinstance(result, tuple) else result
+            with condition:
+                results[index] = data
+                condition.notify_all()
+        # Each attempt has its own key: a failed job's key is still held as running while its on_done runs
+        key = ('highlight_reel', export_id, index, attempt)
+        deadline = time.monotonic() + wait_seconds
+        while not service.submit(key, func, args, priority, on_done):
+            if time.monotonic() >= deadline:
+                on_done(None)
+                return
+            time.sleep(QUEUE_FULL_RETRY_SECONDS)
+
+    def wait_for(index):
+        with condition:
+            condition.wait_for(lambda: index in results, wait_seconds)
+            return results.pop(index, None)
+
+    render_indexes = [i for i, entry in enumerate(entries) if entry.job is not None]
+    submitted = 0
+    missing = []
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        date_time = time.localtime()[:6]
+        for index, entry in enumerate(entries):
+            if entry.job is None:
+                data = entry.data
+            else:
+                # Keep the window full: this image and the next ones render while earlier ones stream out
+                while submitted < len(render_indexes) and render_indexes[submitted] < index + window:
+                    submit(render_indexes[submitted], 0)
+                    submitted += 1
+                data = wait_for(index)
+                for attempt in range(1, RENDER_ATTEMPTS):
+                    if data is not None:
+                        break
+                    submit(index, attempt)
+                    data = wait_for(index)
+            if data is None:
+                log.warning("Highlight reel: couldn't render %s; leaving it out.", entry.name)
+                missing.append(entry.name)
+                continue
+            archive.writestr(zipfile.ZipInfo(entry.name, date_time), data)
+            yield sink.take()
+        if missing:
+            archive.writestr(zipfile.ZipInfo('missing.txt', date_time),
+                             "These images couldn't be rendered:\n" + ''.join(f'{name}\n' for name in missing))
+    yield sink.take() # The central directory
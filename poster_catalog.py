@@ -0,0 +1,129 @@
+"""Poster catalog: path, dimensions, byte size and content hash of every poster.
+
+The app used to find posters by listing static/posters from a before_request hook, and only
+learned a poster's dimensions by opening it during a render. Instead the catalog is built
+once at startup and persisted to an index file. A rescan stats each file and reuses the
+index entry when its size and modification time are unchanged, so only new or replaced
+posters are opened (for their header; nothing is decoded) and hashed. A warm start costs
+one directory scan and one JSON load.
+
+Because a rescan costs about the same as the old directory listing, the app repeats it
+periodically and on SIGHUP to pick up posters that were added, replaced or removed.
+
+Entries also carry a placeholder: a ~32px-wide WebP of the poster as a data: URI (about
+500 bytes), which pages inline so a poster's box shows a blurry preview before any image
+arrives. Making one means decoding the whole poster (~0.2s for a PNG), so scans leave it
+out; the app has make_placeholder() run as a render job for entries without one and merges
+the results back in (see add_placeholder()).
+"""
+import base64
+import io
+import json
+import os
+
+from PIL import Image
+
+from poster_pipeline import file_sha256
+
+CATALOG_VERSION = 1
+POSTER_DIR = 'posters' # Relative to static/
+POSTER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+PLACEHOLDER_WIDTH = 32 # Pixels; browsers stretch it to the poster's box, which blurs it
+PLACEHOLDER_QUALITY = 50 # WebP quality; detail is lost to the stretching anyway
+
+
+def scan_poster_files(static_folder):
+    """{poster_path: os.stat_result} for every image in static/posters, with paths relative to static/.
+
+    Raises OSError if the directory can't be read.
+    """
+    files = {}
+    with os.scandir(os.path.join(static_folder, POSTER_DIR)) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(POSTER_EXTENSIONS) and entry.is_file():
+                files[f'{POSTER_DIR}/{entry.name}'] = entry.stat()
+    return files
+
+
+def catalog_entry(static_folder, poster_path, stat):
+    """Catalog entry for one poster: its dimensions, read from the header, and its hash."""
+    source_path = os.path.join(static_folder, poster_path)
+    with Image.open(source_path) as img:
+        width, height = img.size
+    return {
+        'width': width,
+        'height': height,
+        'bytes': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(source_path),
+    }
+
+
+def make_placeholder(static_folder, poster_path):
+    """A tiny WebP of the poster as a data: URI. Decodes the poster (JPEGs at a fraction of their size)."""
+    with Image.open(os.path.join(static_folder, poster_path)) as img:
+        img.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4))
+        small = img.convert('RGB')
+    data = io.BytesIO()
+    small.save(data, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(data.getvalue()).decode('ascii')
+
+
+def add_placeholder(posters, poster_path, sha256, placeholder):
+    """Returns posters with the placeholder added to poster_path's entry, or None if that entry
+    is gone or now describes other bytes (the poster was replaced while its placeholder was made).
+
+    Entries are never modified in place; the result is a new dict sharing the other entries.
+    """
+    entry = posters.get(poster_path)
+    if entry is None or entry['sha256'] != sha256:
+        return None
+    return {**posters, poster_path: {**entry, 'placeholder': placeholder}}
+
+
+def load_catalog(index_path):
+    """Returns {poster_path: entry} from the index, or None if it's missing, unreadable or from another version."""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != CATALOG_VERSION:
+        return None
+    return index['posters']
+
+
+def save_catalog(index_path, posters):
+    """Writes the index atomically. Raises OSError if static/ isn't writable."""
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f'{index_path}.{os.getpid()}.tmp' # Server workers may save at the same time
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CATALOG_VERSION, 'posters': posters}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def refresh_catalog(static_folder, previous, log=print):
+    """Scans static/posters against a previous catalog ({} for none).
+
+    Entries for files whose size and modification time match are reused as they are; other
+    posters are read and hashed. Files that can't be read as images are left out. Returns
+    (posters, summary), where summary is {'reused': n, 'read': n, 'removed': n, 'failed': n}.
+    Raises OSError if the directory can't be read.
+    """
+    posters = {}
+    summary = {'reused': 0, 'read': 0, 'removed': 0, 'failed': 0}
+    for poster_path, stat in sorted(scan_poster_files(static_folder).items()):
+        entry = previous.get(poster_path)
+        if entry and entry['bytes'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            posters[poster_path] = entry
+            summary['reused'] += 1
+            continue
+        try:
+            posters[poster_path] = catalog_entry(static_folder, poster_path, stat)
+        except OSError as e: # Including Pillow's UnidentifiedImageError
+            log(f"Leaving {poster_path} out of the poster catalog: {e}")
+            summary['failed'] += 1
+            continue
+        summary['read'] += 1
+    summary['removed'] = len(previous.keys() - posters.keys())
+    return posters, summary
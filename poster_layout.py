@@ -0,0 +1,170 @@
+"""Per-poster caption regions and text colors, computed once instead of on every render.
+
+The renderer used to pick each block's text color by inverting the single pixel under the
+middle of its first line, which on a busy poster is often a poor sample (a highlight or a
+speck of shadow). Instead, every poster is analyzed once: each caption region is cut into
+horizontal bands, one percent of the image height apiece, and each band's average color and
+brightness spread are stored in a sidecar index next to the derivatives manifest.
+
+At render time text_style() combines the bands the text actually covers into one average and
+spread, then picks a fill that stands out from that average, plus an outline when the
+background is too busy for any flat color to read well. That is a lookup and a few dozen
+additions; no pixel data is touched.
+
+`flask posters build` runs build_layout_index(). Posters missing from the index (or an index
+built for other caption regions) are analyzed on first use by the app instead.
+"""
+import functools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageStat
+
+from poster_pipeline import file_sha256
+
+LAYOUT_INDEX_VERSION = 1
+ANALYSIS_BANDS = 100           # Bands per image height; each one is 1% of the poster
+ANALYSIS_ROWS_PER_BAND = 6     # Posters are box-downscaled to ANALYSIS_BANDS * this many rows first
+MIN_TEXT_CONTRAST = 128        # Minimum luma gap (0-255) between fill and background before black/white is used
+BUSY_LUMA_STDDEV = 48          # Backgrounds whose luma varies more than this get an outline around the text
+STYLE_CACHE_SIZE = 4096        # Combined (bands, extent) -> style results kept
+DEFAULT_TEXT_STYLE = {'fill': (255, 255, 255), 'outline': (0, 0, 0)} # Reads on any background; for posters not analyzed yet
+
+
+def analyze_poster(img, regions):
+    """Band statistics for each caption region of a decoded poster.
+
+    regions is {name: (left, top, right, bottom)} in fractions of the image size. Returns
+    {name: {'box': [...], 'first_band': n, 'bands': [[r, g, b, luma, luma_stddev], ...]}}
+    with one band per ANALYSIS_BANDS-th of the image height that the region overlaps.
+    """
+    height = ANALYSIS_BANDS * ANALYSIS_ROWS_PER_BAND
+    width = max(1, round(img.width * height / img.height))
+    small = img.convert('RGB').resize((width, height), Image.BOX) # BOX: every source pixel weighs equally
+    luma = small.convert('L')
+
+    blocks = {}
+    for name, (left, top, right, bottom) in regions.items():
+        x0 = min(width - 1, int(left * width))
+        x1 = max(x0 + 1, min(width, round(right * width)))
+        first_band = min(ANALYSIS_BANDS - 1, int(top * ANALYSIS_BANDS))
+        last_band = max(first_band, min(ANALYSIS_BANDS - 1, -int(-bottom * ANALYSIS_BANDS) - 1))
+        bands = []
+        for band in range(first_band, last_band + 1):
+            box = (x0, band * ANALYSIS_ROWS_PER_BAND, x1, (band + 1) * ANALYSIS_ROWS_PER_BAND)
+            rgb = ImageStat.Stat(small.crop(box)).mean
+            luma_stat = ImageStat.Stat(luma.crop(box))
+            bands.append([round(channel, 1) for channel in (*rgb, luma_stat.mean[0], luma_stat.stddev[0])])
+        blocks[name] = {'box': [left, top, right, bottom], 'first_band': first_band, 'bands': bands}
+    return blocks
+
+
+def analyze_poster_file(path, regions):
+    with Image.open(path) as img:
+        return analyze_poster(img, regions)
+
+
+@functools.lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _combined_band_stats(first_band, bands, band_start, band_end):
+    """Average color, luma and luma stddev over bands[band_start:band_end] (absolute band numbers)."""
+    selected = bands[max(0, band_start - first_band):max(1, band_end - first_band)] or bands[-1:]
+    count = len(selected)
+    r, g, b, luma = (sum(band[i] for band in selected) / count for i in range(4))
+    # Bands are equal-sized, so the pooled variance is the mean of (variance + mean^2) minus the overall mean^2
+    mean_square = sum(band[4] ** 2 + band[3] ** 2 for band in selected) / count
+    return (r, g, b), luma, max(0.0, mean_square - luma ** 2) ** 0.5
+
+
+def text_style(block, top_fraction, bottom_fraction):
+    """Fill and outline colors for text covering [top_fraction, bottom_fraction] of the image height.
+
+    block is one region from analyze_poster(). The fill is the inverse of the background's
+    average color, as the renderer has always drawn it, unless that is too close to the
+    background in brightness (mid-grey inverts to mid-grey), in which case it is white or
+    black. Returns {'fill': (r, g, b), 'outline': (r, g, b) or None}.
+    """
+    band_start = int(top_fraction * ANALYSIS_BANDS)
+    band_end = max(band_start + 1, -int(-bottom_fraction * ANALYSIS_BANDS))
+    bands = block['bands']
+    if not isinstance(bands, tuple):
+        bands = tuple(tuple(band) for band in bands) # Hashable for the cache
+    (r, g, b), luma, luma_stddev = _combined_band_stats(block['first_band'], bands, band_start, band_end)
+
+    fill = (255 - round(r), 255 - round(g), 255 - round(b))
+    if abs((255 - luma) - luma) < MIN_TEXT_CONTRAST:
+        fill = (255, 255, 255) if luma < 128 else (0, 0, 0)
+    outline = None
+    if luma_stddev > BUSY_LUMA_STDDEV:
+        fill_luma = (299 * fill[0] + 587 * fill[1] + 114 * fill[2]) / 1000
+        outline = (0, 0, 0) if fill_luma >= 128 else (255, 255, 255)
+    return {'fill': fill, 'outline': outline}
+
+
+def frozen_blocks(blocks):
+    """analyze_poster() output with band lists turned into tuples, so text_style() can cache on them."""
+    return {name: {**block, 'bands': tuple(tuple(band) for band in block['bands'])} for name, block in blocks.items()}
+
+
+# --- Sidecar Index ---
+
+def _settings(regions):
+    return {
+        'regions': {name: list(box) for name, box in sorted(regions.items())},
+        'bands': ANALYSIS_BANDS,
+        'rows_per_band': ANALYSIS_ROWS_PER_BAND,
+    }
+
+
+def load_layout_index(index_path, regions):
+    """Returns {poster_path: entry} from the index, or None if it's missing, unreadable, from
+    another version, or was built for different caption regions."""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != LAYOUT_INDEX_VERSION or index.get('settings') != _settings(regions):
+        return None
+    return index['posters']
+
+
+def analyze_poster_entry(static_folder, poster_path, regions, previous_entry=None):
+    """Index entry for one poster. Runs in a worker process. Returns (entry, was_analyzed)."""
+    source_path = os.path.join(static_folder, poster_path)
+    sha256 = file_sha256(source_path)
+    if previous_entry and previous_entry.get('sha256') == sha256:
+        return previous_entry, False
+    return {'sha256': sha256, 'blocks': analyze_poster_file(source_path, regions)}, True
+
+
+def build_layout_index(static_folder, poster_paths, index_path, regions, jobs=None, force=False, log=print):
+    """Analyzes poster_paths in parallel and writes the index. Unchanged posters are skipped.
+
+    Returns a summary dict: {'analyzed': n, 'skipped': n, 'failed': n}.
+    """
+    previous_posters = {} if force else (load_layout_index(index_path, regions) or {})
+    posters = {}
+    summary = {'analyzed': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(analyze_poster_entry, static_folder, poster_path, regions, previous_posters.get(poster_path)): poster_path
+            for poster_path in sorted(poster_paths)
+        }
+        for future, poster_path in futures.items():
+            try:
+                entry, was_analyzed = future.result()
+            except Exception as e:
+                log(f"Failed to analyze {poster_path}: {e}")
+                summary['failed'] += 1
+                continue
+            posters[poster_path] = entry
+            summary['analyzed' if was_analyzed else 'skipped'] += 1
+
+    index = {'version': LAYOUT_INDEX_VERSION, 'settings': _settings(regions), 'posters': posters}
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+    os.replace(tmp_path, index_path)
+    return summary
@@ -0,0 +1,170 @@
+"""Offline poster preprocessing: writes web-sized derivatives of every poster.
+
+The originals in static/posters are ~3 MB, ~2000px PNGs, far bigger than any browser
+displays them. `flask posters build` runs build_derivatives() to produce resolution-capped
+WebP and JPEG copies plus a manifest.json describing them, which app.py uses to serve
+posters and render captions at a size matching the client.
+
+The build is incremental (posters whose content hash and build settings are unchanged are
+skipped) and runs one poster per process so it uses every core. Derivative file names carry
+the poster's content hash, so 003.png and 003.jpg never share a file, a replaced poster gets
+new URLs, and files of posters since replaced or removed are deleted after the build.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+MANIFEST_VERSION = 2
+DERIVATIVE_DIR = 'build/posters' # Relative to static/
+DERIVATIVE_HASH_CHARS = 12 # Hex digits of the poster's SHA-256 in derivative file names
+
+# Pillow format name and file extension for each output encoding
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's contents, read in chunks to keep memory flat."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_path(poster_path, sha256, width, fmt):
+    """Static-relative path of a derivative, e.g. posters/003.png -> build/posters/003-1f0c2a9be41d-960.webp"""
+    stem = os.path.splitext(os.path.basename(poster_path))[0]
+    return f'{DERIVATIVE_DIR}/{stem}-{sha256[:DERIVATIVE_HASH_CHARS]}-{width}.{DERIVATIVE_FORMATS[fmt][1]}'
+
+
+def load_manifest(manifest_path):
+    """Returns the parsed manifest, or None if it's missing, unreadable or from another version."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _is_up_to_date(previous_entry, sha256, static_folder):
+    """True if a previous manifest entry was built from the same bytes and its files still exist."""
+    if not previous_entry or previous_entry.get('sha256') != sha256:
+        return False
+    for derivative in previous_entry['derivatives'].values():
+        for fmt in DERIVATIVE_FORMATS:
+            if not os.path.exists(os.path.join(static_folder, derivative[fmt]['path'])):
+                return False
+    return True
+
+
+def build_poster(static_folder, poster_path, widths, quality, previous_entry=None):
+    """Builds every derivative of one poster. Runs in a worker process.
+
+    Returns (manifest_entry, was_rebuilt).
+    """
+    source_path = os.path.join(static_folder, poster_path)
+    sha256 = file_sha256(source_path)
+    if _is_up_to_date(previous_entry, sha256, static_folder):
+        return previous_entry, False
+
+    with Image.open(source_path) as source:
+        source_img = source.convert('RGB')
+    source_width, source_height = source_img.size
+
+    derivatives = {}
+    for width in sorted(widths):
+        if width >= source_width:
+            continue # Never upscale; the original already serves this size
+        height = max(1, round(source_height * width / source_width))
+        resized = source_img.resize((width, height), Image.LANCZOS)
+        outputs = {}
+        for fmt, (pil_format, _) in DERIVATIVE_FORMATS.items():
+            rel_path = derivative_path(poster_path, sha256, width, fmt)
+            full_path = os.path.join(static_folder, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            save_kwargs = {'quality': quality}
+            if pil_format == 'JPEG':
+                save_kwargs.update(optimize=True, progressive=True)
+            elif pil_format == 'WEBP':
+                save_kwargs.update(method=4)
+            resized.save(full_path, format=pil_format, **save_kwargs)
+            outputs[fmt] = {'path': rel_path, 'bytes': os.path.getsize(full_path)}
+        derivatives[str(width)] = {'width': width, 'height': height, **outputs}
+
+    entry = {
+        'sha256': sha256,
+        'width': source_width,
+        'height': source_height,
+        'bytes': os.path.getsize(source_path),
+        'derivatives': derivatives,
+    }
+    return entry, True
+
+
+def build_derivatives(static_folder, poster_paths, manifest_path, widths, quality, jobs=None, force=False, log=print):
+    """Builds derivatives for poster_paths in parallel and writes the manifest.
+
+    Returns a summary dict: {'built': n, 'skipped': n, 'failed': n}.
+    """
+    previous = None if force else load_manifest(manifest_path)
+    settings = {'widths': sorted(widths), 'quality': quality}
+    if previous and previous.get('settings') != settings:
+        log("Build settings changed since the last build; rebuilding every poster.")
+        previous = None
+    previous_posters = previous['posters'] if previous else {}
+
+    posters = {}
+    summary = {'built': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(build_poster, static_folder, poster_path, widths, quality, previous_posters.get(poster_path)): poster_path
+            for poster_path in sorted(poster_paths)
+        }
+        for future, poster_path in futures.items():
+            try:
+                entry, was_rebuilt = future.result()
+            except Exception as e:
+                log(f"Failed to build derivatives for {poster_path}: {e}")
+                summary['failed'] += 1
+                if poster_path in previous_posters:
+                    posters[poster_path] = previous_posters[poster_path] # Keep serving the last good build
+                continue
+            posters[poster_path] = entry
+            summary['built' if was_rebuilt else 'skipped'] += 1
+
+    manifest = {'version': MANIFEST_VERSION, 'settings': settings, 'posters': posters}
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path) # Readers never see a half-written manifest
+    _remove_stale_derivatives(static_folder, posters, log)
+    return summary
+
+
+def _remove_stale_derivatives(static_folder, posters, log):
+    """Deletes derivative files the manifest no longer lists (their poster was replaced or removed)."""
+    current = {derivative[fmt]['path'] for entry in posters.values()
+               for derivative in entry['derivatives'].values() for fmt in DERIVATIVE_FORMATS}
+    extensions = tuple(f'.{extension}' for _, extension in DERIVATIVE_FORMATS.values())
+    try:
+        names = os.listdir(os.path.join(static_folder, DERIVATIVE_DIR))
+    except OSError:
+        return
+    stale = [name for name in names if name.endswith(extensions) and f'{DERIVATIVE_DIR}/{name}' not in current]
+    for name in stale:
+        try:
+            os.remove(os.path.join(static_folder, DERIVATIVE_DIR, name))
+        except OSError as e:
+            log(f"Couldn't remove stale derivative {name}: {e}")
+    if stale:
+        log(f"Removed {len(stale)} stale derivative files.")
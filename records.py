@@ -0,0 +1,51 @@
+"""Compact records for what a game keeps per player, per caption and per finished round.
+
+Slotted dataclasses instead of dicts: no per-object __dict__, fixed fields, and attribute
+access that Jinja templates read exactly like the old dict keys (player.name, caption.text1).
+They compare by value and pickle/deepcopy cleanly, which the state stores rely on.
+
+Player IDs are the 36-character session UUIDs; intern_id() makes every copy of one ID the
+same string object, so the roster's dict, its sets, the captions and the votes all share it
+(and pickle writes it once per state).
+"""
+import sys
+from dataclasses import dataclass, field
+
+UNNAMED_PLAYER_NAME = 'Unnamed Player'
+
+
+def intern_id(player_id):
+    return sys.intern(player_id)
+
+
+@dataclass(slots=True)
+class Player:
+    player_id: str
+    name: str = UNNAMED_PLAYER_NAME
+    score: int = 0
+    submitted_this_round: bool = False
+    voted_this_round: bool = False
+
+    @property
+    def is_named(self):
+        return bool(self.name) and self.name != UNNAMED_PLAYER_NAME
+
+
+@dataclass(slots=True)
+class Caption:
+    text1: str = ''
+    text2: str = ''
+
+    def __bool__(self):
+        """False for a caption with neither line filled in."""
+        return bool(self.text1 or self.text2)
+
+
+@dataclass(slots=True)
+class Round:
+    """A finished round, kept so results and history don't need recomputing from votes."""
+    number: int
+    poster: str
+    captions: dict = field(default_factory=dict) # {author_id: Caption}
+    vote_counts: dict = field(default_factory=dict) # {author_id: votes that scored}
+    winner_id: str = None
@@ -0,0 +1,276 @@
+"""Render service: CPU-bound jobs (caption renders) on a pool of worker processes.
+
+Pillow holds the GIL while it works, so renders running on threads of a server process stall
+every other request that process handles, down to the cheapest JSON poll. RenderService runs
+them in separate processes instead, leaving the server's threads to do I/O:
+
+- Jobs wait in one bounded queue, ordered by priority (lower runs first), then by age. When
+  the queue is full a job only gets in by displacing a lower-priority one; otherwise submit()
+  returns False, and the caller can answer 503 with a Retry-After.
+- Jobs are keyed. Submitting a key that is already queued or running adds nothing, though it
+  raises the queued job's priority if the new one is higher.
+- Each process runs one job at a time. A job still running after job_timeout seconds has its
+  process killed and replaced, and fails.
+- processes=0 runs jobs on threads of the calling process instead, as renders used to run
+  (no timeouts: a thread can't be killed). For debugging and comparisons.
+
+A job is a module-level function and its arguments, which must pickle, as must its result.
+Processes are fresh interpreters (forking a threaded server is unsafe) that import the modules
+in preload before taking their first job; a job's function is looked up by module and name.
+What those modules import at module level is paid by every process, including each one
+that replaces a killed process, so job modules are kept free of Flask and of server setup.
+One that has both (app.py) skips its setup when in_worker_process() is true, and hands
+jobs what it already resolved instead of having them look it up.
+"""
+import functools
+import heapq
+import importlib
+import itertools
+import logging
+import os
+import pickle
+import select
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+WORKER_START_TIMEOUT_SECONDS = 60 # A new process must have imported its preload modules by then
+# Runs in each worker process. Only the job modules are imported there: unlike multiprocessing's
+# spawn, the parent's __main__ is never re-run, whatever script or server started it.
+WORKER_BOOTSTRAP = "import sys; sys.path[:0] = sys.argv[4:]; import render_service; render_service._worker_main(*sys.argv[1:4])"
+
+log = logging.getLogger(__name__)
+
+_in_worker_process = False
+
+
+def in_worker_process():
+    """True in a render worker process, so modules it imports can skip server-only setup."""
+    return _in_worker_process
+
+
+def _module_name(module_name):
+    """Importable name for a module: a script run as __main__ is imported by its file name."""
+    if module_name != '__main__':
+        return module_name
+    main = sys.modules['__main__']
+    if getattr(main, '__spec__', None) is not None:
+        return main.__spec__.name
+    return os.path.splitext(os.path.basename(main.__file__))[0]
+
+
+def _worker_main(read_fd, write_fd, options):
+    """Worker process loop: receives (module, qualname, args), sends back ('ok', result) or ('error', traceback)."""
+    global _in_worker_process
+    _in_worker_process = True
+    niceness, *preload = options.split(',')
+    if int(niceness):
+        os.nice(int(niceness)) # Let request handling win the CPU when both want it
+    for module_name in preload:
+        importlib.import_module(module_name)
+    jobs, replies = os.fdopen(int(read_fd), 'rb'), os.fdopen(int(write_fd), 'wb')
+    try:
+        pickle.dump(('ready', None), replies)
+        replies.flush()
+        while True:
+            module_name, qualname, args = pickle.load(jobs)
+            try:
+                func = functools.reduce(getattr, qualname.split('.'), importlib.import_module(module_name))
+                reply = ('ok', func(*args))
+            except Exception:
+                reply = ('error', traceback.format_exc())
+            pickle.dump(reply, replies)
+            replies.flush()
+    except (EOFError, BrokenPipeError): # The server process is gone
+        return
+
+
+class _WorkerProcess:
+    def __init__(self, preload, niceness):
+        job_read, job_write = os.pipe()
+        reply_read, reply_write = os.pipe()
+        options = ','.join([str(niceness), *preload])
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', WORKER_BOOTSTRAP, str(job_read), str(reply_write), options, *sys.path],
+            pass_fds=(job_read, reply_write), stdin=subprocess.DEVNULL)
+        os.close(job_read)
+        os.close(reply_write)
+        self.jobs = os.fdopen(job_write, 'wb')
+        self.replies = os.fdopen(reply_read, 'rb')
+        if self._receive(WORKER_START_TIMEOUT_SECONDS)[0] != 'ready':
+            self.stop()
+            raise RuntimeError(f"Render worker didn't start within {WORKER_START_TIMEOUT_SECONDS}s")
+
+    def _receive(self, timeout):
+        if not select.select([self.replies], [], [], timeout)[0]:
+            return 'timeout', None
+        try:
+            return pickle.load(self.replies)
+        except (EOFError, OSError, pickle.UnpicklingError):
+            return 'died', None
+
+    def run(self, func, args, timeout):
+        """Returns (outcome, result), outcome being 'ok', 'error', 'timeout' or 'died'."""
+        try:
+            pickle.dump((_module_name(func.__module__), func.__qualname__, args), self.jobs)
+            self.jobs.flush()
+        except (BrokenPipeError, OSError):
+            return 'died', None
+        return self._receive(timeout)
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+        for f in (self.jobs, self.replies):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+class _Job:
+    __slots__ = ('key', 'priority', 'seq', 'func', 'args', 'on_done')
+
+    def __init__(self, key, priority, seq, func, args, on_done):
+        self.key, self.priority, self.seq = key, priority, seq
+        self.func, self.args, self.on_done = func, args, on_done
+
+
+class RenderService:
+    def __init__(self, processes, max_queue, job_timeout, preload=(), niceness=0, name='render'):
+        self.processes = processes
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.preload = tuple(_module_name(name) for name in preload)
+        self.niceness = niceness
+        self.name = name
+        self._condition = threading.Condition()
+        self._heap = [] # (priority, seq, key), may contain superseded entries
+        self._queued = {} # {key: _Job}, the live queued job per key
+        self._running = set() # Keys of jobs being run
+        self._seq = itertools.count()
+        self._threads = []
+        self._pid = None
+        self._counts = {'completed': 0, 'failed': 0, 'timed_out': 0, 'rejected': 0, 'displaced': 0}
+
+    def submit(self, key, func, args, priority, on_done=None):
+        """Queues func(*args) under key. Returns False if the queue is full.
+
+        on_done(result) is called on a service thread with func's return value, or with None
+        if the job failed, timed out or was displaced. A key already queued or running returns
+        True without queueing anything (only the first submission's on_done is called).
+        """
+        displaced = None
+        with self._condition:
+            self._ensure_started()
+            if key in self._running:
+                return True
+            job = self._queued.get(key)
+            if job is not None:
+                if priority < job.priority:
+                    job.priority, job.seq = priority, next(self._seq)
+                    heapq.heappush(self._heap, (job.priority, job.seq, key))
+                return True
+            if len(self._queued) >= self.max_queue:
+                worst = max(self._queued.values(), key=lambda j: (j.priority, j.seq))
+                if worst.priority <= priority:
+                    self._counts['rejected'] += 1
+                    return False
+                del self._queued[worst.key] # Its heap entry is skipped when it comes up
+                self._counts['displaced'] += 1
+                displaced = worst
+            job = self._queued[key] = _Job(key, priority, next(self._seq), func, args, on_done)
+            heapq.heappush(self._heap, (job.priority, job.seq, key))
+            self._condition.notify()
+        if displaced is not None and displaced.on_done:
+            displaced.on_done(None)
+        return True
+
+    def is_pending(self, key):
+        """True if key is queued or running."""
+        with self._condition:
+            return key in self._queued or key in self._running
+
+    def wait_idle(self, timeout):
+        """Blocks until nothing is queued or running, or timeout seconds pass. Returns True if idle."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._condition:
+                if not self._queued and not self._running:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        with self._condition:
+            return {'processes': self.processes, 'queued': len(self._queued), 'running': len(self._running),
+                    'max_queue': self.max_queue, **self._counts}
+
+    def _ensure_started(self):
+        # Called with the condition held. Started lazily, and again in forked server workers,
+        # where the parent's threads don't exist
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._heap, self._queued, self._running = [], {}, set()
+        self._threads = [threading.Thread(target=self._run, name=f'{self.name}-dispatch-{i}', daemon=True)
+                         for i in range(self.processes or 1)]
+        for thread in self._threads:
+            thread.start()
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                while self._heap:
+                    priority, seq, key = heapq.heappop(self._heap)
+                    job = self._queued.get(key)
+                    if job is not None and job.seq == seq:
+                        del self._queued[key]
+                        self._running.add(key)
+                        return job
+                self._condition.wait()
+
+    def _run(self):
+        """Dispatcher thread: feeds one worker process (or runs jobs itself when processes=0)."""
+        worker = None
+        while True:
+            if self.processes and worker is None:
+                try: # Ahead of the next job, so it doesn't wait for interpreter startup and imports
+                    worker = _WorkerProcess(self.preload, self.niceness)
+                except Exception as e:
+                    log.error("Couldn't start a render worker process: %s", e)
+            job = self._next_job()
+            outcome, result = 'died', None
+            if not self.processes:
+                try:
+                    outcome, result = 'ok', job.func(*job.args)
+                except Exception:
+                    outcome, result = 'error', traceback.format_exc()
+            elif worker is not None:
+                outcome, result = worker.run(job.func, job.args, self.job_timeout)
+                if outcome in ('timeout', 'died'):
+                    worker.stop() # Replaced before the next job
+                    worker = None
+
+            if outcome == 'ok':
+                self._finish(job, 'completed', result)
+                continue
+            if outcome == 'timeout':
+                log.warning("Render job %r timed out after %ss; its worker process was replaced.", job.key, self.job_timeout)
+            elif outcome == 'died':
+                log.error("Render job %r failed: its worker process exited or couldn't be started.", job.key)
+            else:
+                log.error("Render job %r failed: %s", job.key, result)
+            self._finish(job, 'timed_out' if outcome == 'timeout' else 'failed', None)
+
+    def _finish(self, job, count, result):
+        if job.on_done:
+            try:
+                job.on_done(result) # Before the key stops counting as pending, so it's never resubmitted in between
+            except Exception as e:
+                log.exception("Render job %r completion callback failed: %s", job.key, e)
+        with self._condition:
+            self._running.discard(job.key)
+            self._counts[count] += 1
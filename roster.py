@@ -0,0 +1,188 @@
+"""The players in one game, indexed for the checks every submission and vote makes.
+
+A Roster is a read-only {player_id: Player} mapping for views and templates, but all changes
+go through its methods so it can keep these up to date as players join, rename, submit and vote:
+
+  named             players who have picked a name (only they take part in rounds)
+  pending_captions  named players who haven't submitted this round's caption
+  pending_votes     named players with a caption in who haven't voted yet
+  votes             {voter_id: author_id} for this round
+  vote_counts       {author_id: votes that count}: from a named voter, for a named author's caption
+
+"Has everyone submitted/voted?" is then a length check instead of a scan over every player,
+and tallying only touches the authors who got votes. Rosters are plain picklable objects so
+they can live in any state store.
+"""
+from records import Player, intern_id
+
+
+class Roster:
+    __slots__ = ('_players', 'voting', 'named', 'pending_captions', 'pending_votes', 'votes', 'vote_counts')
+
+    def __init__(self):
+        self._players = {} # {player_id: Player}
+        self.voting = False # Between start_voting() and the next start_round()
+        self.named = set()
+        self.pending_captions = set()
+        self.pending_votes = set()
+        self.votes = {}
+        self.vote_counts = {}
+
+    # --- Read-only mapping interface (what templates and views use) ---
+
+    def __getitem__(self, player_id):
+        return self._players[player_id]
+
+    def get(self, player_id, default=None):
+        return self._players.get(player_id, default)
+
+    def __contains__(self, player_id):
+        return player_id in self._players
+
+    def __iter__(self):
+        return iter(self._players)
+
+    def __len__(self):
+        return len(self._players)
+
+    def keys(self):
+        return self._players.keys()
+
+    def values(self):
+        return self._players.values()
+
+    def items(self):
+        return self._players.items()
+
+    def __eq__(self, other):
+        # The indexes are derived from the players, votes and phase, so those decide equality
+        if not isinstance(other, Roster):
+            return NotImplemented
+        return self._players == other._players and self.votes == other.votes and self.voting == other.voting
+
+    __hash__ = None
+
+    def canonical_id(self, player_id):
+        """The ID string this roster already holds for player_id, so every reference shares one object."""
+        player = self._players.get(player_id)
+        return player.player_id if player is not None else intern_id(player_id)
+
+    # --- Membership ---
+
+    def join(self, player_id):
+        """Adds a new, unnamed player and returns their record. Existing players are left as they are."""
+        player = self._players.get(player_id)
+        if player is None:
+            player_id = intern_id(player_id)
+            player = self._players[player_id] = Player(player_id)
+        return player
+
+    def rename(self, player_id, name):
+        player = self._players[player_id]
+        was_named = player_id in self.named
+        player.name = name
+        if player.is_named != was_named:
+            if was_named:
+                self.named.discard(player_id)
+            else:
+                self.named.add(player_id)
+            self._update_pending(player_id)
+            self._recount_votes()
+
+    def remove(self, player_id):
+        if self._players.pop(player_id, None) is None:
+            return
+        for index in (self.named, self.pending_captions, self.pending_votes):
+            index.discard(player_id)
+        self.votes.pop(player_id, None)
+        self._recount_votes()
+
+    # --- Round progress ---
+
+    def start_round(self):
+        """Clears every player's submission and vote for a new round."""
+        for player in self._players.values():
+            player.submitted_this_round = False
+            player.voted_this_round = False
+        # New dicts rather than clear(): the finished round's Round record keeps the old ones
+        self.votes = {}
+        self.vote_counts = {}
+        self.voting = False
+        self.pending_captions = set(self.named)
+        self.pending_votes.clear()
+
+    def start_voting(self):
+        """Resets voted flags at the start of the voting phase; everyone with a caption in must vote."""
+        for player in self._players.values():
+            player.voted_this_round = False
+        self.voting = True
+        self.pending_votes = {p_id for p_id in self.named if self._players[p_id].submitted_this_round}
+
+    def mark_submitted(self, player_id):
+        self._players[player_id].submitted_this_round = True
+        self._update_pending(player_id)
+        if self.votes:
+            self._recount_votes() # Votes for this player's caption may count now
+
+    def mark_voted(self, player_id):
+        """Records that a player is done voting (with or without casting a vote)."""
+        self._players[player_id].voted_this_round = True
+        self.pending_votes.discard(player_id)
+
+    def record_vote(self, voter_id, author_id):
+        author_id = self.canonical_id(author_id) # Came from a form field
+        previous = self.votes.get(voter_id)
+        if previous is not None and self._counts(voter_id, previous):
+            self._add_count(previous, -1)
+        self.votes[voter_id] = author_id
+        if self._counts(voter_id, author_id):
+            self._add_count(author_id, 1)
+        self.mark_voted(voter_id)
+
+    def all_submitted(self):
+        """True once every named player has a caption in (False if nobody is named)."""
+        return bool(self.named) and not self.pending_captions
+
+    def all_voted(self):
+        """True once every named player with a caption in has voted (or nobody needs to)."""
+        return not self.pending_votes
+
+    def award_votes(self):
+        """Adds this round's counted votes to the authors' scores. Returns {author_id: votes}.
+
+        The returned dict is the roster's own; it is left alone once the next round starts.
+        """
+        for author_id, count in self.vote_counts.items():
+            self._players[author_id].score += count # Each vote is 1 point
+        return self.vote_counts
+
+    # --- Index maintenance ---
+
+    def _update_pending(self, player_id):
+        player = self._players[player_id]
+        named = player_id in self.named
+        if named and not player.submitted_this_round:
+            self.pending_captions.add(player_id)
+        else:
+            self.pending_captions.discard(player_id)
+        if self.voting and named and player.submitted_this_round and not player.voted_this_round:
+            self.pending_votes.add(player_id)
+        else:
+            self.pending_votes.discard(player_id)
+
+    def _counts(self, voter_id, author_id):
+        return voter_id in self.named and author_id in self.named and self._players[author_id].submitted_this_round
+
+    def _add_count(self, author_id, delta):
+        count = self.vote_counts.get(author_id, 0) + delta
+        if count:
+            self.vote_counts[author_id] = count
+        else:
+            self.vote_counts.pop(author_id, None)
+
+    def _recount_votes(self):
+        """Rebuilds vote_counts after a change to who is named or submitted (rare: O(votes))."""
+        self.vote_counts = {} # Not clear(): a finished Round may still hold the old dict
+        for voter_id, author_id in self.votes.items():
+            if self._counts(voter_id, author_id):
+                self._add_count(author_id, 1)
@@ -0,0 +1,389 @@
+"""Game state storage backends.
+
+Each room's game state is stored as a whole, with a version number that goes up on every
+write. Request handlers work inside transaction(), which loads a private copy of the state,
+lets the caller mutate it, and writes it back with an atomic compare-and-set on the version.
+If another thread or worker process committed in the meantime, StaleStateError is raised
+and the caller retries with fresh state. That makes phase transitions and caption/vote
+submissions safe with any number of gunicorn workers sharing one store.
+
+Backends:
+  InMemoryStateStore  - a dict in this process (single-worker deployments, tests)
+  JournaledStateStore - the same, plus an append-only log on disk that survives restarts
+                        and keeps every finished round (see event_log.py)
+  SQLiteStateStore    - a SQLite file in WAL mode, shared by every worker on the machine
+"""
+import copy
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+from event_log import EventLog
+
+
+class StaleStateError(Exception):
+    """Raised when committing state that someone else changed after it was loaded."""
+
+
+class RoomNotFoundError(KeyError):
+    """Raised when loading a room that doesn't exist (never created, or removed)."""
+
+
+class StateStore:
+    """Interface shared by the backends. Subclasses implement the underscore methods."""
+
+    # True if other processes can see this store's writes, so caches of it must be refreshed
+    is_shared = False
+
+    def create(self, code, state):
+        """Stores the initial state for a new room. Returns False if the code is taken."""
+        raise NotImplementedError
+
+    def exists(self, code):
+        raise NotImplementedError
+
+    def version(self, code):
+        """Current version of a room's state, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def load(self, code):
+        """Returns (version, state) with a private copy of the state. Raises RoomNotFoundError."""
+        version, state, _ = self._load_for_update(code)
+        return version, state
+
+    def peek(self, code):
+        """Returns (version, state) for reading only: the caller must not modify the state, which
+        may be the stored one itself (no copy is made where the backend can avoid it), and
+        nothing is ever committed. Raises RoomNotFoundError."""
+        return self.load(code)
+
+    def delete(self, code):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def delete_idle(self, cutoff):
+        """Deletes rooms last written before cutoff (a time.time() value). Returns their codes."""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self, code, events=()):
+        """Yields a private copy of a room's state (in memory, a CopyOnWriteState over it);
+        commits it on exit if it was changed.
+
+        events is a list the block may fill with labels for what it changed ('vote_cast', ...),
+        which the journal backend records with the change. Raises StaleStateError on exit if
+        the room was written since it was loaded, and RoomNotFoundError if it doesn't exist.
+        Nothing is written if the block raises.
+        """
+        version, state, baseline = self._load_for_update(code)
+        yield state
+        self._commit(code, version, state, baseline, events)
+
+    def _load_for_update(self, code):
+        """Returns (version, state, baseline); baseline is whatever _commit needs to detect changes."""
+        raise NotImplementedError
+
+    def _commit(self, code, version, state, baseline, events):
+        raise NotImplementedError
+
+
+_MISSING = object()
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+
+class CopyOnWriteState(MutableMapping):
+    """A transaction's view of a stored state dict, copying only what the block touches.
+
+    A mutable value (the roster, captions, lists) is deep-copied the first time it's read, so
+    the stored state is never modified; scalars are shared. changes() compares just those
+    values and the assigned keys with the stored ones, so a request that looks at two fields
+    pays for two fields rather than for copying and comparing the whole room.
+    """
+
+    __slots__ = ('_stored', '_values', '_removed')
+
+    def __init__(self, stored):
+        self._stored = stored
+        self._values = {} # {key: value} copied on first read, or assigned
+        self._removed = set()
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        if key in self._removed:
+            raise KeyError(key)
+        value = self._stored[key]
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            value = self._values[key] = copy.deepcopy(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._removed.add(key)
+
+    def __contains__(self, key):
+        return key in self._values or (key in self._stored and key not in self._removed)
+
+    def __iter__(self):
+        yield from (key for key in self._stored if key not in self._removed)
+        yield from (key for key in self._values if key not in self._stored)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def changes(self):
+        """({key: new value} for touched keys whose value differs from the stored one, {removed keys})."""
+        changed = {key: value for key, value in self._values.items() if self._stored.get(key, _MISSING) != value}
+        return changed, self._removed & self._stored.keys()
+
+    def merged(self, changed, removed):
+        """The new state dict: the stored values, with changed and removed applied."""
+        state = {key: value for key, value in self._stored.items() if key not in removed}
+        state.update(changed)
+        return state
+
+
+class InMemoryStateStore(StateStore):
+    """Keeps every room's state in a dict in this process.
+
+    Stored states are never modified: transactions work on a CopyOnWriteState over them, and
+    a commit stores a new dict sharing every value the transaction didn't change.
+    """
+
+    def __init__(self):
+        self._rooms = {} # {code: [version, state, last_write_time]}; stored states are never modified
+        self._lock = threading.RLock() # Reentrant so JournaledStateStore can log under it
+
+    def create(self, code, state):
+        with self._lock:
+            if code in self._rooms:
+                return False
+            self._rooms[code] = [1, copy.deepcopy(state), time.time()]
+            return True
+
+    def exists(self, code):
+        return code in self._rooms
+
+    def version(self, code):
+        entry = self._rooms.get(code)
+        return entry[0] if entry else None
+
+    def delete(self, code):
+        with self._lock:
+            self._rooms.pop(code, None)
+
+    def count(self):
+        return len(self._rooms)
+
+    def delete_idle(self, cutoff):
+        with self._lock:
+            idle = [code for code, entry in self._rooms.items() if entry[2] < cutoff]
+            for code in idle:
+                del self._rooms[code]
+        return idle
+
+    def load(self, code):
+        version, stored_state = self.peek(code)
+        return version, copy.deepcopy(stored_state)
+
+    def peek(self, code):
+        entry = self._rooms.get(code)
+        if entry is None:
+            raise RoomNotFoundError(code)
+        return entry[0], entry[1]
+
+    def _load_for_update(self, code):
+        version, stored_state = self.peek(code)
+        return version, CopyOnWriteState(stored_state), stored_state
+
+    def _commit(self, code, version, state, baseline, events):
+        """Stores the transaction's changes. Returns (changed, removed) as CopyOnWriteState.changes()
+        gives them, or None if there were none."""
+        changed, removed = state.changes()
+        if not changed and not removed:
+            return None # Read-only request; nothing to write
+        with self._lock:
+            entry = self._rooms.get(code)
+            if entry is None:
+                raise RoomNotFoundError(code)
+            if entry[0] != version:
+                raise StaleStateError(code)
+            self._rooms[code] = [version + 1, state.merged(changed, removed), time.time()]
+        return changed, removed
+
+
+class JournaledStateStore(InMemoryStateStore):
+    """The in-memory store, with every change also appended to an EventLog in directory.
+
+    Rooms are rebuilt from the log when the store is created. Changes are logged under the
+    store's lock, so the log's order is the commit order. Like the in-memory store, it
+    serves a single process.
+    """
+
+    def __init__(self, directory, **log_options):
+        super().__init__()
+        self.log = EventLog(directory, **log_options)
+        started = time.perf_counter()
+        self._rooms, self.recovery = self.log.recover()
+        self.recovery['ms'] = (time.perf_counter() - started) * 1000
+        self.recovery['room_codes'] = sorted(self._rooms)
+
+    def create(self, code, state):
+        with self._lock:
+            if not super().create(code, state):
+                return False
+            version, stored_state, last_write = self._rooms[code]
+            self._append('put', code, version, ('room_created',), stored_state, last_write)
+            return True
+
+    def delete(self, code):
+        with self._lock:
+            if code in self._rooms:
+                super().delete(code)
+                self._append('delete', code, None, ('room_deleted',), None, time.time())
+
+    def delete_idle(self, cutoff):
+        with self._lock:
+            idle = super().delete_idle(cutoff)
+            for code in idle:
+                self._append('delete', code, None, ('room_idle',), None, time.time())
+        return idle
+
+    def _commit(self, code, version, state, baseline, events):
+        with self._lock:
+            written = super()._commit(code, version, state, baseline, events)
+            if written is None:
+                return None # Read-only request; nothing was written
+            changed, removed = written
+            new_version, stored_state, last_write = self._rooms[code]
+            if removed:
+                self._append('put', code, new_version, events, stored_state, last_write)
+            else:
+                self._append('update', code, new_version, events, changed, last_write)
+            return written
+
+    def _append(self, kind, code, version, events, changes, timestamp):
+        # Called with the lock held
+        if self.log.append(kind, code, version, events, changes, timestamp):
+            self.log.snapshot({room_code: list(entry) for room_code, entry in self._rooms.items()})
+
+    def flush(self, timeout=None):
+        """Waits until every change so far is on disk. Returns False on timeout."""
+        return self.log.flush(timeout)
+
+
+class SQLiteStateStore(StateStore):
+    """Stores each room's pickled state in one SQLite row, shared across worker processes.
+
+    WAL mode lets readers proceed while a writer commits; the compare-and-set is a single
+    UPDATE ... WHERE version = ?, so concurrent writers can't both win.
+    """
+
+    is_shared = True
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local() # sqlite3 connections can't be shared between threads
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rooms (
+                    code TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    state BLOB NOT NULL,
+                    last_write REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS rooms_last_write ON rooms (last_write)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Forked workers must not reuse the parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, code, state):
+        try:
+            self._connection().execute(
+                "INSERT INTO rooms (code, version, state, last_write) VALUES (?, 1, ?, ?)",
+                (code, pickle.dumps(state, pickle.HIGHEST_PROTOCOL), time.time()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def exists(self, code):
+        return self.version(code) is not None
+
+    def version(self, code):
+        row = self._connection().execute("SELECT version FROM rooms WHERE code = ?", (code,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, code):
+        self._connection().execute("DELETE FROM rooms WHERE code = ?", (code,))
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+
+    def delete_idle(self, cutoff):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            idle = [row[0] for row in conn.execute("SELECT code FROM rooms WHERE last_write < ?", (cutoff,))]
+            conn.execute("DELETE FROM rooms WHERE last_write < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return idle
+
+    def _load_for_update(self, code):
+        row = self._connection().execute("SELECT version, state FROM rooms WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            raise RoomNotFoundError(code)
+        version, blob = row
+        return version, pickle.loads(blob), blob
+
+    def _commit(self, code, version, state, baseline, events):
+        # Compared by value, not as bytes: pickles aren't canonical (sets come out in hash order,
+        # which differs between worker processes), so an unchanged state can re-pickle differently
+        if state == pickle.loads(baseline):
+            return # Read-only request; nothing to write
+        blob = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        cursor = self._connection().execute(
+            "UPDATE rooms SET version = version + 1, state = ?, last_write = ? WHERE code = ? AND version = ?",
+            (blob, time.time(), code, version))
+        if cursor.rowcount != 1:
+            if not self.exists(code):
+                raise RoomNotFoundError(code)
+            raise StaleStateError(code)
+
+
+def create_state_store(backend, sqlite_path=None, journal_dir=None):
+    """Builds the configured backend: 'memory', 'journal' or 'sqlite'."""
+    if backend == 'memory':
+        return InMemoryStateStore()
+    if backend == 'journal':
+        return JournaledStateStore(journal_dir)
+    if backend == 'sqlite':
+        return SQLiteStateStore(sqlite_path)
+    raise ValueError(f"Unknown game state backend {backend!r} (expected 'memory', 'journal' or 'sqlite')")
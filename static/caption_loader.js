@@ -0,0 +1,45 @@
+// Swaps caption placeholders for the rendered images once the server has them.
+// /rendered_caption answers 503 + Retry-After while a caption is still rendering in the
+// background, so each image is retried until it loads (or we give up after maxAttempts).
+// The displayed width is passed as ?w= so the server renders on a poster derivative of that size
+// (for overlay layers, which sit on top of the poster, that's the width of the poster they cover).
+// It's snapped up to one of the derivative widths listed in the script tag's data-widths, as the
+// server does (app.caption_render_width), so clients share URLs and the server's prerendered images.
+(function () {
+    const maxAttempts = 30;
+    const renderWidths = (document.currentScript.dataset.widths || '').split(',').filter(Boolean).map(Number);
+
+    function loadCaption(img, attempt) {
+        const loader = new Image();
+        loader.onload = function () {
+            img.src = loader.src;
+            img.classList.remove('caption-pending');
+        };
+        loader.onerror = function () {
+            if (attempt + 1 >= maxAttempts) {
+                console.error('Giving up on caption image:', img.dataset.captionSrc);
+                return;
+            }
+            // Back off gently: 0.5s, 1s, 1.5s ... capped at 3s
+            setTimeout(function () { loadCaption(img, attempt + 1); }, Math.min(3000, 500 * (attempt + 1)));
+        };
+        loader.src = img.dataset.captionSrc;
+    }
+
+    function withDisplayWidth(src, img) {
+        const sizedBy = img.classList.contains('caption-overlay') ? img.parentElement : img;
+        const cssWidth = sizedBy.clientWidth || (sizedBy.parentElement && sizedBy.parentElement.clientWidth) || 0;
+        if (!cssWidth) {
+            return src; // Layout unknown; the server falls back to its default render width
+        }
+        const pixels = Math.round(cssWidth * (window.devicePixelRatio || 1));
+        const url = new URL(src, window.location.href);
+        url.searchParams.set('w', renderWidths.find(function (w) { return w >= pixels; }) || renderWidths[renderWidths.length - 1] || pixels);
+        return url.toString();
+    }
+
+    document.querySelectorAll('img[data-caption-src]').forEach(function (img) {
+        img.dataset.captionSrc = withDisplayWidth(img.dataset.captionSrc, img);
+        loadCaption(img, 0);
+    });
+})();
@@ -0,0 +1,143 @@
+"""Caption text layout: word wrapping with measured, cached word widths.
+
+Each distinct word is measured once per (font, size). Lines are then built from cumulative
+widths (the words plus one space between each) instead of re-measuring the whole line every
+time a word is added, and finished layouts are memoized by (font, size, box width, text).
+Rendering and the writing page's live "will it fit?" check share these caches, so a caption
+is laid out once however many times it is previewed and rendered.
+
+fit_text() finds the largest font size whose layout fits a box by binary search. Probes use
+word widths measured once at a reference size and scaled, so a fit costs a handful of layout
+passes (and no font loads or drawing) per size tried.
+"""
+import functools
+from collections import namedtuple
+
+from PIL import ImageFont
+
+FONT_CACHE_SIZE = 32           # (font path, size) FreeType objects kept loaded
+WORD_WIDTH_CACHE_SIZE = 16384  # Measured (font path, size, word) widths
+LAYOUT_CACHE_SIZE = 4096       # Wrapped (font path, size, box width, text) layouts
+WRAP_WIDTH_FRACTION = 0.98     # Lines may use 98% of the box width, a small safety margin
+METRICS_REFERENCE_SIZE = 200   # Size fit_text() measures words at; other sizes scale from it
+
+
+class TextLayout(namedtuple('TextLayout', 'lines widths max_width font_size')):
+    """Wrapped lines of one text block at one font size, with each line's width in pixels."""
+    __slots__ = ()
+
+    @property
+    def line_count(self):
+        return len(self.lines)
+
+    @property
+    def overflows(self):
+        """True if some line (a single word too long to wrap) is wider than the box."""
+        return any(width > self.max_width for width in self.widths)
+
+    def height(self, line_height):
+        return self.line_count * line_height
+
+    def fits(self, line_height, max_height):
+        """True if every line fits the box width and the block is no taller than max_height."""
+        return not self.overflows and self.height(line_height) <= max_height
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_path, size):
+    """Returns a font object, memoized by (path, size) so each is only parsed once.
+
+    font_path None gives Pillow's built-in font. Raises OSError if the file can't be loaded.
+    """
+    if font_path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(font_path, size)
+
+
+@functools.lru_cache(maxsize=WORD_WIDTH_CACHE_SIZE)
+def text_width(font_path, size, text):
+    """Advance width of text in pixels."""
+    return load_font(font_path, size).getlength(text)
+
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_text(font_path, size, max_width, text):
+    """Wraps text into lines no wider than max_width; explicit newlines start a new line.
+
+    A single word wider than the box gets a line of its own (and the layout overflows).
+    A paragraph of only whitespace becomes an empty line, so it still takes up space;
+    an empty paragraph (e.g. between two newlines) adds nothing.
+    """
+    return _wrap(text, size, max_width, lambda word: text_width(font_path, size, word))
+
+
+def _estimated_layout(font_path, size, max_width, text):
+    """layout_text() using widths scaled from METRICS_REFERENCE_SIZE (no font load at this size)."""
+    scale = size / METRICS_REFERENCE_SIZE
+    return _wrap(text, size, max_width, lambda word: text_width(font_path, METRICS_REFERENCE_SIZE, word) * scale)
+
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def fit_text(font_path, max_size, min_size, max_width, max_height, line_height_multiplier, text):
+    """Layout at the largest font size in [min_size, max_size] that fits a max_width x max_height box.
+
+    Lines are int(size * line_height_multiplier) apart. Text that fits at max_size costs one
+    layout. Otherwise sizes are binary-searched with estimated widths, and the winner is
+    checked with exact ones (stepping down if rounding made the estimate optimistic). If not
+    even min_size fits, the min_size layout is returned and it overflows.
+    """
+    def fits(layout):
+        return layout.fits(int(layout.font_size * line_height_multiplier), max_height)
+
+    layout = layout_text(font_path, max_size, max_width, text)
+    if fits(layout) or max_size <= min_size:
+        return layout
+
+    best, low, high = min_size, min_size, max_size - 1
+    while low <= high:
+        size = (low + high) // 2
+        if fits(_estimated_layout(font_path, size, max_width, text)):
+            best, low = size, size + 1
+        else:
+            high = size - 1
+
+    for size in range(best, min_size - 1, -1):
+        layout = layout_text(font_path, size, max_width, text)
+        if fits(layout):
+            break
+    return layout
+
+
+def _wrap(text, size, max_width, measure):
+    space_width = measure(' ')
+    limit = max_width * WRAP_WIDTH_FRACTION
+    lines, widths = [], []
+
+    for paragraph in text.split('\n'):
+        words = paragraph.split()
+        if not words:
+            if paragraph:
+                lines.append('')
+                widths.append(0)
+            continue
+
+        line_start, line_width = 0, 0
+        for i, word in enumerate(words):
+            word_width = measure(word)
+            if i == line_start:
+                line_width = word_width
+            elif line_width + space_width + word_width > limit:
+                lines.append(' '.join(words[line_start:i]))
+                widths.append(line_width)
+                line_start, line_width = i, word_width
+            else:
+                line_width += space_width + word_width
+        lines.append(' '.join(words[line_start:]))
+        widths.append(line_width)
+
+    return TextLayout(tuple(lines), tuple(widths), max_width, size)
+
+
+def cache_stats():
+    return {name: func.cache_info()._asdict() for name, func in
+            (('fonts', load_font), ('word_widths', text_width), ('layouts', layout_text), ('fits', fit_text))}